@@ -0,0 +1,78 @@
+""" Time building calibration curves and recalibrating, the old per column binned_statistic/interp1d loop against pippin.calibration.
+
+Uses random predictions for a number of classifiers, and recalibrates a number of versions against the same curve file.
+
+    python benchmarks/bench_calibration.py --num_rows 200000 --num_classifiers 30 --num_versions 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.interpolate import interp1d
+from scipy.stats import binned_statistic
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pippin import calibration
+
+
+def legacy_curves(df):
+    bins = calibration.BINS
+    bc = 0.5 * (bins[:-1] + bins[1:])
+    mask = (bc >= 0) & (bc <= 1)
+    result = {"bins": np.concatenate(([0], bc[mask], [1.0]))}
+    truth = df["IA"]
+    for c in [c for c in df.columns if c.startswith("PROB_")]:
+        combined_mask = np.isfinite(truth) & np.isfinite(df[c])
+        actual_prob, _, _ = binned_statistic(df[c][combined_mask], truth[combined_mask].astype(float), bins=bins, statistic="mean")
+        m = np.isfinite(actual_prob)
+        actual_prob[~m] = bc[~m]
+        result[c] = np.clip(np.concatenate(([0], actual_prob[mask], [1.0])), 0, 1)
+    return pd.DataFrame(result)
+
+
+def legacy_recalibrate(df, path):
+    curves = pd.read_csv(path)
+    for c in [c for c in df.columns if c.startswith("PROB_")]:
+        df[c.replace("PROB_", "CPROB_")] = interp1d(curves["bins"], curves[c])(df[c])
+
+
+def new_recalibrate(df, path):
+    calibration.recalibrate(df, calibration.load_calibration_curve(path))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_rows", type=int, default=200000)
+    parser.add_argument("--num_classifiers", type=int, default=30)
+    parser.add_argument("--num_versions", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    truth = rng.integers(0, 2, args.num_rows).astype(float)
+    columns = {"IA": truth}
+    for i in range(args.num_classifiers):
+        columns[f"PROB_{i}"] = np.clip(truth * 0.5 + rng.random(args.num_rows) * 0.5, 0, 1)
+    df = pd.DataFrame(columns)
+
+    for name, method in [("legacy", legacy_curves), ("bincount", calibration.get_calibration_curves)]:
+        start = time.time()
+        curves = method(df)
+        print(f"{name:>10s} curves: {time.time() - start:7.3f}s")
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "calibration.csv")
+        curves.to_csv(path, index=False)
+        for name, method in [("legacy", legacy_recalibrate), ("interp", new_recalibrate)]:
+            start = time.time()
+            for _ in range(args.num_versions):
+                method(df.copy(), path)
+            print(f"{name:>10s} recalibrate {args.num_versions} versions: {time.time() - start:7.3f}s")
+
+
+if __name__ == "__main__":
+    main()
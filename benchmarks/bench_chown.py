@@ -0,0 +1,81 @@
+""" Time fixing group ownership and permissions of a large output tree, old os.walk chown_dir against the new walker.
+
+Creates a synthetic tree shaped like an LCFIT output directory (lots of split job files spread over a few
+directories), using your primary group so no special permissions are needed, and then runs each implementation
+twice: once on a fresh tree where every mode is wrong, and again straight after when nothing needs changing.
+The directories are backdated after creation, as recently modified directories are always rescanned.
+
+    python benchmarks/bench_chown.py --num_files 100000
+"""
+import argparse
+import os
+import stat
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pippin import config
+
+
+def legacy_chown_tree(directory, group_id):
+    """ The body of the old chown_dir """
+    for root, dirs, files in os.walk(directory):
+        for d in dirs:
+            if not os.path.islink(os.path.join(root, d)):
+                os.chown(os.path.join(root, d), -1, group_id, follow_symlinks=False)
+                os.chmod(os.path.join(root, d), 0o770)
+        for f in files:
+            if not os.path.islink(os.path.join(root, f)):
+                os.chown(os.path.join(root, f), -1, group_id, follow_symlinks=False)
+                os.chmod(os.path.join(root, f), 0o660)
+
+
+def build_tree(base_dir, num_files, files_per_dir):
+    num_dirs = max(1, num_files // files_per_dir)
+    for i in range(num_dirs):
+        d = os.path.join(base_dir, "output", f"SPLIT_JOB_{i:04d}")
+        os.makedirs(d, mode=0o755)
+        for j in range(files_per_dir):
+            path = os.path.join(d, f"FIT_{j:05d}.LOG")
+            with open(path, "w"):
+                pass
+            os.chmod(path, 0o644)
+    for root, dirs, files in os.walk(base_dir):
+        os.utime(root, (1e9, 1e9))
+
+
+def check_tree(base_dir):
+    for root, dirs, files in os.walk(base_dir):
+        for f in files:
+            assert stat.S_IMODE(os.stat(os.path.join(root, f)).st_mode) == 0o660
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_files", type=int, default=100000)
+    parser.add_argument("--files_per_dir", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    group_id = os.getgid()
+    methods = [
+        ("legacy os.walk", lambda d: legacy_chown_tree(d, group_id)),
+        ("scandir + threads", lambda d: config._chown_tree(d, group_id, max_workers=args.workers, skip_unchanged=False)),
+        ("+ skip unchanged", lambda d: config._chown_tree(d, group_id, max_workers=args.workers, skip_unchanged=True)),
+    ]
+    for name, method in methods:
+        with tempfile.TemporaryDirectory() as base_dir:
+            build_tree(base_dir, args.num_files, args.files_per_dir)
+            times = []
+            for _ in range(2):
+                start = time.time()
+                method(base_dir)
+                times.append(time.time() - start)
+            check_tree(base_dir)
+        print(f"{name:>18s}: first pass {times[0]:7.3f}s, second pass {times[1]:7.3f}s")
+
+
+if __name__ == "__main__":
+    main()
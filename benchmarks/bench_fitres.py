@@ -0,0 +1,54 @@
+""" Time loading a large FITRES file: parsing the text every time against the cached binary sidecar.
+
+    python benchmarks/bench_fitres.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pippin.io.fitres import load_fitres
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--columns", type=int, default=60)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "FITOPT000.FITRES")
+        df = pd.DataFrame({"CID": np.arange(args.rows), "TYPE": rng.choice([1, 20, 101], size=args.rows)})
+        for i in range(args.columns - 2):
+            df[f"COL{i}"] = rng.random(args.rows)
+        df.insert(0, "VARNAMES:", "SN:")
+        df.to_csv(path, sep=" ", index=False, float_format="%0.5f")
+        print(f"{args.rows} rows, {args.columns} columns, {os.path.getsize(path) / 1024 ** 2:0.0f} MB of text")
+
+        start = time.time()
+        text = pd.read_csv(path, sep=r"\s+", comment="#")
+        print(f"          parse text: {time.time() - start:7.3f}s")
+
+        start = time.time()
+        load_fitres(path)
+        print(f"  parse, write cache: {time.time() - start:7.3f}s")
+
+        start = time.time()
+        cached = load_fitres(path)
+        print(f"    cached, all cols: {time.time() - start:7.3f}s")
+
+        start = time.time()
+        load_fitres(path, columns=["CID", "TYPE"])
+        print(f"      cached, 2 cols: {time.time() - start:7.3f}s")
+        pd.testing.assert_frame_equal(text, cached)
+
+
+if __name__ == "__main__":
+    main()
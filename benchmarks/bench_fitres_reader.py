@@ -0,0 +1,86 @@
+""" Time parsing FITRES and prediction text files with read_fitres against the read_csv calls it replaced.
+
+Covers a full read, reading only the columns a task needs, float32 conversion, chunked iteration, a gzipped file,
+and the aggregator's prediction file loading (which used to parse whitespace files twice).
+
+    python benchmarks/bench_fitres_reader.py --rows 1000000
+"""
+import argparse
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pippin.io.fitres import read_fitres, is_fitres_format, get_fitres_columns
+
+warnings.simplefilter("ignore", FutureWarning)
+
+
+def legacy_load_prediction_file(filename):
+    df = pd.read_csv(filename, comment="#")
+    columns = df.columns
+    if len(columns) == 1 and "VARNAME" in columns[0]:
+        df = pd.read_csv(filename, comment="#", delim_whitespace=True)
+    if "VARNAMES:" in df.columns:
+        df = df.drop(columns="VARNAMES:")
+    remove_columns = [c for i, c in enumerate(df.columns) if i != 0 and "PROB_" not in c]
+    return df.drop(columns=remove_columns)
+
+
+def load_prediction_file(filename):
+    """ What Aggregator.load_prediction_file does now """
+    names = get_fitres_columns(filename)[1:]
+    assert is_fitres_format(filename)
+    return read_fitres(filename, columns=[c for i, c in enumerate(names) if i == 0 or "PROB_" in c])
+
+
+def timed(name, func):
+    start = time.time()
+    result = func()
+    print(f"  {name:>40s}: {time.time() - start:7.3f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--columns", type=int, default=40)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "FITOPT000.FITRES")
+        df = pd.DataFrame({"CID": np.arange(args.rows), "TYPE": rng.choice([1, 20, 101], size=args.rows)})
+        for i in range(args.columns - 3):
+            df[f"COL{i}"] = rng.random(args.rows)
+        df["PROB_NN"] = rng.random(args.rows)
+        df.insert(0, "VARNAMES:", "SN:")
+        df.to_csv(path, sep=" ", index=False, float_format="%0.5f")
+        with open(path, "rb") as f_in, gzip.open(path + ".gz", "wb", compresslevel=1) as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        print(f"{args.rows} rows, {args.columns} columns, {os.path.getsize(path) / 1024 ** 2:0.0f} MB of text")
+
+        full = timed("read_csv, all columns", lambda: pd.read_csv(path, delim_whitespace=True, comment="#"))
+        fast = timed("read_fitres, all columns", lambda: read_fitres(path))
+        pd.testing.assert_frame_equal(full, fast)
+        timed("read_csv, then take CID TYPE", lambda: pd.read_csv(path, delim_whitespace=True, comment="#")[["CID", "TYPE"]])
+        timed("read_fitres, CID TYPE", lambda: read_fitres(path, columns=["CID", "TYPE"]))
+        timed("read_fitres, CID as str, float32", lambda: read_fitres(path, dtype={"CID": str}, float32=True))
+        timed("read_fitres, 100k row chunks", lambda: sum(len(c) for c in read_fitres(path, chunksize=100000)))
+        timed("read_csv, gzipped", lambda: pd.read_csv(path + ".gz", delim_whitespace=True, comment="#", compression="infer"))
+        timed("read_fitres, gzipped", lambda: read_fitres(path + ".gz"))
+        old = timed("old load_prediction_file", lambda: legacy_load_prediction_file(path))
+        new = timed("new load_prediction_file", lambda: load_prediction_file(path))
+        pd.testing.assert_frame_equal(old, new)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+""" Time getting SNID and SNTYPE for a photometry directory: the old per task astropy loop against the header index.
+
+Writes a directory of HEAD files shaped like a RANSEED_CHANGE sim version, then reads it as the aggregator and
+perfect classifier used to, and through get_header_index cold (building and saving the index), from the saved
+index (as a new process would) and from memory.
+
+    python benchmarks/bench_header_index.py --num_files 200 --rows 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+from astropy.table import Table
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pippin import photometry
+
+
+def legacy_read(phot_dir):
+    """ The loop the aggregator, perfect and unity classifiers each had """
+    type_df = None
+    headers = [os.path.join(phot_dir, a) for a in os.listdir(phot_dir) if "HEAD" in a]
+    for h in headers:
+        with fits.open(h) as hdul:
+            data = hdul[1].data
+            snid = np.array(data.field("SNID"))
+            sntype = np.array(data.field("SNTYPE")).astype(np.int64)
+            dataframe = pd.DataFrame({"CID": snid, "SNTYPE": sntype})
+            dataframe["CID"] = dataframe["CID"].apply(str)
+            dataframe["CID"] = dataframe["CID"].str.strip()
+            type_df = dataframe if type_df is None else pd.concat([type_df, dataframe])
+        type_df.drop_duplicates(subset="CID", inplace=True)
+    return type_df
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_files", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as phot_dir:
+        for i in range(args.num_files):
+            snid = np.arange(i * args.rows, (i + 1) * args.rows).astype("U12")
+            columns = {"SNID": snid, "SNTYPE": rng.choice([1, 20, 21, 101], size=args.rows)}
+            for extra in ["RA", "DEC", "REDSHIFT_FINAL", "PEAKMJD", "SIM_REDSHIFT_CMB", "SIM_DLMU", "SIM_SALT2x1", "SIM_SALT2c"]:
+                columns[extra] = rng.random(args.rows)
+            Table(columns).write(os.path.join(phot_dir, f"SIM_{i:04d}_HEAD.FITS.gz"))
+
+        start = time.time()
+        legacy = legacy_read(phot_dir)
+        legacy_time = time.time() - start
+
+        photometry.clear()
+        times = []
+        for clear_memory in [False, True, False]:
+            if clear_memory:
+                photometry.clear()
+            start = time.time()
+            index = photometry.get_header_index(phot_dir)
+            times.append(time.time() - start)
+
+        assert set(legacy["CID"]) == set(index["SNID"])
+        print(f"{args.num_files} HEAD files, {len(index)} objects")
+        print(f"     legacy astropy loop: {legacy_time:7.3f}s")
+        print(f"  index, build and save: {times[0]:7.3f}s")
+        print(f"   index, from npz file: {times[1]:7.3f}s")
+        print(f"     index, from memory: {times[2]:7.3f}s")
+
+
+if __name__ == "__main__":
+    main()
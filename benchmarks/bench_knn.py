@@ -0,0 +1,70 @@
+""" Accuracy against throughput for the nearest neighbour classifier's algorithms.
+
+Trains each algorithm on a synthetic training sample shaped like the SALT2 features (a few correlated features whose
+distribution shifts with type), then predicts a separate sample. Reports fit and predict times, predictions per
+second, accuracy, and the mean absolute difference of the probabilities from kd_tree, which is exact.
+
+    python benchmarks/bench_knn.py --num_train 500000 --num_predict 100000 --n_jobs 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pippin.classifiers import nearest_neighbor_code
+
+
+def get_sample(num, num_features, rng):
+    is_ia = rng.random(num) < 0.5
+    X = rng.normal(size=(num, num_features)) + np.outer(is_ia, np.linspace(1, 0.1, num_features))
+    X[:, 1:] += 0.5 * X[:, :1]
+    return X, is_ia
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_train", type=int, default=500000)
+    parser.add_argument("--num_predict", type=int, default=100000)
+    parser.add_argument("--num_features", type=int, default=9)
+    parser.add_argument("--n_jobs", type=int, default=4)
+    parser.add_argument("--chunk_size", type=int, default=10000)
+    parser.add_argument("--algorithms", nargs="+", default=nearest_neighbor_code.ALGORITHMS)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    X_train, y_train = get_sample(args.num_train, args.num_features, rng)
+    X_test, y_test = get_sample(args.num_predict, args.num_features, rng)
+
+    exact = None
+    algorithms = sorted(args.algorithms, key=lambda a: a != "kd_tree")
+    for algorithm in algorithms:
+        for float32 in [False, True]:
+            dtype = np.float32 if float32 else np.float64
+            knn = nearest_neighbor_code.get_neighbours_classifier(algorithm, 50)
+            clf = Pipeline([("scaler", StandardScaler()), ("knn", knn)])
+            start = time.time()
+            clf.fit(X_train.astype(dtype), y_train)
+            fit_time = time.time() - start
+
+            start = time.time()
+            prob = nearest_neighbor_code.predict_proba(clf, X_test.astype(dtype), args.chunk_size, args.n_jobs)
+            predict_time = time.time() - start
+
+            if exact is None:
+                exact = prob
+            accuracy = np.mean((prob > 0.5) == y_test)
+            name = f"{algorithm}{' float32' if float32 else ''}"
+            print(
+                f"{name:>18s}: fit {fit_time:7.2f}s, predict {predict_time:7.2f}s ({args.num_predict / predict_time:9.0f}/s), "
+                f"accuracy {accuracy:0.4f}, mean |p - exact| {np.abs(prob - exact).mean():0.4f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+""" How long a predict job takes to load a saved nearest neighbour model, against refitting it from the training points.
+
+Trains on a synthetic sample, saves the model with save_model, then times load_model and a first small prediction in a
+fresh process, like a predict job. The page cache is warm after saving, as it would be for jobs after the first on a node.
+
+    python benchmarks/bench_knn_load.py --num_train 10000000 --algorithms kd_tree approx
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pippin.classifiers import nearest_neighbor_code
+from bench_knn import get_sample
+
+LOAD_SCRIPT = """
+import sys, time
+import numpy as np
+from pippin.classifiers import nearest_neighbor_code
+start = time.time()
+clf = nearest_neighbor_code.load_model(sys.argv[1])
+loaded = time.time()
+clf.predict_proba(np.random.default_rng(1).normal(size=(1000, int(sys.argv[2]))))
+print(loaded - start, time.time() - loaded)
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_train", type=int, default=10000000)
+    parser.add_argument("--num_features", type=int, default=9)
+    parser.add_argument("--algorithms", nargs="+", default=nearest_neighbor_code.ALGORITHMS)
+    args = parser.parse_args()
+
+    X, y = get_sample(args.num_train, args.num_features, np.random.default_rng(0))
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    env = dict(os.environ, PYTHONPATH=root)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for algorithm in args.algorithms:
+            clf = Pipeline([("scaler", StandardScaler()), ("knn", nearest_neighbor_code.get_neighbours_classifier(algorithm, 50))])
+            start = time.time()
+            clf.fit(X, y)
+            fit_time = time.time() - start
+
+            path = os.path.join(temp_dir, algorithm)
+            model_args = argparse.Namespace(algorithm=algorithm, n_neighbors=50, n_trees=10)
+            nearest_neighbor_code.save_model(path, clf, model_args)
+            output = subprocess.check_output([sys.executable, "-c", LOAD_SCRIPT, path, str(args.num_features)], env=env, text=True)
+            load_time, predict_time = [float(v) for v in output.split()]
+            print(
+                f"{algorithm:>10s} on {args.num_train} rows: fit (what loading used to cost) {fit_time:7.2f}s, "
+                f"load {load_time:6.2f}s, first 1000 predictions {predict_time:6.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+""" Time joining many classifiers' predictions on CID, chained outer merges against one shared factorised key.
+
+    python benchmarks/bench_prediction_join.py --classifiers 12 --rows 500000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pippin.aggregator import join_predictions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--classifiers", type=int, default=12)
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    dataframes = []
+    for i in range(args.classifiers):
+        # Most classifiers see the same candidates, with a few dropped or extra per classifier
+        cids = rng.choice(int(args.rows * 1.05), size=args.rows, replace=False).astype(str)
+        dataframes.append(pd.DataFrame({"CID": cids, f"PROB_C{i}": rng.random(args.rows)}))
+
+    start = time.time()
+    legacy = dataframes[0]
+    for dataframe in dataframes[1:]:
+        legacy = pd.merge(legacy, dataframe, on="CID", how="outer")
+    legacy_time = time.time() - start
+
+    start = time.time()
+    joined = join_predictions(dataframes, "CID")
+    join_time = time.time() - start
+
+    pd.testing.assert_frame_equal(legacy.reset_index(drop=True), joined.reset_index(drop=True))
+    print(f"{args.classifiers} classifiers, {args.rows} rows each, {len(joined)} rows joined")
+    print(f"     chained merge: {legacy_time:7.3f}s")
+    print(f"  factorised join:{join_time:7.3f}s  ({legacy_time / join_time:0.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
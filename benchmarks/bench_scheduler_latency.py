@@ -0,0 +1,127 @@
+""" Measure how long a dependent task waits to be launched after its dependency finishes.
+
+Builds a synthetic DAG of tasks which "finish" by writing their done file from a timer thread,
+and runs it through the Manager main loop twice: once sleeping between pings, and once in
+event driven mode where the done file watcher wakes the manager up.
+
+    python benchmarks/bench_scheduler_latency.py --width 10 --depth 3
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pippin.config import get_config
+from pippin.manager import Manager
+from pippin.queue_snapshot import QueueSnapshot
+from pippin.task import Task
+
+
+class SleepTask(Task):
+    def __init__(self, name, output_dir, duration, dependencies=None):
+        super().__init__(name, output_dir, dependencies=dependencies)
+        self.duration = duration
+        self.launched = None
+        self.finished = None
+
+    def _run(self, force_refresh):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.launched = time.time()
+        threading.Timer(self.duration, self._finish).start()
+        return True
+
+    def _finish(self):
+        self.finished = time.time()
+        with open(self.done_file, "w") as f:
+            f.write("SUCCESS")
+
+    def _check_completion(self, squeue):
+        if os.path.exists(self.done_file):
+            return Task.FINISHED_SUCCESS
+        return self.num_jobs
+
+    @staticmethod
+    def get_tasks(config, prior_tasks, base_output_dir, stage_number, prefix, global_config):
+        return []
+
+
+class QuietMessageStore:
+    def get_warnings(self):
+        return []
+
+    def get_errors(self):
+        return []
+
+
+class SyntheticManager(Manager):
+    def __init__(self, tasks, output_dir, config_path):
+        super().__init__("BENCH", config_path, {}, QuietMessageStore())
+        self.synthetic_tasks = tasks
+        self.output_dir = output_dir
+
+    def get_tasks(self, config):
+        return list(self.synthetic_tasks)
+
+    def get_squeue(self):
+        return QueueSnapshot([])
+
+
+def build_dag(base_dir, width, depth, seed):
+    rng = random.Random(seed)
+    tasks = []
+    for w in range(width):
+        previous = None
+        for d in range(depth):
+            deps = [] if previous is None else [previous]
+            t = SleepTask(f"T{w}_{d}", os.path.join(base_dir, f"T{w}_{d}"), rng.uniform(0.5, 3.0), dependencies=deps)
+            tasks.append(t)
+            previous = t
+    return tasks
+
+
+def run(event_driven, args, config_path):
+    with tempfile.TemporaryDirectory() as base_dir:
+        tasks = build_dag(base_dir, args.width, args.depth, args.seed)
+        manager = SyntheticManager(tasks, base_dir, config_path)
+        manager.event_driven = event_driven
+        manager.global_config["OUTPUT"]["ping_frequency"] = args.ping
+        manager.global_config["OUTPUT"]["max_ping_frequency"] = args.max_ping
+        start = time.time()
+        manager.execute(False)
+        makespan = time.time() - start
+        latencies = [t.launched - max(d.finished for d in t.dependencies) for t in tasks if t.dependencies]
+    return makespan, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=10, help="Number of independent chains")
+    parser.add_argument("--depth", type=int, default=3, help="Number of tasks in each chain")
+    parser.add_argument("--ping", type=float, default=2, help="Starting ping frequency in seconds")
+    parser.add_argument("--max_ping", type=float, default=10, help="Max ping frequency in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    logging.Logger.notice = logging.Logger.info  # Normally added by run.py
+    config_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "../tests/config_files/cfg_dev.yml"))
+    get_config(initial_path=config_path)
+
+    for event_driven in [False, True]:
+        makespan, latencies = run(event_driven, args, config_path)
+        latencies = sorted(latencies)
+        mode = "event driven" if event_driven else "sleep and poll"
+        print(
+            f"{mode:>15s}: makespan {makespan:6.2f}s, completion -> dependent launch latency "
+            f"mean {sum(latencies) / len(latencies):6.3f}s, median {latencies[len(latencies) // 2]:6.3f}s, max {latencies[-1]:6.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
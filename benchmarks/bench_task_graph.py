@@ -0,0 +1,145 @@
+""" Compare the old list based scheduling in the Manager against the TaskGraph ready queue.
+
+Builds a synthetic pipeline shaped like a large RANSEED_CHANGE run (sims -> fits -> classifiers -> aggregators
+-> mergers -> biascor -> create_cov -> cosmomc), then schedules every task with no job limits, finishing
+running tasks one at a time and failing a small fraction of them so blocking gets exercised too.
+
+    python benchmarks/bench_task_graph.py --num_tasks 10000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pippin.dag import TaskGraph
+
+
+class FakeTask:
+    def __init__(self, name, dependencies):
+        self.name = name
+        self.dependencies = dependencies
+        self.gpu = False
+        self.num_jobs = 1
+
+    def __repr__(self):
+        return self.name
+
+
+def build_tasks(num_tasks, seed):
+    """ Fans out from the sims and back in at the aggregation stages, in the same proportions as a big classifier run """
+    rng = random.Random(seed)
+    fractions = [("SIM", 0.05), ("LCFIT", 0.05), ("CLASSIFY", 0.40), ("AGGREGATE", 0.10), ("MERGE", 0.10), ("BIASCOR", 0.05), ("CREATE_COV", 0.15)]
+    tasks = []
+    previous = []
+    for stage, fraction in fractions:
+        layer = []
+        for i in range(max(1, int(num_tasks * fraction))):
+            deps = rng.sample(previous, min(len(previous), rng.randint(1, 3))) if previous else []
+            layer.append(FakeTask(f"{stage}_{i}", deps))
+        tasks += layer
+        previous = layer
+    while len(tasks) < num_tasks:
+        tasks.append(FakeTask(f"COSMOMC_{len(tasks)}", [rng.choice(previous)]))
+    return tasks
+
+
+def legacy_schedule(tasks, failures):
+    """ What the Manager used to do: rescan the waiting list, with list membership tests and repeated block passes """
+    tasks = list(tasks)
+    done, failed, blocked, running = [], [], [], []
+
+    def get_task_to_run():
+        for t in tasks:
+            can_run = True
+            for dep in t.dependencies:
+                if dep not in done:
+                    can_run = False
+            if can_run:
+                return t
+        return None
+
+    def fail_task(t):
+        failed.append(t)
+        modified = True
+        while modified:
+            modified = False
+            for t2 in tasks:
+                for d in t2.dependencies:
+                    if d in failed or d in blocked:
+                        tasks.remove(t2)
+                        blocked.append(t2)
+                        modified = True
+                        break
+
+    while tasks or running:
+        while True:
+            t = get_task_to_run()
+            if t is None:
+                break
+            tasks.remove(t)
+            running.append(t)
+        if running:
+            t = running.pop(0)
+            if t.name in failures:
+                fail_task(t)
+            else:
+                done.append(t)
+    return len(done), len(failed), len(blocked)
+
+
+def graph_schedule(tasks, failures):
+    graph = TaskGraph(tasks)
+    done, failed, blocked, running = [], [], [], []
+    while graph or running:
+        while True:
+            t = graph.pop_ready()
+            if t is None:
+                break
+            running.append(t)
+        if running:
+            t = running.pop(0)
+            if t.name in failures:
+                failed.append(t)
+                blocked += graph.block(t)
+            else:
+                done.append(t)
+                graph.mark_done(t)
+    return len(done), len(failed), len(blocked)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_tasks", type=int, default=10000)
+    parser.add_argument("--fail_fraction", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--legacy_max", type=int, default=2000, help="Largest size to time the old scheduler at, it is cubic")
+    args = parser.parse_args()
+
+    tasks = build_tasks(args.num_tasks, args.seed)
+    rng = random.Random(args.seed)
+    failures = set(t.name for t in rng.sample(tasks, int(len(tasks) * args.fail_fraction)))
+    print(f"{len(tasks)} tasks, {len(failures)} set to fail")
+
+    start = time.time()
+    result = graph_schedule(tasks, failures)
+    print(f"  task graph: {time.time() - start:8.3f}s  (done, failed, blocked) = {result}")
+
+    # Time the old approach on a subset small enough to finish, and check both agree on what happens
+    legacy_tasks = tasks[: args.legacy_max]
+    names = set(t.name for t in legacy_tasks)
+    legacy_tasks = [t for t in legacy_tasks if all(d.name in names for d in t.dependencies)]
+    print(f"On the first {len(legacy_tasks)} tasks:")
+    results = []
+    for name, method in [("legacy lists", legacy_schedule), ("task graph", graph_schedule)]:
+        start = time.time()
+        result = method(legacy_tasks, failures)
+        print(f"{name:>12s}: {time.time() - start:8.3f}s  (done, failed, blocked) = {result}")
+        results.append(result)
+    assert results[0] == results[1], "Schedulers disagree on the outcome"
+
+
+if __name__ == "__main__":
+    main()
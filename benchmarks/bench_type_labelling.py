@@ -0,0 +1,47 @@
+""" Time labelling a merged prediction table as Ia / non-Ia / unknown, per row lambda against TypeLookup.
+
+    python benchmarks/bench_type_labelling.py --rows 5000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from pippin.sntypes import TypeLookup
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    types = {"IA": [1, 101], "NONIA": [2, 20, 21, 22, 29, 30, 31, 32, 33, 39, 40, 41, 42, 42, 43, 80, 81]}
+    rng = np.random.default_rng(args.seed)
+    choices = np.array(types["IA"] + types["NONIA"] + [99], dtype=np.float64)
+    sntype = rng.choice(choices, size=args.rows)
+    sntype[rng.random(args.rows) < 0.05] = np.nan  # Candidates with no match in the photometry after the left merge
+    df = pd.DataFrame({"CID": np.arange(args.rows).astype(str), "SNTYPE": sntype, "PROB_A": rng.random(args.rows)})
+
+    start = time.time()
+    legacy = df["SNTYPE"].apply(lambda y: 1.0 if y in types["IA"] else (0.0 if y in types["NONIA"] else np.nan))
+    legacy_time = time.time() - start
+
+    start = time.time()
+    lookup = TypeLookup(types)
+    vectorised = lookup.label(df["SNTYPE"])
+    vectorised_time = time.time() - start
+
+    assert np.array_equal(legacy.to_numpy(), vectorised, equal_nan=True), "Labels differ"
+    print(f"{args.rows} rows")
+    print(f"  per row lambda: {legacy_time:7.3f}s")
+    print(f"      TypeLookup: {vectorised_time:7.3f}s  ({legacy_time / vectorised_time:0.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
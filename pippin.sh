@@ -1,3 +1,8 @@
 #!/usr/bin/env bash
 DIR="$(cd "$(dirname "$0")" && pwd)"
-python -c "import sys; assert sys.version_info >= (3, 6), 'Sorry, you need python 3.6. If youre on midway, there is a conda env at $PRODUCTS/miniconda for you to use'" && python $DIR/run.py "$@"
\ No newline at end of file
+python -c "import sys; assert sys.version_info >= (3, 6), 'Sorry, you need python 3.6. If youre on midway, there is a conda env at $PRODUCTS/miniconda for you to use'" || exit 1
+if [ "$1" == "cache" ]; then
+    PYTHONPATH="$DIR:$PYTHONPATH" python -m pippin.cache "${@:2}"
+else
+    python $DIR/run.py "$@"
+fi
@@ -1,23 +1,104 @@
 import inspect
+import logging
 import shutil
 import subprocess
 
-from scipy.interpolate import interp1d
-from scipy.ndimage import gaussian_filter
-from scipy.stats import binned_statistic
-
+from pippin.calibration import get_calibration_curves, load_calibration_curve, recalibrate
 from pippin.classifiers.classifier import Classifier
 from pippin.config import mkdirs, get_output_loc
 from pippin.dataprep import DataPrep
+from pippin.executor import get_process_pool
+from pippin.io.fitres import is_fitres_format, get_fitres_columns, read_fitres
+from pippin.photometry import get_header_index
 from pippin.snana_fit import SNANALightCurveFit
 from pippin.snana_sim import SNANASimulation
 from pippin.task import Task
 import pandas as pd
 import os
-from astropy.io import fits
 import numpy as np
 
 
+def _outer_merge_sorts():
+    """ Pandas 2.2 started sorting the keys of outer merges, earlier versions keep the order they first appear in """
+    left = pd.DataFrame({"k": ["b"], "x": [1]})
+    right = pd.DataFrame({"k": ["a"], "y": [1]})
+    return list(pd.merge(left, right, on="k", how="outer")["k"]) == ["a", "b"]
+
+
+OUTER_MERGE_SORTS = _outer_merge_sorts()
+
+
+def join_predictions(dataframes, key):
+    """ Outer joins the prediction dataframes on the key column, giving the same result as chaining pd.merge(how="outer").
+
+    Rather than merging one at a time, which copies the growing frame k times, the keys of every file are factorised
+    once into a shared int64 code and each probability column is scattered straight into its place in the output.
+    The keys must already be normalised strings. If a key is duplicated, a column name clashes (where merge would
+    produce cartesian products or _x/_y suffixes) or a column isn't float we fall back to chaining merges.
+
+    :param dataframes: list of dataframes, each with the key column
+    :param key: name of the column to join on
+    :return: the joined dataframe, with the key as the first column
+    """
+    if len(dataframes) == 1:
+        return dataframes[0]
+    columns = [c for d in dataframes for c in d.columns if c != key]
+    if (
+        len(columns) != len(set(columns))
+        or any(d[key].duplicated().any() for d in dataframes)
+        or not all(pd.api.types.is_float_dtype(d[c]) for d in dataframes for c in d.columns if c != key)
+    ):
+        df = dataframes[0]
+        for dataframe in dataframes[1:]:
+            df = pd.merge(df, dataframe, on=key, how="outer")
+        return df
+
+    all_keys = np.concatenate([d[key].to_numpy(dtype=object) for d in dataframes])
+    codes, uniques = pd.factorize(all_keys, sort=OUTER_MERGE_SORTS)
+    result = {key: uniques}
+    start = 0
+    for d in dataframes:
+        rows = codes[start : start + len(d)]
+        start += len(d)
+        for c in d.columns:
+            if c == key:
+                continue
+            values = np.full(len(uniques), np.nan, dtype=d[c].dtype)
+            values[rows] = d[c].to_numpy()
+            result[c] = values
+    return pd.DataFrame(result)
+
+
+class _RecordCollector(logging.Handler):
+    """ Keeps the log messages of a worker process, so the manager can log them in the main process """
+
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(logging.Formatter("%(message)s"))
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, self.format(record)))
+
+
+def _aggregate_version(aggregator, job):
+    """ Runs in a worker process, aggregating a single version and returning whether it worked and its log messages """
+    collector = _RecordCollector()
+    logger = logging.getLogger(f"pippin.aggregator.{job['index']}")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.addHandler(collector)
+    aggregator.logger = logger
+    try:
+        success = aggregator.aggregate_version(job)
+    except Exception as e:
+        logger.exception(f"Aggregating version {job['index']} failed: {e}")
+        success = False
+    finally:
+        logger.removeHandler(collector)
+    return success, collector.records
+
+
 class Aggregator(Task):
     """ Merge fitres files and aggregator output
 
@@ -32,6 +113,7 @@ class Aggregator(Task):
         OPTS:
           PLOT: True  # Whether or not to generate the PR curve, ROC curve, reliability plot, etc. Can specify a PYTHON FILE WHICH GETS INVOKED
           PLOT_ALL: False # If you use RANSEED_CHANGE, should we plot for all versions. Defaults to no.
+          MAX_WORKERS: 4 # Versions to aggregate at once outside the manager. Under it, EXECUTOR: worker_processes bounds all tasks
           # PLOT: True will default to external/aggregator_plot.py, copy that for customisation
 
     OUTPUTS:
@@ -51,7 +133,6 @@ class Aggregator(Task):
 
     def __init__(self, name, output_dir, dependencies, options, recal_aggtask):
         super().__init__(name, output_dir, dependencies=dependencies)
-        self.passed = False
         self.classifiers = [d for d in dependencies if isinstance(d, Classifier)]
         self.lcfit_deps = [c.get_fit_dependency(output=False) for c in self.classifiers]
         self.lcfit_names = list(set([l.output["name"] for l in self.lcfit_deps if l is not None]))
@@ -75,6 +156,10 @@ class Aggregator(Task):
         self.include_type = bool(options.get("INCLUDE_TYPE", False))
         self.plot = options.get("PLOT", True)
         self.plot_all = options.get("PLOT_ALL", False)
+        self.max_workers = max(1, min(int(options.get("MAX_WORKERS", 4)), self.num_versions))
+        self.pool = None
+        self.futures = None
+        self.new_hash = None
         self.output["classifiers"] = self.classifiers
         self.output["calibration_files"] = self.output_cals
         if isinstance(self.plot, bool):
@@ -86,8 +171,56 @@ class Aggregator(Task):
         if not os.path.exists(self.python_file):
             Task.fail_config(f"Attempting to find python file {self.python_file} but it's not there!")
 
+    # All a worker needs besides its job from get_version_job, rather than the task graph, state store and whatever else the manager holds
+    worker_attributes = [
+        "name", "id", "type_name", "output_dir", "output_dfs", "output_dfs_key", "output_cals", "lcfit_names", "plot", "plot_all", "python_file"
+    ]
+
+    def __getstate__(self):
+        return {key: self.__dict__[key] for key in self.worker_attributes}
+
     def _check_completion(self, squeue):
-        return Task.FINISHED_SUCCESS if self.passed else Task.FINISHED_FAILURE
+        if self.futures is None:
+            # Hash check passed, nothing was run this time
+            if os.path.exists(self.done_file):
+                with open(self.done_file) as f:
+                    if "FAILURE" in f.read().upper():
+                        return Task.FINISHED_FAILURE
+                return Task.FINISHED_SUCCESS
+            self.logger.error(f"Aggregation {self.name} was not run, but there is no done file at {self.done_file}")
+            return Task.FINISHED_FAILURE
+        num_running = sum(not f.done() for f in self.futures)
+        if num_running:
+            return num_running
+
+        passed = True
+        for index, future in enumerate(self.futures):
+            if future.exception() is not None:
+                self.logger.error(f"Worker aggregating version {index} crashed: {future.exception()}")
+                passed = False
+                continue
+            success, records = future.result()
+            for level, message in records:
+                self.logger.log(level, message)
+            passed = passed and success
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        self.futures = None
+        if passed:
+            # Only now is the output complete, so a manager dying mid-aggregation leaves the hash unsaved and it reruns.
+            # Saved here rather than in _version_finished, as the state store can only be used from the manager's thread.
+            self.save_new_hash(self.new_hash)
+        return Task.FINISHED_SUCCESS if passed else Task.FINISHED_FAILURE
+
+    def _version_finished(self, future):
+        """ Called in the manager process as each version finishes. Writing the done file wakes up the manager. """
+        futures = self.futures
+        if futures is None or not all(f.done() for f in futures):
+            return
+        success = all(f.exception() is None and f.result()[0] for f in futures)
+        with open(self.done_file, "w") as f:
+            f.write("SUCCESS" if success else "FAILURE")
 
     def check_regenerate(self, force_refresh):
         new_hash = self.get_hash_from_string(self.name + str(self.include_type) + str(self.plot))
@@ -96,6 +229,9 @@ class Aggregator(Task):
         if new_hash != old_hash:
             self.logger.info("Hash check failed, regenerating")
             return new_hash
+        elif not os.path.exists(self.done_file):
+            self.logger.info("Hash check passed but there is no done file, so the last run didn't finish. Regenerating")
+            return new_hash
         elif force_refresh:
             self.logger.debug("Force refresh deteted")
             return new_hash
@@ -118,226 +254,150 @@ class Aggregator(Task):
         return None
 
     def load_prediction_file(self, filename):
+        """ Loads the id column (whatever it is called) and the PROB_ columns from a csv or FITRES format prediction file """
+        if is_fitres_format(filename):
+            names = get_fitres_columns(filename)[1:]
+            columns = [c for i, c in enumerate(names) if i == 0 or "PROB_" in c]
+            return read_fitres(filename, columns=columns)
         df = pd.read_csv(filename, comment="#")
-        columns = df.columns
-        if len(columns) == 1 and "VARNAME" in columns[0]:
-            df = pd.read_csv(filename, comment="#", delim_whitespace=True)
-        if "VARNAMES:" in df.columns:
-            df = df.drop(columns="VARNAMES:")
         remove_columns = [c for i, c in enumerate(df.columns) if i != 0 and "PROB_" not in c]
         df = df.drop(columns=remove_columns)
         return df
 
     def save_calibration_curve(self, df, output_name):
-
         self.logger.debug("Creating calibration curves")
-
-        # First let us define some prob bins
-        bins = np.linspace(-1, 2, 61)  # Yes, outside normal range, so if we smooth it we dont screw things up with edge effects
-        bc = 0.5 * (bins[:-1] + bins[1:])
-        mask = (bc >= 0) & (bc <= 1)
-        bc3 = bc[mask]  # Dont bother saving out the negative probs
-        bc4 = np.concatenate(([0], bc3, [1.0]))  # For them bounds
-
-        truth = df["IA"]
-        truth_mask = np.isfinite(truth)
-        cols = [c for c in df.columns if c.startswith("PROB_")]
-        result = {"bins": bc4}
-        for c in cols:
-            data = df[c]
-
-            if data.isnull().sum() == data.size or truth.isnull().sum() == truth.size:
-                self.logger.warning(
-                    "Unable to create calibration curves. This is expected if the calibration source is data (unknown types) or a sim of only Ia or CC (where you have only one type)."
-                )
-                if data.isnull().sum() == data.size:
-                    self.logger.error(f"prob column {c} is all NaN")
-                if truth.isnull().sum() == truth.size:
-                    self.logger.error(f"truth values are all NaN")
-                continue
-
-            # Remove NaNs
-            data_mask = np.isfinite(data)
-            combined_mask = truth_mask & data_mask
-            if combined_mask.sum() < 100:
-                if combined_mask.sum() == 0:
-                    self.logger.warning("There are no events which have both a prob and a known Ia/CC flag")
-                else:
-                    self.logger.warning("There are too few events with both a prob and known Ia/CC flag")
-                continue
-
-            data2 = data[combined_mask]
-            truth2 = truth[combined_mask].astype(np.float)
-
-            actual_prob, _, _ = binned_statistic(data2, truth2, bins=bins, statistic="mean")
-            m = np.isfinite(actual_prob)  # All the -1 to 0 and 1 to 2 probs will be NaN
-
-            # Sets a 1:1 line outside of 0 to 1
-            actual_prob2 = actual_prob.copy()
-            actual_prob2[~m] = bc[~m]
-
-            # Optional Gaussian filter. Turning this off but I'll keep the code in, in case we want to play around later with changing sigma
-            actual_prob3 = gaussian_filter(actual_prob2, sigma=0)[mask]
-
-            # Lets make sure out bounds are correct and all prob values are good. The last two lines will only do anything if sigma>0
-            actual_prob4 = np.concatenate(([0], actual_prob3, [1.0]))
-            actual_prob4[actual_prob4 < 0] = 0
-            actual_prob4[actual_prob4 > 1] = 1
-            result[c] = actual_prob4
-
-        result_df = pd.DataFrame(result)
+        result_df = get_calibration_curves(df)
         result_df.to_csv(output_name, index=False)
         self.logger.debug(f"Calibration curves output to {output_name}")
 
-    def recalibrate(self, df):
+    def recalibrate(self, df, calibration_file):
         self.logger.debug("Recalibrating!")
-        curves = self.load_calibration_curve()
-        cols = [c for c in df.columns if c.startswith("PROB_")]
-        for c in cols:
-            self.logger.debug(f"Recalibrating column {c}")
-            data = df[c]
-            if c not in curves:
-                self.logger.warning(f"Classifier {c} cannot be recalibrated. If this is because its FITPROB or another fake classifier, all good.")
-                recalibrated = data
-            else:
-                recalibrated = interp1d(curves["bins"], curves[c])(data)
-            df[c.replace("PROB_", "CPROB_")] = recalibrated
+        missing = recalibrate(df, self.load_calibration_curve(calibration_file))
+        for c in missing:
+            self.logger.warning(f"Classifier {c} cannot be recalibrated. If this is because its FITPROB or another fake classifier, all good.")
         self.logger.debug("Returning recalibrated curves. They start with CPROB_, instead of PROB_")
         return df
 
-    def load_calibration_curve(self):
+    def get_calibration_file(self):
         path = self.recal_aggtask.output["calibration_files"]
         if len(path) > 1:
             self.logger.warning(f"Warning, found multiple calibration files, only using first one: {path}")
         assert len(path) != 0, f"No calibration files found for agg task {self.recal_aggtask}"
-        path = path[0]
-
-        df = pd.read_csv(path)
-        self.logger.debug(f"Reading calibration curves from {path}")
-        return df
+        return path[0]
+
+    def load_calibration_curve(self, path):
+        return load_calibration_curve(path)
+
+    def get_version_job(self, index):
+        """ Everything a worker needs from the other tasks to aggregate one version """
+        relevant_classifiers = [c for c in self.classifiers if index in c.indexes]
+        colnames = [d.get_prob_column_name() for d in relevant_classifiers]
+        need_to_rename = len(colnames) != len(set(colnames))
+        if need_to_rename:
+            self.logger.info("Detected duplicate probability column names, will need to rename them")
+        predictions = []
+        for d in relevant_classifiers:
+            l = d.get_fit_dependency()
+            lcname = l["name"] if need_to_rename and l is not None else None
+            predictions.append((d.get_predictions_filename(index), d.get_prob_column_name(), lcname))
+        return {
+            "index": index,
+            "predictions": predictions,
+            "photometry_dir": self.sim_task.output["photometry_dirs"][index],
+            "type_lookup": self.sim_task.output["type_lookup"],
+            "calibration_file": self.get_calibration_file() if self.recal_aggtask else None,
+        }
 
     def _run(self, force_refresh):
         new_hash = self.check_regenerate(force_refresh)
+        self.output["merge_predictions_filename"] = self.output_dfs
+        self.output["merge_key_filename"] = self.output_dfs_key
+        self.output["sn_column_name"] = self.id
+        if self.include_type:
+            self.output["sn_type_name"] = self.type_name
+
         if new_hash:
+            self.clear_hash()
             shutil.rmtree(self.output_dir, ignore_errors=True)
             mkdirs(self.output_dir)
-
-            # Want to loop over each number and grab the relevant IDs and classifiers
-            for index in range(self.num_versions):
-                relevant_classifiers = [c for c in self.classifiers if c.index == index]
-
-                prediction_files = [d.output["predictions_filename"] for d in relevant_classifiers]
-                lcfits = [d.get_fit_dependency() for d in relevant_classifiers]
-
-                df = None
-
-                colnames = [d.get_prob_column_name() for d in relevant_classifiers]
-                need_to_rename = len(colnames) != len(set(colnames))
-                self.logger.info("Detected duplicate probability column names, will need to rename them")
-
-                for f, d, l in zip(prediction_files, relevant_classifiers, lcfits):
-                    dataframe = self.load_prediction_file(f)
-                    dataframe = dataframe.rename(columns={dataframe.columns[0]: self.id})
-                    dataframe[self.id] = dataframe[self.id].apply(str)
-                    dataframe[self.id] = dataframe[self.id].str.strip()
-                    if need_to_rename and l is not None:
-                        lcname = l["name"]
-                        self.logger.debug(f"Renaming column {d.get_prob_column_name()} to include LCFIT name {lcname}")
-                        dataframe = dataframe.rename(columns={d.get_prob_column_name(): d.get_prob_column_name() + "_RENAMED_" + lcname})
-                    self.logger.debug(f"Merging on column {self.id} for file {f}")
-                    if df is None:
-                        df = dataframe
-                    else:
-                        df = pd.merge(df, dataframe, on=self.id, how="outer")
-
-                self.logger.info("Finding original types")
-                s = self.get_underlying_sim_task()
-                type_df = None
-                phot_dir = s.output["photometry_dirs"][index]
-                headers = [os.path.join(phot_dir, a) for a in os.listdir(phot_dir) if "HEAD" in a]
-                if len(headers) == 0:
-                    self.logger.warning(f"No HEAD fits files found in {phot_dir}, manually running grep command!")
-
-                    cmd = "grep --exclude-dir=* TYPE * | awk -F ':' '{print $1 $3}'"
-                    self.logger.debug(f"Running command   {cmd}")
-                    process = subprocess.run(cmd, capture_output=True, cwd=phot_dir, shell=True)
-                    output = process.stdout.decode("ascii").split("\n")
-                    output = [x for x in output if x]
-
-                    snid = [x.split()[0].split("_")[1].split(".")[0] for x in output]
-                    snid = [x[1:] if x.startswith("0") else x for x in snid]
-                    sntype = [x.split()[1].strip() for x in output]
-                    type_df = pd.DataFrame({self.id: snid, self.type_name: sntype})
-                    type_df[self.id] = type_df[self.id].apply(str)
-                    type_df[self.id] = type_df[self.id].str.strip()
-                    type_df.drop_duplicates(subset=self.id, inplace=True)
-                else:
-                    for h in headers:
-                        with fits.open(h) as hdul:
-                            data = hdul[1].data
-                            snid = np.array(data.field("SNID"))
-                            sntype = np.array(data.field("SNTYPE")).astype(np.int64)
-                            # self.logger.debug(f"Photometry has fields {hdul[1].columns.names}")
-                            dataframe = pd.DataFrame({self.id: snid, self.type_name: sntype})
-                            dataframe[self.id] = dataframe[self.id].apply(str)
-                            dataframe[self.id] = dataframe[self.id].str.strip()
-                            if type_df is None:
-                                type_df = dataframe
-                            else:
-                                type_df = pd.concat([type_df, dataframe])
-                        type_df.drop_duplicates(subset=self.id, inplace=True)
-                    self.logger.debug(f"Photometric types are {type_df['SNTYPE'].unique()}")
-
-                if type_df is not None:
-                    df = pd.merge(df, type_df, on=self.id, how="left")
-
-                types = self.get_underlying_sim_task().output["types_dict"]
-                has_nonia = len(types.get("NONIA", [])) > 0
-                has_ia = len(types.get("IA", [])) > 0
-                self.logger.debug(f"Input types are {types}")
-                ia = df["SNTYPE"].apply(lambda y: 1.0 if y in types["IA"] else (0.0 if y in types["NONIA"] else np.nan))
-                df["IA"] = ia
-
-                num_ia = (ia == 1.0).sum()
-                num_cc = (ia == 0.0).sum()
-                num_nan = ia.isnull().sum()
-
-                self.logger.info(f"Truth type has {num_ia} Ias, {num_cc} CCs and {num_nan} unknowns")
-
-                sorted_columns = [self.id, "SNTYPE", "IA"] + sorted([c for c in df.columns if c.startswith("PROB_")])
-                df = df.reindex(sorted_columns, axis=1)
-                self.logger.info(f"Merged into dataframe of {df.shape[0]} rows, with columns {list(df.columns)}")
-
-                if has_nonia and has_ia:
-                    self.save_calibration_curve(df, self.output_cals[index])
-                    if self.recal_aggtask:
-                        df = self.recalibrate(df)
-
-                df.to_csv(self.output_dfs[index], index=False, float_format="%0.4f")
-
-                for l in self.lcfit_names:
-                    self.save_key_format(df, index, l)
-                self.logger.debug(f"Saving merged dataframe to {self.output_dfs[index]}")
-                self.save_new_hash(new_hash)
-
-                if self.plot:
-                    if index == 0 or self.plot_all:
-                        return_good = self._plot(index)
-                        if not return_good:
-                            self.logger.error("Plotting did not work correctly! Attempting to continue anyway.")
-                else:
-                    self.logger.debug("Plot not set, skipping plotting section")
+            self.new_hash = new_hash
+
+            # Each version is independent, so aggregate them in separate processes and check on them in _check_completion
+            jobs = [self.get_version_job(index) for index in range(self.num_versions)]
+            self.logger.info(f"Aggregating {self.num_versions} versions in worker processes")
+            pool = self.worker_pool
+            if pool is None:
+                # Not run by the manager, so use a pool of our own and shut it down once the versions are done
+                pool = self.pool = get_process_pool(self.max_workers)
+            self.futures = [pool.submit(_aggregate_version, self, job) for job in jobs]
+            for future in self.futures:
+                future.add_done_callback(self._version_finished)
         else:
             self.should_be_done()
             self.logger.info("Hash check passed, not rerunning")
+        return True
 
-        self.output["merge_predictions_filename"] = self.output_dfs
-        self.output["merge_key_filename"] = self.output_dfs_key
-        self.output["sn_column_name"] = self.id
-        if self.include_type:
-            self.output["sn_type_name"] = self.type_name
-
-        self.passed = True
+    def aggregate_version(self, job):
+        """ Merges the predictions of one version, adds the true types, saves calibration curves and makes plots.
+
+        :param job: dictionary from `get_version_job`
+        :return: true if it worked
+        """
+        index = job["index"]
+        dataframes = []
+        for f, prob_column, lcname in job["predictions"]:
+            dataframe = self.load_prediction_file(f)
+            dataframe = dataframe.rename(columns={dataframe.columns[0]: self.id})
+            dataframe[self.id] = dataframe[self.id].apply(str)
+            dataframe[self.id] = dataframe[self.id].str.strip()
+            if lcname is not None:
+                self.logger.debug(f"Renaming column {prob_column} to include LCFIT name {lcname}")
+                dataframe = dataframe.rename(columns={prob_column: prob_column + "_RENAMED_" + lcname})
+            dataframes.append(dataframe)
+
+        self.logger.debug(f"Merging {len(dataframes)} prediction files on column {self.id}")
+        df = join_predictions(dataframes, self.id)
+
+        self.logger.info("Finding original types")
+        type_df = get_header_index(job["photometry_dir"]).rename(columns={"SNID": self.id, "SNTYPE": self.type_name})
+        self.logger.debug(f"Photometric types are {type_df[self.type_name].unique()}")
+        df = pd.merge(df, type_df, on=self.id, how="left")
+
+        type_lookup = job["type_lookup"]
+        has_nonia = type_lookup.has_nonia()
+        has_ia = type_lookup.has_ia()
+        self.logger.debug(f"Input types are {type_lookup}")
+        ia = pd.Series(type_lookup.label(df["SNTYPE"]), index=df.index)
+        df["IA"] = ia
+
+        num_ia = (ia == 1.0).sum()
+        num_cc = (ia == 0.0).sum()
+        num_nan = ia.isnull().sum()
+
+        self.logger.info(f"Truth type has {num_ia} Ias, {num_cc} CCs and {num_nan} unknowns")
+
+        sorted_columns = [self.id, "SNTYPE", "IA"] + sorted([c for c in df.columns if c.startswith("PROB_")])
+        df = df.reindex(sorted_columns, axis=1)
+        self.logger.info(f"Merged into dataframe of {df.shape[0]} rows, with columns {list(df.columns)}")
+
+        if has_nonia and has_ia:
+            self.save_calibration_curve(df, self.output_cals[index])
+            if job["calibration_file"] is not None:
+                df = self.recalibrate(df, job["calibration_file"])
+
+        df.to_csv(self.output_dfs[index], index=False, float_format="%0.4f")
+
+        for l in self.lcfit_names:
+            self.save_key_format(df, index, l)
+        self.logger.debug(f"Saving merged dataframe to {self.output_dfs[index]}")
+
+        if self.plot:
+            if index == 0 or self.plot_all:
+                return_good = self._plot(index)
+                if not return_good:
+                    self.logger.error("Plotting did not work correctly! Attempting to continue anyway.")
+        else:
+            self.logger.debug("Plot not set, skipping plotting section")
         return True
 
     def save_key_format(self, df, index, lcfitname):
@@ -1,13 +1,12 @@
 import inspect
 import json
 import shutil
-import subprocess
 import os
 from pathlib import Path
 import numpy as np
 
 from pippin.biascor import BiasCor
-from pippin.config import mkdirs, get_config, ensure_list, get_data_loc
+from pippin.config import mkdirs, get_config, ensure_list, get_data_loc, get_pythonpath_export
 from pippin.cosmomc import CosmoMC
 from pippin.snana_fit import SNANALightCurveFit
 from pippin.task import Task
@@ -39,6 +38,8 @@ class AnalyseChains(Task):  # TODO: Define the location of the output so we can
 
     """
 
+    can_run_locally = True
+
     def __init__(self, name, output_dir, options, dependencies=None):
         super().__init__(name, output_dir, dependencies=dependencies)
         self.options = options
@@ -132,6 +133,7 @@ class AnalyseChains(Task):  # TODO: Define the location of the output so we can
 #SBATCH --mem=20GB
 
 cd {output_dir}
+{pythonpath}
 
 """
 
@@ -159,6 +161,9 @@ fi
         self.path_to_codes.append(script_path)
         self.done_files.append(os.path.join(self.output_dir, os.path.basename(script_name).split(".")[0] + ".done"))
 
+    def get_done_files(self):
+        return self.done_files
+
     def _check_completion(self, squeue):
         num_success = 0
         for f in self.done_files:
@@ -240,7 +245,13 @@ fi
             },
         }
 
-        format_dict = {"job_name": self.job_name, "log_file": self.logfile, "output_dir": self.output_dir, "input_yml": input_yml_file}
+        format_dict = {
+            "job_name": self.job_name,
+            "log_file": self.logfile,
+            "output_dir": self.output_dir,
+            "input_yml": input_yml_file,
+            "pythonpath": get_pythonpath_export(),
+        }
         final_slurm = self.get_slurm_raw().format(**format_dict)
 
         new_hash = self.get_hash_from_string(final_slurm + json.dumps(output_dict))
@@ -262,7 +273,7 @@ fi
             with open(slurm_output_file, "w") as f:
                 f.write(final_slurm)
             self.logger.info(f"Submitting batch job for analyse chains")
-            subprocess.run(["sbatch", slurm_output_file], cwd=self.output_dir)
+            self.submit_job(slurm_output_file)
         else:
             self.logger.info("Hash check passed, not rerunning")
         return True
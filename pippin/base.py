@@ -1,3 +1,4 @@
+from pippin.file_cache import read_lines
 from pippin.task import Task
 
 
@@ -6,9 +7,8 @@ class ConfigBasedExecutable(Task):
         super().__init__(name, output_dir, dependencies=dependencies)
         self.default_assignment = default_assignment
         self.base_file = base_file
-        with open(base_file, "r") as f:
-            self.base = list(f.read().splitlines())
-            self.logger.debug(f"Loaded base file from {self.base_file}")
+        self.base = read_lines(base_file)
+        self.logger.debug(f"Loaded base file from {self.base_file}")
 
     def delete_property(self, name, section_start=None, section_end=None):
         self.set_property(name, None, section_start=section_start, section_end=section_end)
@@ -0,0 +1,295 @@
+import argparse
+import json
+import os
+import shutil
+import stat
+import time
+
+from pippin.config import get_logger, get_config, mkdirs, chown_dir
+
+try:
+    import fcntl
+except ModuleNotFoundError:
+    fcntl = None
+
+FICLONE = 0x40049409  # Linux ioctl to reflink one file to another
+
+
+def link_file(source, destination):
+    """ Puts a file at destination without copying its contents where we can avoid it.
+
+    On filesystems which support it, like btrfs and XFS, the blocks are shared copy-on-write (a reflink), so writing to
+    one file never changes the other. Elsewhere the file is hardlinked and made read-only, so neither side can change
+    it in place, only delete or replace it. Only when neither works (say they're on different filesystems) is it copied.
+    """
+    if fcntl is not None:
+        try:
+            with open(source, "rb") as src, open(destination, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            shutil.copystat(source, destination)
+            return
+        except OSError:
+            if os.path.exists(destination):
+                os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+        return
+    os.chmod(destination, stat.S_IMODE(os.stat(destination).st_mode) & ~0o222)
+
+
+class TaskCache:
+    """ A cache of finished task outputs shared between runs, keyed by the task's cache key (a hash of its inputs).
+
+    When a task would regenerate, but an identical task has already finished (in another run, or before its output
+    directory was removed), its outputs are put into place from the cache instead of being run again. Files are
+    reflinked where the filesystem supports it, and otherwise hardlinked and made read-only (see `link_file`), so
+    neither storing nor restoring an entry copies the data. A run can delete or replace its outputs, but can't change
+    the cache entry other runs restore from. Keep the cache on the same filesystem as the outputs, or it falls back to
+    copying. Entries are evicted least recently used first once the cache grows past its maximum size.
+
+    SNANA writes the GENVERSION (which is made from the config file and task names) into the names and contents of its
+    outputs. Tasks leave it and their output directory out of the key (see `Task.get_cache_values`), and the values
+    they had are saved with the entry. Restoring replaces them with the new task's values in file and directory names,
+    and in the contents of text files up to max_rewrite_size bytes, which are copied rather than linked.
+
+    Set it up in the OUTPUT section of the global config with `cache_dir` and optionally `cache_max_size_gb`, and inspect
+    or prune it with `pippin.sh cache list` and `pippin.sh cache prune`.
+
+    Each entry is a directory containing:
+        meta.json: the key, task name and type, when it was created and last used, its size, and the values left out of the key
+        output: the output directory of the task
+        extra_0, extra_1, ...: any other output directories of the task, such as the simulation folders in SNANA's sim dir
+    """
+
+    meta_filename = "meta.json"
+    skipped_files = ["hash.txt"]  # These belong to whichever run restores the entry
+    max_rewrite_size = 10 * 1024 ** 2
+
+    def __init__(self, cache_dir, max_size_gb=None):
+        self.logger = get_logger()
+        self.cache_dir = cache_dir
+        self.max_size = None if max_size_gb is None else int(float(max_size_gb) * 1024 ** 3)
+        mkdirs(self.cache_dir)
+
+    def get_entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get_meta(self, key):
+        path = os.path.join(self.get_entry_dir(key), self.meta_filename)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, entry_dir, meta):
+        path = os.path.join(entry_dir, self.meta_filename)
+        with open(path + ".tmp", "w") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(path + ".tmp", path)
+
+    def copy_tree(self, source, destination, replacements=None):
+        """ Recreates source at destination with link_file. Symlinks are not carried across.
+
+        :param replacements: list of (old, new) strings to replace in the names of everything copied, and the contents of
+        small text files
+        :return: the total size of the files copied in bytes
+        """
+        replacements = replacements or []
+
+        def replace(text):
+            for old, new in replacements:
+                text = text.replace(old, new)
+            return text
+
+        size = 0
+        for root, dirs, files in os.walk(source):
+            rel = os.path.relpath(root, source)
+            target_root = destination if rel == "." else os.path.join(destination, replace(rel))
+            os.makedirs(target_root, exist_ok=True)
+            dirs[:] = [d for d in dirs if not os.path.islink(os.path.join(root, d))]
+            for f in files:
+                path = os.path.join(root, f)
+                if os.path.islink(path) or (rel == "." and f in self.skipped_files):
+                    continue
+                target = os.path.join(target_root, replace(f))
+                if not replacements or not self.rewrite_file(path, target, replacements):
+                    link_file(path, target)
+                size += os.path.getsize(path)
+        return size
+
+    def rewrite_file(self, source, destination, replacements):
+        """ Writes a copy of a small text file with the replacements made, if it contains any of them
+
+        :return: true if the file was written
+        """
+        if os.path.getsize(source) > self.max_rewrite_size:
+            return False
+        with open(source, "rb") as f:
+            content = f.read()
+        if b"\0" in content or not any(old.encode("utf-8") in content for old, _ in replacements):
+            return False
+        for old, new in replacements:
+            content = content.replace(old.encode("utf-8"), new.encode("utf-8"))
+        with open(destination, "wb") as f:
+            f.write(content)
+        shutil.copystat(source, destination)
+        os.chmod(destination, stat.S_IMODE(os.stat(destination).st_mode) | 0o200)
+        return True
+
+    def restore(self, key, output_dir, extra_dirs=None, values=None):
+        """ Copies a cached entry into place, replacing anything currently in the output and extra dirs.
+
+        :param values: dictionary of placeholder to value for the restoring task, see `Task.get_cache_values`. Wherever
+        the value the storing task had for a placeholder appears, it is replaced with this one.
+        :return: true if the entry existed and was restored
+        """
+        meta = self.get_meta(key)
+        if meta is None:
+            return False
+        extra_dirs = extra_dirs or []
+        if len(extra_dirs) != meta["num_extra"]:
+            self.logger.warning(f"Cache entry {key} has {meta['num_extra']} extra directories but the task has {len(extra_dirs)}, not using it")
+            return False
+        stored_values = meta.get("values", {})
+        replacements = [(stored_values[p], v) for p, v in (values or {}).items() if stored_values.get(p) and stored_values[p] != v]
+        # Longest first, so a value containing another (like the output directory containing the GENVERSION) is replaced whole
+        replacements.sort(key=lambda r: len(r[0]), reverse=True)
+        entry_dir = self.get_entry_dir(key)
+        self.logger.info(f"Restoring outputs of {meta['name']} from cache entry {entry_dir}")
+        for i, directory in enumerate([output_dir] + extra_dirs):
+            source = os.path.join(entry_dir, "output" if i == 0 else f"extra_{i - 1}")
+            shutil.rmtree(directory, ignore_errors=True)
+            self.copy_tree(source, directory, replacements)
+            chown_dir(directory)
+        meta["last_used"] = time.time()
+        meta["num_uses"] = meta.get("num_uses", 0) + 1
+        self._write_meta(entry_dir, meta)
+        return True
+
+    def store(self, key, name, task_type, output_dir, extra_dirs=None, values=None):
+        """ Adds the outputs of a successfully finished task to the cache
+
+        :param values: dictionary of placeholder to value for the things the task left out of the key, see `Task.get_cache_values`
+        """
+        entry_dir = self.get_entry_dir(key)
+        if self.get_meta(key) is not None:
+            self.logger.debug(f"Cache already has an entry for {name} with key {key}")
+            return
+        extra_dirs = extra_dirs or []
+        temp_dir = f"{entry_dir}.tmp{os.getpid()}"
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        try:
+            size = self.copy_tree(output_dir, os.path.join(temp_dir, "output"))
+            for i, directory in enumerate(extra_dirs):
+                size += self.copy_tree(directory, os.path.join(temp_dir, f"extra_{i}"))
+            now = time.time()
+            meta = {
+                "key": key,
+                "name": name,
+                "type": task_type,
+                "created": now,
+                "last_used": now,
+                "num_uses": 0,
+                "size": size,
+                "num_extra": len(extra_dirs),
+                "values": values or {},
+            }
+            self._write_meta(temp_dir, meta)
+            os.rename(temp_dir, entry_dir)
+        except OSError as e:
+            self.logger.warning(f"Unable to add {name} to the cache at {self.cache_dir}: {e}")
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+        self.logger.info(f"Added {name} to the task cache, entry size {size / 1024 ** 2:0.1f} MB")
+        if self.max_size is not None:
+            self.prune(max_size=self.max_size)
+
+    def list_entries(self):
+        """ All complete entries, most recently used first """
+        entries = []
+        if not os.path.exists(self.cache_dir):
+            return entries
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                if ".tmp" in key:
+                    continue
+                meta = self.get_meta(key)
+                if meta is not None:
+                    entries.append(meta)
+        return sorted(entries, key=lambda m: m["last_used"], reverse=True)
+
+    def remove(self, key):
+        shutil.rmtree(self.get_entry_dir(key), ignore_errors=True)
+
+    def prune(self, max_size=None, max_age_days=None):
+        """ Evicts entries unused for more than max_age_days, then least recently used entries until under max_size bytes
+
+        :return: the metadata of the removed entries
+        """
+        removed = []
+        total = 0
+        for meta in self.list_entries():
+            too_old = max_age_days is not None and time.time() - meta["last_used"] > max_age_days * 86400
+            too_big = max_size is not None and total + meta["size"] > max_size
+            if too_old or too_big:
+                self.logger.info(f"Evicting {meta['name']} ({meta['key']}) from the task cache")
+                self.remove(meta["key"])
+                removed.append(meta)
+            else:
+                total += meta["size"]
+        return removed
+
+
+def get_task_cache(global_config=None):
+    """ Returns the TaskCache configured in the OUTPUT section of the global config, or None if there isn't one """
+    if global_config is None:
+        global_config = get_config()
+    cache_dir = global_config["OUTPUT"].get("cache_dir")
+    if not cache_dir:
+        return None
+    cache_dir = os.path.expandvars(cache_dir)
+    return TaskCache(cache_dir, global_config["OUTPUT"].get("cache_max_size_gb"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and prune the shared task output cache")
+    parser.add_argument("command", choices=["list", "prune"], help="list entries, or prune them")
+    parser.add_argument("--config", help="Location of global config", default=None, type=str)
+    parser.add_argument("--max_size_gb", help="When pruning, evict least recently used entries until the cache is this size", default=None, type=float)
+    parser.add_argument("--max_age_days", help="When pruning, evict entries unused for this many days", default=None, type=float)
+    args = parser.parse_args()
+
+    import logging
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    cache = get_task_cache(get_config(initial_path=args.config))
+    if cache is None:
+        print("No cache_dir is set in the OUTPUT section of the global config")
+        return
+
+    if args.command == "list":
+        entries = cache.list_entries()
+        total = sum(e["size"] for e in entries)
+        print(f"{len(entries)} entries in {cache.cache_dir}, {total / 1024 ** 3:0.2f} GB")
+        for e in entries:
+            last_used = time.strftime("%Y-%m-%d %H:%M", time.localtime(e["last_used"]))
+            print(f"  {e['key'][:12]}  {e['type']:>20s}  {e['name']:<40s} {e['size'] / 1024 ** 2:10.1f} MB  used {e['num_uses']} times, last {last_used}")
+    else:
+        max_size = args.max_size_gb * 1024 ** 3 if args.max_size_gb is not None else cache.max_size
+        if max_size is None and args.max_age_days is None:
+            print("Nothing to prune against, please set --max_size_gb, --max_age_days or cache_max_size_gb")
+            return
+        removed = cache.prune(max_size=max_size, max_age_days=args.max_age_days)
+        print(f"Removed {len(removed)} entries, freeing {sum(e['size'] for e in removed) / 1024 ** 3:0.2f} GB")
+
+
+if __name__ == "__main__":
+    main()
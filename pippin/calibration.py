@@ -0,0 +1,160 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from scipy.ndimage import gaussian_filter
+
+from pippin.config import get_logger
+
+# Yes, outside normal range, so if we smooth it we dont screw things up with edge effects
+BINS = np.linspace(-1, 2, 61)
+SMOOTHING = 0  # Gaussian filter sigma in bins. Turned off, but kept in case we want to play around with it later
+MIN_EVENTS = 100
+
+_curves = {}  # absolute path -> (mtime_ns, size, dataframe)
+_lock = threading.Lock()
+
+
+def get_bin_index(values, bins):
+    """ Which bin each value falls in, the same as np.digitize(values, bins) - 1 but faster for evenly spaced bins.
+
+    Values below the first edge (and NaNs) get -1, values above the last edge get len(bins) - 1. The index is worked out
+    arithmetically and then nudged by one where rounding put a value on the wrong side of an edge.
+    """
+    num_bins = bins.size - 1
+    width = (bins[-1] - bins[0]) / num_bins
+    if not np.allclose(np.diff(bins), width):
+        return np.where(np.isnan(values), -1, np.digitize(values, bins) - 1)
+    with np.errstate(invalid="ignore"):
+        index = np.floor((values - bins[0]) * (1 / width))
+    index = np.clip(np.nan_to_num(index, nan=-1), -1, num_bins).astype(np.intp)
+    edges = np.concatenate(([-np.inf], bins, [np.inf]))
+    index -= values < edges[index + 1]
+    index += values >= edges[index + 2]
+    return index
+
+
+def binned_means(probs, truth, bins=BINS):
+    """ Mean of truth in each probability bin, for every column of probs at once.
+
+    Every value is given a bin in one pass over the whole array, then offset by its column so a single bincount gives
+    the sums (and another the counts) for every column. Matches scipy's binned_statistic: bins are closed on the
+    left, except the last which includes its right edge, and values outside the bins are ignored.
+
+    :param probs: 2D array of shape (num_events, num_columns), NaNs are ignored
+    :param truth: 1D array of length num_events, NaNs are ignored
+    :return: (means of shape (num_columns, num_bins), NaN where a bin is empty; number of usable events per column)
+    """
+    probs = np.asarray(probs, dtype=np.float64)
+    truth = np.asarray(truth, dtype=np.float64)
+    num_bins = bins.size - 1
+    num_columns = probs.shape[1]
+    size = num_columns * num_bins
+
+    usable = np.isfinite(probs) & np.isfinite(truth)[:, None]
+    index = get_bin_index(probs, bins)
+    index[probs == bins[-1]] = num_bins - 1
+    # Anything which shouldn't be counted goes in an extra bin at the end, which is thrown away
+    flat = np.where(usable & (index >= 0) & (index < num_bins), index + np.arange(num_columns) * num_bins, size).ravel()
+    weights = np.broadcast_to(np.nan_to_num(truth)[:, None], probs.shape).ravel()
+    sums = np.bincount(flat, weights=weights, minlength=size + 1)[:size].reshape(num_columns, num_bins)
+    counts = np.bincount(flat, minlength=size + 1)[:size].reshape(num_columns, num_bins)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    return means, usable.sum(axis=0)
+
+
+def get_calibration_curves(df, bins=BINS):
+    """ Calibration curves for every PROB_ column of df, using the IA column as the truth.
+
+    Columns which are all NaN or have fewer than MIN_EVENTS events with both a probability and a known type are skipped.
+
+    :return: a dataframe with the bin centres (and the 0 and 1 bounds) in the bins column and a column per classifier
+    """
+    logger = get_logger()
+    bc = 0.5 * (bins[:-1] + bins[1:])
+    mask = (bc >= 0) & (bc <= 1)
+    result = {"bins": np.concatenate(([0], bc[mask], [1.0]))}
+
+    truth = df["IA"].to_numpy(dtype=np.float64, na_value=np.nan)
+    cols = [c for c in df.columns if c.startswith("PROB_")]
+    if not cols:
+        return pd.DataFrame(result)
+    probs = df[cols].to_numpy(dtype=np.float64, na_value=np.nan)
+    means, num_usable = binned_means(probs, truth, bins)
+
+    all_nan_truth = not np.isfinite(truth).any()
+    all_nan_probs = ~np.isfinite(probs).any(axis=0)
+    good = np.ones(len(cols), dtype=bool)
+    for i, c in enumerate(cols):
+        if all_nan_probs[i] or all_nan_truth:
+            logger.warning(
+                "Unable to create calibration curves. This is expected if the calibration source is data (unknown types) or a sim of only Ia or CC (where you have only one type)."
+            )
+            if all_nan_probs[i]:
+                logger.error(f"prob column {c} is all NaN")
+            if all_nan_truth:
+                logger.error(f"truth values are all NaN")
+            good[i] = False
+        elif num_usable[i] < MIN_EVENTS:
+            if num_usable[i] == 0:
+                logger.warning("There are no events which have both a prob and a known Ia/CC flag")
+            else:
+                logger.warning("There are too few events with both a prob and known Ia/CC flag")
+            good[i] = False
+
+    # Sets a 1:1 line outside of 0 to 1, then clips to the 0 and 1 bounds. The clipping only does anything if SMOOTHING > 0
+    curves = np.where(np.isfinite(means), means, bc)
+    curves = gaussian_filter(curves, sigma=(0, SMOOTHING))[:, mask]
+    curves = np.clip(np.hstack((np.zeros((len(cols), 1)), curves, np.ones((len(cols), 1)))), 0, 1)
+    for i, c in enumerate(cols):
+        if good[i]:
+            result[c] = curves[i]
+    return pd.DataFrame(result)
+
+
+def load_calibration_curve(path):
+    """ The calibration curves saved at path, reusing the last read if the file has not changed since.
+
+    Every version of an aggregator recalibrates against the same file, so this saves rereading it each time.
+    Do not modify the returned dataframe.
+    """
+    path = os.path.abspath(path)
+    s = os.stat(path)
+    with _lock:
+        cached = _curves.get(path)
+    if cached is not None and cached[0] == s.st_mtime_ns and cached[1] == s.st_size:
+        return cached[2]
+    get_logger().debug(f"Reading calibration curves from {path}")
+    df = pd.read_csv(path)
+    with _lock:
+        _curves[path] = (s.st_mtime_ns, s.st_size, df)
+    return df
+
+
+def recalibrate(df, curves):
+    """ Adds a CPROB_ column for every PROB_ column, mapping the probabilities through the calibration curves.
+
+    Columns without a curve are copied unchanged. Probabilities outside 0 to 1 are clamped to the ends of the curve.
+
+    :return: the names of the PROB_ columns without a curve
+    """
+    bins = curves["bins"].to_numpy()
+    missing = []
+    new_columns = {}
+    for c in [c for c in df.columns if c.startswith("PROB_")]:
+        data = df[c].to_numpy(dtype=np.float64, na_value=np.nan)
+        if c not in curves:
+            missing.append(c)
+            new_columns[c.replace("PROB_", "CPROB_")] = df[c]
+        else:
+            new_columns[c.replace("PROB_", "CPROB_")] = np.interp(data, bins, curves[c].to_numpy())
+    for c, values in new_columns.items():
+        df[c] = values
+    return missing
+
+
+def clear():
+    with _lock:
+        _curves.clear()
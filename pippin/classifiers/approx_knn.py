@@ -0,0 +1,145 @@
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin
+
+
+class RandomProjectionTree:
+    """ A tree splitting the training points in half along a random direction at each node, like those used by annoy.
+
+    Nodes are stored in flat arrays so that a whole batch of queries can be walked down the tree together, one level at
+    a time. Each leaf holds at most leaf_size points, stored as a row of `leaves` padded with -1.
+    """
+
+    ARRAYS = ["normals", "offsets", "children", "leaves"]
+
+    def __init__(self, normals, offsets, children, leaves):
+        self.normals = normals
+        self.offsets = offsets
+        self.children = children
+        self.leaves = leaves
+
+    @classmethod
+    def build(cls, X, leaf_size, rng):
+        normals, offsets, children = [], [], []
+        leaves = []
+        stack = [(np.arange(X.shape[0]), None, 0)]  # (points, parent node, which child of the parent)
+        while stack:
+            points, parent, side = stack.pop()
+            node = len(normals)
+            if parent is not None:
+                children[parent][side] = node
+            normals.append(None)
+            offsets.append(0.0)
+            children.append([-1, -1])
+            if points.size <= leaf_size:
+                # Leaves are marked by a negative child, -1 - leaf number
+                children[node] = [-1 - len(leaves), -1 - len(leaves)]
+                leaves.append(points)
+                continue
+            normal = rng.normal(size=X.shape[1]).astype(X.dtype)
+            projection = X[points] @ normal
+            order = np.argsort(projection, kind="stable")
+            half = points.size // 2
+            normals[node] = normal
+            offsets[node] = 0.5 * (projection[order[half - 1]] + projection[order[half]])
+            stack.append((points[order[half:]], node, 1))
+            stack.append((points[order[:half]], node, 0))
+
+        normals = np.array([n if n is not None else np.zeros(X.shape[1], dtype=X.dtype) for n in normals])
+        leaf_array = np.full((len(leaves), leaf_size), -1, dtype=np.int64)
+        for i, leaf in enumerate(leaves):
+            leaf_array[i, : leaf.size] = leaf
+        return cls(normals, np.array(offsets, dtype=X.dtype), np.array(children, dtype=np.int64), leaf_array)
+
+    def get_leaves(self, X):
+        """ The members of the leaf each query point ends up in, shape (num_queries, leaf_size) """
+        node = np.zeros(X.shape[0], dtype=np.int64)
+        active = self.children[node, 0] >= 0
+        while active.any():
+            n = node[active]
+            right = np.einsum("ij,ij->i", X[active], self.normals[n]) > self.offsets[n]
+            node[active] = self.children[n, right.astype(np.int64)]
+            active = self.children[node, 0] >= 0
+        return self.leaves[-1 - self.children[node, 0]]
+
+
+class ApproxKNeighborsClassifier(ClassifierMixin, BaseEstimator):
+    """ Approximate k nearest neighbours classifier, using a forest of random projection trees.
+
+    Each query is dropped down every tree and the points in the leaves it lands in become its candidates. The exact
+    distance to each candidate is computed and the k closest vote, like KNeighborsClassifier with uniform weights.
+    More trees or bigger leaves give results closer to the exact neighbours, at the cost of speed. Only numpy is used,
+    so it can be pickled into a Pipeline and used anywhere sklearn is available.
+
+    :param n_neighbors: the number of neighbours which vote
+    :param n_trees: the number of trees to search
+    :param leaf_size: the maximum number of training points in a leaf. Should be at least n_neighbors.
+    :param random_state: seed for the random directions
+    """
+
+    def __init__(self, n_neighbors=50, n_trees=10, leaf_size=128, random_state=0):
+        self.n_neighbors = n_neighbors
+        self.n_trees = n_trees
+        self.leaf_size = leaf_size
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        X = np.asarray(X)
+        if X.dtype != np.float32:
+            X = X.astype(np.float64)
+        self.classes_, self._y = np.unique(y, return_inverse=True)
+        self._X = np.ascontiguousarray(X)
+        self._sq_norms = np.einsum("ij,ij->i", self._X, self._X)
+        rng = np.random.default_rng(self.random_state)
+        leaf_size = max(self.leaf_size, self.n_neighbors)
+        self.trees_ = [RandomProjectionTree.build(self._X, leaf_size, rng) for _ in range(self.n_trees)]
+        return self
+
+    def get_arrays(self):
+        """ Everything the fitted classifier needs, as a dict of arrays which can be saved and restored by from_arrays """
+        arrays = {"X": self._X, "y": self._y, "sq_norms": self._sq_norms, "classes": self.classes_}
+        for i, tree in enumerate(self.trees_):
+            arrays.update({f"tree{i}_{name}": getattr(tree, name) for name in RandomProjectionTree.ARRAYS})
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, **params):
+        """ A fitted classifier using the arrays from get_arrays, which can be memory mapped as they are only read """
+        clf = cls(**params)
+        clf._X, clf._y, clf._sq_norms, clf.classes_ = arrays["X"], arrays["y"], arrays["sq_norms"], arrays["classes"]
+        clf.trees_ = [RandomProjectionTree(*[arrays[f"tree{i}_{name}"] for name in RandomProjectionTree.ARRAYS]) for i in range(clf.n_trees)]
+        return clf
+
+    def kneighbors(self, X, batch_size=256):
+        """ Indexes of the (approximate) nearest training points of each row of X, shape (num_queries, n_neighbors).
+
+        Where fewer than n_neighbors distinct candidates are found the remainder are -1. Queries are done batch_size at
+        a time, as the candidates of each query are gathered into one array.
+        """
+        X = np.asarray(X, dtype=self._X.dtype)
+        if X.shape[0] > batch_size:
+            return np.vstack([self.kneighbors(X[i : i + batch_size], batch_size) for i in range(0, X.shape[0], batch_size)])
+        candidates = np.sort(np.hstack([t.get_leaves(X) for t in self.trees_]), axis=1)
+        # Points found by more than one tree, and the padding of small leaves, can't be neighbours
+        invalid = candidates < 0
+        invalid[:, 1:] |= candidates[:, 1:] == candidates[:, :-1]
+
+        # |x - c|^2 without the |x|^2, which doesn't change the ordering
+        safe = np.where(invalid, 0, candidates)
+        distances = self._sq_norms[safe] - 2 * np.einsum("ikj,ij->ik", self._X[safe], X)
+        distances[invalid] = np.inf
+
+        k = min(self.n_neighbors, candidates.shape[1])
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        result = np.take_along_axis(candidates, nearest, axis=1)
+        result[np.isinf(np.take_along_axis(distances, nearest, axis=1))] = -1
+        return result
+
+    def predict_proba(self, X):
+        neighbours = self.kneighbors(X)
+        valid = neighbours >= 0
+        labels = np.where(valid, self._y[np.where(valid, neighbours, 0)], -1)
+        counts = np.stack([(labels == i).sum(axis=1) for i in range(self.classes_.size)], axis=1)
+        return counts / np.maximum(valid.sum(axis=1), 1)[:, None]
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
@@ -1,5 +1,6 @@
 import os
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
 from pippin.config import get_output_loc, get_data_loc
 from pippin.dataprep import DataPrep
@@ -28,20 +29,27 @@ class Classifier(Task):
         output_dir: top level output directory
         prob_column_name: name of the column to get probabilities out of
         predictions_filename: location of csv filename with id/probs
+        indexes: the versions of the sim or fit this task classifies
 
     """
 
     TRAIN = 0
     PREDICT = 1
 
-    def __init__(self, name, output_dir, dependencies, mode, options, index=0, model_name=None):
+    # Classifiers quick enough to run inside Pippin can set this, so that one task classifies every version of
+    # its sim or fit rather than creating a task per version
+    BATCHED = False
+
+    def __init__(self, name, output_dir, dependencies, mode, options, index=0, model_name=None, indexes=None):
         super().__init__(name, output_dir, dependencies=dependencies)
         self.options = options
         self.index = index
+        self.indexes = [index] if indexes is None else list(indexes)
         self.mode = mode
         self.model_name = model_name
         self.output["prob_column_name"] = self.get_prob_column_name()
         self.output["index"] = index
+        self.output["indexes"] = self.indexes
 
     @abstractmethod
     def predict(self, force_refresh):
@@ -70,6 +78,33 @@ class Classifier(Task):
         """
         return True, True
 
+    def get_predictions_filename(self, index):
+        """ The predictions for the given version. Batched classifiers write one file per version. """
+        filenames = self.output.get("predictions_filenames")
+        if filenames is not None:
+            return filenames[self.indexes.index(index)]
+        return self.output["predictions_filename"]
+
+    def get_batched_filenames(self):
+        """ Where a batched classifier saves the predictions of each of its versions """
+        if len(self.indexes) == 1:
+            return [os.path.join(self.output_dir, "predictions.csv")]
+        return [os.path.join(self.output_dir, f"predictions_{i + 1:04d}.csv") for i in self.indexes]
+
+    def save_batched_predictions(self, get_predictions, max_workers=8):
+        """ Saves the predictions of every version, a few versions at a time.
+
+        :param get_predictions: function taking the version index and returning a dataframe of ids and probabilities
+        """
+
+        def save(index):
+            filename = self.get_predictions_filename(index)
+            get_predictions(index).to_csv(filename, index=False, float_format="%0.4f")
+            self.logger.info(f"Saved probabilities to {filename}")
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(self.indexes))) as executor:
+            list(executor.map(save, self.indexes))
+
     def get_fit_dependency(self, output=True):
         for t in self.dependencies:
             if isinstance(t, SNANALightCurveFit):
@@ -216,24 +251,30 @@ class Classifier(Task):
                         assert (
                             len(folders) == 1
                         ), f"Training requires one version of the lcfits, you have {len(folders)} for lcfit task {l}. Make sure your training sim doesn't set RANSEED_CHANGE"
+
+                def create_tasks(deps, extra=None, model_name=None):
+                    """ One task per version, or a single task for all of them if the classifier is batched """
+                    num_indexes = get_num_ranseed(s, l)
+                    if cls.BATCHED:
+                        runs = [(None, 0, {"indexes": list(range(num_indexes))})]
+                    else:
+                        runs = [(i + 1 if num_indexes > 1 else None, i, {}) for i in range(num_indexes)]
+                    for num, i, kwargs in runs:
+                        clas_output_dir = _get_clas_output_dir(base_output_dir, stage_number, sim_name, fit_name, clas_name, index=num, extra=extra)
+                        cc = cls(clas_name, clas_output_dir, deps, mode, options, index=i, model_name=model_name, **kwargs)
+                        index_name = f"{cc.indexes[0]}-{cc.indexes[-1]}" if cls.BATCHED else i
+                        Task.logger.info(
+                            f"Creating classification task {name} with {cc.num_jobs} jobs, for LC fit {fit_name} on simulation {sim_name} and index {index_name}"
+                        )
+                        tasks.append(cc)
+                    return len(runs)
+
                 if model is not None:
                     if "/" in model or "." in model:
                         potential_path = get_output_loc(model)
                         if os.path.exists(potential_path):
                             extra = os.path.basename(os.path.dirname(potential_path))
-
-                            # Nasty duplicate code, TODO fix this
-                            indexes = get_num_ranseed(s, l)
-                            for i in range(indexes):
-                                num = i + 1 if indexes > 1 else None
-                                clas_output_dir = _get_clas_output_dir(base_output_dir, stage_number, sim_name, fit_name, clas_name, index=num, extra=extra)
-                                cc = cls(clas_name, clas_output_dir, deps, mode, options, index=i, model_name=extra)
-                                Task.logger.info(
-                                    f"Creating classification task {name} with {cc.num_jobs} jobs, for LC fit {fit_name} on simulation {sim_name} and index {i}"
-                                )
-                                num_gen += 1
-                                tasks.append(cc)
-
+                            num_gen += create_tasks(deps, extra=extra, model_name=extra)
                         else:
                             Task.fail_config(f"Your model {model} looks like a path, but I couldn't find a model at {potential_path}")
                     else:
@@ -243,29 +284,9 @@ class Classifier(Task):
                                 extra = t.get_unique_name()
 
                                 assert t.__class__ == cls, f"Model {clas_name} with class {cls} has model {model} with class {t.__class__}, they should match!"
-
-                                indexes = get_num_ranseed(s, l)
-                                for i in range(indexes):
-                                    num = i + 1 if indexes > 1 else None
-                                    clas_output_dir = _get_clas_output_dir(base_output_dir, stage_number, sim_name, fit_name, clas_name, index=num, extra=extra)
-                                    cc = cls(clas_name, clas_output_dir, deps + [t], mode, options, index=i)
-                                    Task.logger.info(
-                                        f"Creating classification task {name} with {cc.num_jobs} jobs, for LC fit {fit_name} on simulation {sim_name} and index {i}"
-                                    )
-                                    num_gen += 1
-                                    tasks.append(cc)
+                                num_gen += create_tasks(deps + [t], extra=extra)
                 else:
-
-                    indexes = get_num_ranseed(s, l)
-                    for i in range(indexes):
-                        num = i + 1 if indexes > 1 else None
-                        clas_output_dir = _get_clas_output_dir(base_output_dir, stage_number, sim_name, fit_name, clas_name, index=num)
-                        cc = cls(clas_name, clas_output_dir, deps, mode, options, index=i)
-                        Task.logger.info(
-                            f"Creating classification task {name} with {cc.num_jobs} jobs, for LC fit {fit_name} on simulation {sim_name} and index {i}"
-                        )
-                        num_gen += 1
-                        tasks.append(cc)
+                    num_gen += create_tasks(deps)
 
             if num_gen == 0:
                 Task.fail_config(f"Classifier {clas_name} with masks |{mask}|{mask_sim}|{mask_fit}| matched no combination of sims and fits")
@@ -1,7 +1,7 @@
 import os
-import pandas as pd
 from pippin.classifiers.classifier import Classifier
 from pippin.config import chown_dir, mkdirs
+from pippin.io.fitres import load_fitres
 from pippin.task import Task
 
 
@@ -24,16 +24,21 @@ class FitProbClassifier(Classifier):
         name : name given in the yml
         output_dir: top level output directory
         prob_column_name: name of the column to get probabilities out of
-        predictions_filename: location of csv filename with id/probs
+        predictions_filename: location of csv filename with id/probs for the first version
+        predictions_filenames: the csv file for each version
 
+    One task classifies every version of the light curve fit.
     """
 
-    def __init__(self, name, output_dir, dependencies, mode, options, index=0, model_name=None):
-        super().__init__(name, output_dir, dependencies, mode, options, index=index, model_name=model_name)
-        self.output_file = None
+    BATCHED = True
+
+    def __init__(self, name, output_dir, dependencies, mode, options, index=0, model_name=None, indexes=None):
+        super().__init__(name, output_dir, dependencies, mode, options, index=index, model_name=model_name, indexes=indexes)
         self.passed = False
         self.num_jobs = 1  # This is the default. Can get this from options if needed.
-        self.output_file = os.path.join(self.output_dir, "predictions.csv")
+        self.output_files = self.get_batched_filenames()
+        self.output_file = self.output_files[0]
+        self.output["predictions_filenames"] = self.output_files
         self.fitopt = options.get("FITOPT", "DEFAULT")
 
     def check_regenerate(self, force_refresh):
@@ -57,18 +62,16 @@ class FitProbClassifier(Classifier):
         if new_hash:
             mkdirs(self.output_dir)
             input = self.get_fit_dependency()
-            fitres_file = os.path.join(input["fitres_dirs"][self.index], input["fitopt_map"][self.fitopt])
-            self.logger.debug(f"Looking for {fitres_file}")
-            if not os.path.exists(fitres_file):
-                self.logger.error(f"FITRES file could not be found at {fitres_file}, classifer has nothing to work with")
-                self.passed = False
-                return False
-
-            df = pd.read_csv(fitres_file, delim_whitespace=True, comment="#")
-            df = df[["CID", "FITPROB"]].rename(columns={"FITPROB": self.get_prob_column_name()})
-
-            self.logger.info(f"Saving probabilities to {self.output_file}")
-            df.to_csv(self.output_file, index=False, float_format="%0.4f")
+            fitres_files = {i: os.path.join(input["fitres_dirs"][i], input["fitopt_map"][self.fitopt]) for i in self.indexes}
+            for fitres_file in fitres_files.values():
+                self.logger.debug(f"Looking for {fitres_file}")
+                if not os.path.exists(fitres_file):
+                    self.logger.error(f"FITRES file could not be found at {fitres_file}, classifer has nothing to work with")
+                    self.passed = False
+                    return False
+
+            name = self.get_prob_column_name()
+            self.save_batched_predictions(lambda i: load_fitres(fitres_files[i], columns=["CID", "FITPROB"]).rename(columns={"FITPROB": name}))
             chown_dir(self.output_dir)
             with open(self.done_file, "w") as f:
                 f.write("SUCCESS")
@@ -1,16 +1,36 @@
 import argparse
+import json
+import shutil
 import numpy as np
 import pandas as pd
 import logging
 import sys
 import os
 import pickle
+from concurrent.futures import ThreadPoolExecutor
 
+import sklearn
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.pipeline import Pipeline
 
+try:
+    from pippin.classifiers.approx_knn import ApproxKNeighborsClassifier
+    from pippin.io.fitres import load_fitres
+except ModuleNotFoundError:
+    # Run as a script somewhere without Pippin on the PYTHONPATH, so find it from where this file is
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+    from pippin.classifiers.approx_knn import ApproxKNeighborsClassifier
+    from pippin.io.fitres import load_fitres
+
+
+# kd_tree, ball_tree and brute (which uses BLAS for the distances) are sklearn's exact searches.
+# approx searches a forest of random projection trees, and is much faster to predict with for large training sets.
+ALGORITHMS = ["kd_tree", "ball_tree", "brute", "approx"]
+MODEL_FORMAT = 2
+TREE_ARRAYS = ["tree_idx_array", "tree_node_data", "tree_node_bounds"]  # The arrays of a KDTree or BallTree's state
+
 
 def setup_logging():
     fmt = "[%(levelname)8s |%(funcName)21s:%(lineno)3d]   %(message)s"
@@ -21,13 +41,22 @@ def setup_logging():
 
 def get_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("fitres_file", help="the name of the fitrres file to load. For example: somepath/FITOPT000.FITRES")
+    parser.add_argument(
+        "fitres_file", help="the fitres files to load, for example somepath/FITOPT000.FITRES. Training uses only one.", nargs="+", type=str
+    )
     parser.add_argument("-p", "--predict", help="If in predict mode", action="store_true")
-    parser.add_argument("-m", "--model", help="Pickled model to load", default="model.pkl", type=str)
+    parser.add_argument("-m", "--model", help="Model directory to save or load. Pickled models from older versions can be loaded too.", default="model", type=str)
+    parser.add_argument("--model_version", help="Version to save the model as, or the version it must have to predict", type=str, default=None)
     parser.add_argument("-d", "--done_file", help="Location to write done file", default="done.txt", type=str)
     parser.add_argument("-f", "--features", help="Space separated string of features out of fitres", type=str, nargs="+", default=None)
     parser.add_argument("-t", "--types", help="Ia types, space separated list", type=int, nargs="+", default=None)
-    parser.add_argument("-o", "--output", help="Output CSV of predictions", type=str, default="predictions.csv")
+    parser.add_argument("-o", "--output", help="Output CSV of predictions, one per fitres file", type=str, nargs="+", default=["predictions.csv"])
+    parser.add_argument("-c", "--chunk_size", help="Number of rows to predict at once", type=int, default=100000)
+    parser.add_argument("-j", "--n_jobs", help="Number of chunks to predict at the same time", type=int, default=1)
+    parser.add_argument("-a", "--algorithm", help="How to find the neighbours", choices=ALGORITHMS, default="kd_tree")
+    parser.add_argument("-k", "--n_neighbors", help="Number of neighbours which vote", type=int, default=50)
+    parser.add_argument("--n_trees", help="Number of trees searched by the approx algorithm", type=int, default=10)
+    parser.add_argument("--float32", help="Store the features as float32 to halve their memory. Only approx and brute keep them, the trees use float64. Training only.", action="store_true")
     parser.add_argument("-n", "--name", help="Column name for probability", type=str, default="PROB")
     args = parser.parse_args()
     return args
@@ -42,20 +71,22 @@ def sanitise_args(args):
     if args.types is None:
         args.types = [1, 101]
 
-    logging.info(f"Input fitres_file is {args.fitres_file}")
-    assert os.path.exists(args.fitres_file), f"File {args.fitres_file} does not exist"
+    for f in args.fitres_file:
+        logging.info(f"Input fitres_file is {f}")
+        assert os.path.exists(f), f"File {f} does not exist"
+    if args.predict:
+        assert len(args.output) == len(args.fitres_file), f"Got {len(args.fitres_file)} fitres files but {len(args.output)} outputs"
+    assert args.chunk_size > 0, "Chunk size should be positive"
+    assert args.n_jobs > 0, "Number of jobs should be positive"
 
     assert " " not in args.name, f"Prob column name '{args.name}' should not have spaces"
     return args
 
 
-def get_features(filename, features, types):
-    df = pd.read_csv(filename, delim_whitespace=True, comment="#")
-    for f in features:
-        assert f in df.columns, f"Features {f} is not in DataFrame columns {list(df.columns)}"
-    assert "TYPE" in df.columns, f"DataFrame does not have a TYPE column!"
+def get_features(filename, features, types, float32=False):
+    df = load_fitres(filename, columns=list(dict.fromkeys(["CID", "TYPE"] + list(features))))
 
-    X = df[features].values
+    X = df[features].to_numpy(dtype=np.float32 if float32 else np.float64)
     y = np.isin(df["TYPE"].values, types)
 
     return df["CID"], X, y
@@ -63,38 +94,161 @@ def get_features(filename, features, types):
 
 def train(args):
     args = sanitise_args(args)
-    logging.info(f"Training model on file {args.fitres_file}")
+    assert len(args.fitres_file) == 1, f"Training takes one fitres file, got {args.fitres_file}"
+    logging.info(f"Training model on file {args.fitres_file[0]}")
 
-    _, X, y = get_features(args.fitres_file, args.features, args.types)
+    _, X, y = get_features(args.fitres_file[0], args.features, args.types, args.float32)
 
     X_train, X_test, y_train, y_test = train_test_split(X, y, stratify=y, test_size=0.05, random_state=0)
 
-    clf = Pipeline([("scaler", StandardScaler()), ("knn", KNeighborsClassifier(n_neighbors=50, algorithm="kd_tree"))])
+    clf = Pipeline([("scaler", StandardScaler()), ("knn", get_neighbours_classifier(args.algorithm, args.n_neighbors, args.n_trees))])
 
-    logging.info(f"Training NN on feature matrix {X.shape}")
+    logging.info(f"Training {args.algorithm} NN on feature matrix {X.shape} of {X.dtype}")
     clf.fit(X_train, y_train)
 
     score = clf.score(X_test, y_test)
     logging.info(f"Evaluating on 5% test set: got accuracy {score:0.4f}")
 
-    with open(args.model, "wb") as f:
-        pickle.dump(clf, f)
+    save_model(args.model, clf, args, version=args.model_version)
     logging.info(f"Saved trained model out to {args.model}")
 
 
+def save_model(path, clf, args, version=None):
+    """ Saves a trained pipeline as a directory of the scaler and settings in model.json and the arrays as .npy files.
+
+    Pickling the pipeline embeds the training set in the pickled tree, so every predict job had to unpickle all of it.
+    The arrays saved here are memory mapped instead, so jobs start straight away and share the page cache of a node.
+    The state of sklearn's KDTree and BallTree is saved too, so they aren't rebuilt when loaded, and the approx trees
+    are saved as they are. That state is private to sklearn, so the sklearn version is recorded with it.
+    """
+    scaler, knn = clf.named_steps["scaler"], clf.named_steps["knn"]
+    meta = {
+        "format": MODEL_FORMAT,
+        "version": version,
+        "algorithm": args.algorithm,
+        "n_neighbors": args.n_neighbors,
+        "n_trees": args.n_trees,
+        "sklearn_version": sklearn.__version__,
+        "scaler": {"mean": scaler.mean_.tolist(), "scale": scaler.scale_.tolist(), "n_samples_seen": int(scaler.n_samples_seen_)},
+    }
+    if args.algorithm == "approx":
+        arrays = knn.get_arrays()
+    else:
+        # The training points (already scaled) and their labels, as indexes into classes
+        arrays = {"X": knn._fit_X, "y": knn._y, "classes": knn.classes_}
+        if knn._tree is not None:
+            # The tree's data is the training points, in float64 even with --float32, then its arrays and shape
+            state = knn._tree.__getstate__()
+            arrays["X"] = state[0]
+            arrays.update(zip(TREE_ARRAYS, state[1:4]))
+            meta["tree"] = [int(v) for v in state[4:11]]
+    meta["arrays"] = sorted(arrays)
+
+    temp_path = f"{path}.tmp{os.getpid()}"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(temp_path, f"{name}.npy"), np.ascontiguousarray(array))
+    with open(os.path.join(temp_path, "model.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    os.replace(temp_path, path)
+
+
+def load_neighbours_classifier(arrays, meta):
+    """ A fitted KNeighborsClassifier using the saved arrays, without refitting it.
+
+    sklearn is fitted on a handful of the points to set up everything else, then given the full training set and tree.
+    Nothing is copied, so the memory mapped arrays are used as they are. If the model was saved with another version of
+    sklearn, whose private attributes and tree state may differ, it is refitted on the saved training points instead.
+    """
+    X, y, classes = arrays["X"], arrays["y"], arrays["classes"]
+    if meta.get("sklearn_version") != sklearn.__version__:
+        logging.warning(f"Model was saved with sklearn {meta.get('sklearn_version')} but this is {sklearn.__version__}, refitting it")
+        return KNeighborsClassifier(n_neighbors=meta["n_neighbors"], algorithm=meta["algorithm"]).fit(X, classes[y])
+    num = min(X.shape[0], meta["n_neighbors"])
+    knn = KNeighborsClassifier(n_neighbors=meta["n_neighbors"], algorithm=meta["algorithm"]).fit(X[:num], classes[y[:num]])
+    knn._fit_X, knn._y, knn.classes_, knn.n_samples_fit_ = X, y, classes, X.shape[0]
+    if knn._tree is not None:
+        state = knn._tree.__getstate__()
+        tree = type(knn._tree).__new__(type(knn._tree))
+        tree.__setstate__((X,) + tuple(arrays[name] for name in TREE_ARRAYS) + tuple(meta["tree"]) + state[11:])
+        knn._tree = tree
+    return knn
+
+
+def load_model(path, version=None):
+    """ Loads a model saved by save_model, memory mapping its arrays, or a pickled pipeline.
+
+    :param version: if given, the version the model must have been saved with
+    :return: a pipeline with predict_proba
+    """
+    if not os.path.isdir(path):
+        logging.info(f"Loading pickled model {path}")
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    with open(os.path.join(path, "model.json")) as f:
+        meta = json.load(f)
+    assert meta["format"] == MODEL_FORMAT, f"Model {path} has format {meta['format']}, I can only read {MODEL_FORMAT}. Please retrain it."
+    if version is not None and meta["version"] != version:
+        raise ValueError(f"Model {path} is version {meta['version']}, but version {version} was asked for. Has the training task rerun?")
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in meta["arrays"]}
+
+    scaler = StandardScaler()
+    scaler.mean_ = np.array(meta["scaler"]["mean"])
+    scaler.scale_ = np.array(meta["scaler"]["scale"])
+    scaler.var_ = scaler.scale_ ** 2
+    scaler.n_features_in_ = scaler.mean_.size
+    scaler.n_samples_seen_ = meta["scaler"]["n_samples_seen"]
+
+    if meta["algorithm"] == "approx":
+        knn = ApproxKNeighborsClassifier.from_arrays(arrays, n_neighbors=meta["n_neighbors"], n_trees=meta["n_trees"])
+    else:
+        knn = load_neighbours_classifier(arrays, meta)
+    logging.info(f"Loaded {meta['algorithm']} model {path} version {meta['version']} with {arrays['X'].shape[0]} training points")
+    return Pipeline([("scaler", scaler), ("knn", knn)])
+
+
+def get_neighbours_classifier(algorithm, n_neighbors, n_trees=10):
+    if algorithm == "approx":
+        return ApproxKNeighborsClassifier(n_neighbors=n_neighbors, n_trees=n_trees)
+    return KNeighborsClassifier(n_neighbors=n_neighbors, algorithm=algorithm)
+
+
+def predict_proba(clf, X, chunk_size, n_jobs=1):
+    """ Probability of the positive class for each row of X, predicting chunk_size rows at a time to bound memory.
+
+    With n_jobs above one, that many chunks are predicted at once in threads. The neighbour searches spend most of their
+    time in numpy or sklearn's compiled code, which release the GIL.
+    """
+    if X.shape[0] == 0:
+        return np.zeros(0)
+    chunks = [X[i : i + chunk_size] for i in range(0, X.shape[0], chunk_size)]
+    if n_jobs == 1 or len(chunks) == 1:
+        return np.concatenate([clf.predict_proba(c)[:, 1] for c in chunks])
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        return np.concatenate([p[:, 1] for p in executor.map(clf.predict_proba, chunks)])
+
+
 def predict(args):
+    """ Loads the model once, then predicts every fitres file in turn """
     args = sanitise_args(args)
-    logging.info(f"Predicting model on file {args.fitres_file} using pickle {args.model}")
-    assert os.path.exists(args.model), f"Pickle {args.model} does not exist!"
-    with open(args.model, "rb") as f:
-        clf = pickle.load(f)
+    logging.info(f"Predicting {len(args.fitres_file)} files using model {args.model}")
+    assert os.path.exists(args.model), f"Model {args.model} does not exist!"
+    clf = load_model(args.model, args.model_version)
 
-    cids, X, _ = get_features(args.fitres_file, args.features, args.types)
-    y = clf.predict_proba(X)
+    for fitres_file, output in zip(args.fitres_file, args.output):
+        logging.info(f"Predicting model on file {fitres_file}")
+        cids, X, _ = get_features(fitres_file, args.features, args.types, args.float32)
+        y = predict_proba(clf, X, args.chunk_size, args.n_jobs)
 
-    df_output = pd.DataFrame({"SNID": cids, args.name: y[:, 1]})
-    df_output.to_csv(args.output, float_format="%0.2f", index=False)
-    logging.info(f"Saved predictions to {args.output}")
+        df_output = pd.DataFrame({"SNID": cids, args.name: y})
+        df_output.to_csv(output, float_format="%0.2f", index=False)
+        logging.info(f"Saved predictions to {output}")
 
 
 if __name__ == "__main__":
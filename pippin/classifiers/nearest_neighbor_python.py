@@ -1,11 +1,10 @@
 import inspect
 import os
 import shutil
-import subprocess
 from pathlib import Path
 
 from pippin.classifiers.classifier import Classifier
-from pippin.config import get_config, get_output_loc, mkdirs
+from pippin.config import get_config, get_output_loc, get_pythonpath_export, mkdirs
 from pippin.task import Task
 
 
@@ -24,18 +23,30 @@ class NearestNeighborPyClassifier(Classifier):
           FITOPT: someLabel # Exact match to fitopt in a fitopt file. USED FOR TRAINING ONLY
           FEATURES: x1 c zHD  # Columns out of fitres file to use as features
           MODEL: someName # exact name of training classification task
+          ALGORITHM: kd_tree  # Or ball_tree, brute or approx (random projection trees, much faster for big training sets). Training only
+          N_NEIGHBORS: 50  # Number of neighbours which vote. Training only
+          FLOAT32: False  # Store features as float32, halving their memory. Only for approx and brute, sklearn's trees are float64. Training only
+          N_JOBS: 1  # CPUs to predict with
+          CHUNK_SIZE: 100000  # Rows predicted at once
 
     OUTPUTS:
     ========
         name : name given in the yml
         output_dir: top level output directory
         prob_column_name: name of the column to get probabilities out of
-        predictions_filename: location of csv filename with id/probs
+        predictions_filename: location of csv filename with id/probs for the first version
+        predictions_filenames: the csv file for each version
 
+    Predicting is done in one job for every version of the light curve fit, so the model is only loaded once.
     """
 
-    def __init__(self, name, output_dir, dependencies, mode, options, index=0, model_name=None):
-        super().__init__(name, output_dir, dependencies, mode, options, index=index, model_name=model_name)
+    BATCHED = True
+    can_run_locally = True
+    ALGORITHMS = ["kd_tree", "ball_tree", "brute", "approx"]  # Should match nearest_neighbor_code.ALGORITHMS
+    TRAINING_OPTIONS = ["ALGORITHM", "N_NEIGHBORS", "FLOAT32"]  # Predicting uses whatever the model was trained with
+
+    def __init__(self, name, output_dir, dependencies, mode, options, index=0, model_name=None, indexes=None):
+        super().__init__(name, output_dir, dependencies, mode, options, index=index, model_name=model_name, indexes=indexes)
         self.global_config = get_config()
         self.num_jobs = 1
 
@@ -44,18 +55,33 @@ class NearestNeighborPyClassifier(Classifier):
         self.path_to_classifier = os.path.dirname(inspect.stack()[0][1])
         self.job_base_name = os.path.basename(Path(output_dir).parents[1]) + "__" + os.path.basename(output_dir)
         self.features = options.get("FEATURES", "zHD x1 c cERR x1ERR COV_x1_c COV_x1_x0 COV_c_x0 PKMJDERR")
-        # self.model_pk_file = self.get_unique_name() + ".pkl"
-        self.model_pk_file = "model.pkl"
+        # Directory of the model arrays, see nearest_neighbor_code.save_model. MODEL can also point to an old model.pkl
+        self.model_pk_file = "model"
 
         self.output_pk_file = os.path.join(self.output_dir, self.model_pk_file)
-        self.predictions_filename = os.path.join(self.output_dir, "predictions.csv")
+        self.predictions_filenames = self.get_batched_filenames()
+        self.predictions_filename = self.predictions_filenames[0]
+
+        if self.mode == Classifier.PREDICT:
+            for key in self.TRAINING_OPTIONS:
+                if key in options:
+                    Task.fail_config(f"NN classifier {name} is in predict mode, but {key} is only used when training. Set it on the training task.")
+        self.algorithm = options.get("ALGORITHM", "kd_tree")
+        if self.algorithm not in self.ALGORITHMS:
+            Task.fail_config(f"NN classifier {name} has ALGORITHM {self.algorithm}, it should be one of {self.ALGORITHMS}")
+        self.n_neighbors = options.get("N_NEIGHBORS", 50)
+        self.float32 = options.get("FLOAT32", False)
+        self.n_jobs = options.get("N_JOBS", 1)
+        self.chunk_size = options.get("CHUNK_SIZE", 100000)
 
         self.fitopt = options.get("FITOPT", "DEFAULT")
         lcfit = self.get_fit_dependency()
         self.fitres_filename = lcfit["fitopt_map"][self.fitopt]
-        self.fitres_file = os.path.abspath(os.path.join(lcfit["fitres_dirs"][self.index], self.fitres_filename))
+        self.fitres_files = [os.path.abspath(os.path.join(lcfit["fitres_dirs"][i], self.fitres_filename)) for i in self.indexes]
+        self.fitres_file = self.fitres_files[0]
 
         self.output["predictions_filename"] = self.predictions_filename
+        self.output["predictions_filenames"] = self.predictions_filenames
         self.output["model_filename"] = self.output_pk_file
         self.validate_model()
 
@@ -64,7 +90,7 @@ class NearestNeighborPyClassifier(Classifier):
 #SBATCH --time=00:55:00
 #SBATCH --nodes=1
 #SBATCH --ntasks=1
-#SBATCH --cpus-per-task=1
+#SBATCH --cpus-per-task={n_jobs}
 #SBATCH --partition=broadwl
 #SBATCH --output=output.log
 #SBATCH --account=pi-rkessler
@@ -72,6 +98,7 @@ class NearestNeighborPyClassifier(Classifier):
 
 source activate {conda_env}
 echo `which python`
+{pythonpath}
 cd {path_to_classifier}
 python nearest_neighbor_code.py {command_opts}
 if [ $? -ne 0 ]; then
@@ -86,11 +113,17 @@ fi
             "path_to_classifier": self.path_to_classifier,
             "command_opts": command,
             "done_file": self.done_file,
+            "n_jobs": self.n_jobs,
+            "pythonpath": get_pythonpath_export(),
         }
         slurm_script = self.slurm.format(**format_dict)
 
         old_hash = self.get_old_hash()
         new_hash = self.get_hash_from_string(slurm_script)
+        if self.mode == Classifier.TRAIN:
+            # Tag the model with this task's hash, so predict jobs can check they have the model they were set up for
+            format_dict["command_opts"] = f"--model_version {new_hash} {command}"
+            slurm_script = self.slurm.format(**format_dict)
 
         if force_refresh or new_hash != old_hash:
             self.logger.debug("Regenerating")
@@ -102,37 +135,58 @@ fi
                 f.write(slurm_script)
             self.save_new_hash(new_hash)
             self.logger.info(f"Submitting batch job {slurm_output_file}")
-            subprocess.run(["sbatch", slurm_output_file], cwd=self.output_dir)
+            self.submit_job(slurm_output_file)
         else:
             self.logger.info("Hash check passed, not rerunning")
             self.should_be_done()
         return True
 
+    def get_knn_options(self):
+        """ Command line options for the non-default settings, so the hashes of existing tasks don't change """
+        options = []
+        if self.mode == Classifier.TRAIN:
+            if self.algorithm != "kd_tree":
+                options.append(f"--algorithm {self.algorithm}")
+            if self.n_neighbors != 50:
+                options.append(f"--n_neighbors {self.n_neighbors}")
+            if self.float32:
+                options.append("--float32")
+        if self.n_jobs != 1:
+            options.append(f"--n_jobs {self.n_jobs}")
+        if self.chunk_size != 100000:
+            options.append(f"--chunk_size {self.chunk_size}")
+        return "".join(o + " " for o in options)
+
     def predict(self, force_refresh):
         model = self.options.get("MODEL")
         if model is None:
             self.logger.error("If you are in predict model, please specify a MODEL in OPTS. Either a file location or a training task name.")
             return False
+        version = None
         if not os.path.exists(get_output_loc(model)):
             # If its not a file, it must be a task
             for t in self.dependencies:
                 if model == t.name:
                     self.logger.debug(f"Found task dependency {t.name} with model file {t.output['model_filename']}")
                     model = t.output["model_filename"]
+                    version = t.get_old_hash()
         else:
             model = get_output_loc(model)
         types = " ".join([str(a) for a in self.get_simulation_dependency().output["types_dict"]["IA"]])
         if not types:
             types = "1"
+        # The fitres files go first, as the --output and --features lists would swallow anything after them
         command = (
+            f"{' '.join(self.fitres_files)} "
             f"-p "
+            f"{self.get_knn_options()}"
             f"--features {self.features} "
             f"--done_file {self.done_file} "
             f"--model {model} "
+            f"{'' if version is None else f'--model_version {version} '}"
             f"--types {types} "
             f"--name {self.get_prob_column_name()} "
-            f"--output {self.predictions_filename} "
-            f"{self.fitres_file}"
+            f"--output {' '.join(self.predictions_filenames)}"
         )
         return self.classify(force_refresh, command)
 
@@ -142,13 +196,14 @@ fi
             self.logger.error("No Ia types for a training sim!")
             return False
         command = (
+            f"{self.fitres_file} "
+            f"{self.get_knn_options()}"
             f"--features {self.features} "
             f"--done_file {self.done_file} "
             f"--model {self.output_pk_file} "
             f"--types {types} "
             f"--name {self.get_prob_column_name()} "
-            f"--output {self.predictions_filename} "
-            f"{self.fitres_file}"
+            f"--output {self.predictions_filename}"
         )
         return self.classify(force_refresh, command)
 
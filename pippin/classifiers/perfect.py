@@ -2,10 +2,10 @@ import os
 import shutil
 
 import pandas as pd
-from astropy.io import fits
 import numpy as np
 from pippin.classifiers.classifier import Classifier
 from pippin.config import chown_dir, mkdirs
+from pippin.photometry import get_header_index
 from pippin.task import Task
 
 
@@ -30,20 +30,23 @@ class PerfectClassifier(Classifier):
         name : name given in the yml
         output_dir: top level output directory
         prob_column_name: name of the column to get probabilities out of
-        predictions_filename: location of csv filename with id/probs
-
+        predictions_filename: location of csv filename with id/probs for the first version
+        predictions_filenames: the csv file for each version
 
+    One task classifies every version of the simulation.
     """
 
-    def __init__(self, name, output_dir, dependencies, mode, options, index=0, model_name=None):
-        super().__init__(name, output_dir, dependencies, mode, options, index=index, model_name=model_name)
-        self.output_file = None
+    BATCHED = True
+
+    def __init__(self, name, output_dir, dependencies, mode, options, index=0, model_name=None, indexes=None):
+        super().__init__(name, output_dir, dependencies, mode, options, index=index, model_name=model_name, indexes=indexes)
         self.passed = False
         self.num_jobs = 1  # This is the default. Can get this from options if needed.
         self.prob_ia = options.get("PROB_IA", 1.0)
         self.prob_cc = options.get("PROB_CC", 0.0)
-        self.output_file = os.path.join(self.output_dir, "predictions.csv")
-        self.output.update({"predictions_filename": self.output_file})
+        self.output_files = self.get_batched_filenames()
+        self.output_file = self.output_files[0]
+        self.output.update({"predictions_filename": self.output_file, "predictions_filenames": self.output_files})
 
     def get_unique_name(self):
         return self.name
@@ -63,43 +66,24 @@ class PerfectClassifier(Classifier):
             self.logger.info("Hash check passed, not rerunning")
             return False
 
+    def get_predictions(self, phot_dir, types):
+        index = get_header_index(phot_dir)
+        if index.empty:
+            Task.fail_config(f"No HEAD fits files or light curves found in {phot_dir}!")
+        is_ia = np.isin(index["SNTYPE"], types["IA"])
+        prob = (is_ia * self.prob_ia) + (~is_ia * self.prob_cc)
+        return pd.DataFrame({"CID": index["SNID"], self.get_prob_column_name(): prob})
+
     def classify(self, force_refresh):
         new_hash = self.check_regenerate(force_refresh)
         if new_hash:
             shutil.rmtree(self.output_dir, ignore_errors=True)
             mkdirs(self.output_dir)
             try:
-                name = self.get_prob_column_name()
-                cid = "CID"
                 s = self.get_simulation_dependency()
-                df = None
-                phot_dir = s.output["photometry_dirs"][self.index]
-                headers = [os.path.join(phot_dir, a) for a in os.listdir(phot_dir) if "HEAD" in a]
-                if not headers:
-                    Task.fail_config(f"No HEAD fits files found in {phot_dir}!")
-                else:
-                    types = self.get_simulation_dependency().output["types_dict"]
-                    self.logger.debug(f"Input types are {types}")
-
-                    for h in headers:
-                        with fits.open(h) as hdul:
-                            data = hdul[1].data
-                            snid = np.array(data.field("SNID"))
-                            sntype = np.array(data.field("SNTYPE")).astype(np.int64)
-                            is_ia = np.isin(sntype, types["IA"])
-                            prob = (is_ia * self.prob_ia) + (~is_ia * self.prob_cc)
-
-                            dataframe = pd.DataFrame({cid: snid, name: prob})
-                            dataframe[cid] = dataframe[cid].apply(str)
-                            dataframe[cid] = dataframe[cid].str.strip()
-                            if df is None:
-                                df = dataframe
-                            else:
-                                df = pd.concat([df, dataframe])
-                    df.drop_duplicates(subset=cid, inplace=True)
-
-                self.logger.info(f"Saving probabilities to {self.output_file}")
-                df.to_csv(self.output_file, index=False, float_format="%0.4f")
+                types = s.output["types_dict"]
+                self.logger.debug(f"Input types are {types}")
+                self.save_batched_predictions(lambda i: self.get_predictions(s.output["photometry_dirs"][i], types))
                 chown_dir(self.output_dir)
                 with open(self.done_file, "w") as f:
                     f.write("SUCCESS")
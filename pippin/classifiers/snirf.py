@@ -1,6 +1,5 @@
 import os
 import shutil
-import subprocess
 import pandas as pd
 from pathlib import Path
 
@@ -38,6 +37,8 @@ class SnirfClassifier(Classifier):
 
     """
 
+    can_run_locally = True
+
     def __init__(self, name, output_dir, dependencies, mode, options, index=0, model_name=None):
         super().__init__(name, output_dir, dependencies, mode, options, index=index, model_name=model_name)
         self.global_config = get_config()
@@ -97,7 +98,7 @@ python SNIRF.py {command_opts}
                 f.write(slurm_script)
             self.save_new_hash(new_hash)
             self.logger.info(f"Submitting batch job {slurm_output_file}")
-            subprocess.run(["sbatch", slurm_output_file], cwd=self.output_dir)
+            self.submit_job(slurm_output_file)
         else:
             self.logger.info("Hash check passed, not rerunning")
             self.should_be_done()
@@ -236,6 +236,9 @@ echo "#################TIMING  Classifier finished:   `date`"
 
         return True
 
+    def get_done_files(self):
+        return [self.done_file, self.done_file2]
+
     def _check_completion(self, squeue):
         if os.path.exists(self.done_file) or os.path.exists(self.done_file2):
             self.logger.info("Job complete")
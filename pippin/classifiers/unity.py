@@ -1,12 +1,11 @@
 import os
 import shutil
-import subprocess
 
 import pandas as pd
-from astropy.io import fits
 import numpy as np
 from pippin.classifiers.classifier import Classifier
 from pippin.config import chown_dir, mkdirs
+from pippin.photometry import get_header_index
 from pippin.task import Task
 
 
@@ -68,35 +67,9 @@ class UnityClassifier(Classifier):
                 name = self.get_prob_column_name()
                 cid = "CID"
                 s = self.get_simulation_dependency()
-                df = None
                 phot_dir = s.output["photometry_dirs"][self.index]
-                headers = [os.path.join(phot_dir, a) for a in os.listdir(phot_dir) if "HEAD" in a]
-                if len(headers) == 0:
-                    self.logger.warning(f"No HEAD fits files found in {phot_dir}! Going to do it manually, this may not work.")
-
-                    cmd = "grep --exclude-dir=* SNID: * | awk -F ':' '{print $3}'"
-                    self.logger.debug(f"Running command   {cmd}")
-                    process = subprocess.run(cmd, capture_output=True, cwd=phot_dir, shell=True)
-                    output = process.stdout.decode("ascii").split("\n")
-                    output = [x for x in output if x]
-
-                    snid = [x.strip() for x in output]
-                    df = pd.DataFrame({cid: snid, name: np.ones(len(snid))})
-                    df.drop_duplicates(subset=cid, inplace=True)
-
-                else:
-                    for h in headers:
-                        with fits.open(h) as hdul:
-                            data = hdul[1].data
-                            snid = np.array(data.field("SNID"))
-                            dataframe = pd.DataFrame({cid: snid, name: np.ones(snid.shape)})
-                            dataframe[cid] = dataframe[cid].apply(str)
-                            dataframe[cid] = dataframe[cid].str.strip()
-                            if df is None:
-                                df = dataframe
-                            else:
-                                df = pd.concat([df, dataframe])
-                    df.drop_duplicates(subset=cid, inplace=True)
+                index = get_header_index(phot_dir)
+                df = pd.DataFrame({cid: index["SNID"], name: np.ones(index.shape[0])})
 
                 self.logger.info(f"Saving probabilities to {self.output_file}")
                 df.to_csv(self.output_file, index=False, float_format="%0.4f")
@@ -5,6 +5,9 @@ import hashlib
 import os
 import shutil
 import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 
 def singleton(fn):
@@ -46,6 +49,9 @@ def get_config(initial_path=None, overwrites=None):
     if overwrites is not None:
         config = merge_dict(config, overwrites)
 
+    # DATA_DIRS may have been overridden, so forget any previously resolved paths
+    clear_data_loc_cache()
+
     for i, path in enumerate(config["DATA_DIRS"]):
         updated = get_data_loc(path, extra=this_dir)
         if updated is None:
@@ -67,31 +73,68 @@ def get_output_dir():
     return output_dir
 
 
-def get_data_loc(path, extra=None):
-    if extra is None:
-        data_dirs = get_config()["DATA_DIRS"]
-        if not isinstance(data_dirs, list):
-            data_dirs = [data_dirs]
-    else:
-        data_dirs = [extra]
+_data_loc_cache = {}  # (path, data_dirs) -> (resolved path or None, error message or None)
+_data_loc_stats = {"hits": 0, "misses": 0}
+
+
+def clear_data_loc_cache():
+    _data_loc_cache.clear()
+    _data_loc_stats["hits"] = 0
+    _data_loc_stats["misses"] = 0
+
+
+def get_data_loc_stats():
+    """ Number of get_data_loc calls answered from the cache (hits) and from the filesystem (misses) """
+    return dict(_data_loc_stats)
+
+
+def _resolve_data_loc(path, data_dirs):
     if "$" in path:
         path = os.path.expandvars(path)
         if "$" in path:
-            logging.error(f"Unable to resolve the variable in {path}, please check to see if it is set in your environment")
-            return None
-        return path
+            return None, f"Unable to resolve the variable in {path}, please check to see if it is set in your environment"
+        return path, None
     if path.startswith("/"):
         if not os.path.exists(path):
-            logging.error(f"Got an absolute path that doesn't exist: {path}")
-            return None
-        return path
+            return None, f"Got an absolute path that doesn't exist: {path}"
+        return path, None
     else:
         for data_dir in data_dirs:
             new_path = os.path.join(data_dir, path)
             if os.path.exists(new_path):
-                return new_path
-        logging.error(f"Unable to find relative path {path} when searching through the data directories: {data_dirs}")
-        return None
+                return new_path, None
+        return None, f"Unable to find relative path {path} when searching through the data directories: {data_dirs}"
+
+
+def get_data_loc(path, extra=None, quiet=False):
+    """ Resolves a path against the data directories (or extra if given).
+
+    Results, including paths which could not be found, are cached per path and set of data directories,
+    so the same file is only looked up once. The cache is reset whenever the global config is loaded.
+
+    :param path: absolute path, path relative to a data dir, or path with environment variables in it
+    :param extra: search only this directory instead of the data dirs
+    :param quiet: do not log an error if the path cannot be resolved
+    :return: the resolved path, or None if it cannot be found
+    """
+    if extra is None:
+        data_dirs = get_config()["DATA_DIRS"]
+        if not isinstance(data_dirs, list):
+            data_dirs = [data_dirs]
+    else:
+        data_dirs = [extra]
+    key = (path, tuple(data_dirs))
+    result = _data_loc_cache.get(key)
+    if result is None:
+        _data_loc_stats["misses"] += 1
+        result = _resolve_data_loc(path, data_dirs)
+        _data_loc_cache[key] = result
+    else:
+        _data_loc_stats["hits"] += 1
+    resolved, error = result
+    if error is not None and not quiet:
+        logging.error(error)
+    return resolved
 
 
 def get_output_loc(path):
@@ -103,6 +146,15 @@ def get_output_loc(path):
         return os.path.join(get_output_dir(), path)
 
 
+def get_pythonpath_export():
+    """ A bash line letting job scripts import pippin, for the standalone scripts which use pippin.io.fitres.
+
+    The Pippin directory is appended to PYTHONPATH, rather than put first, so it can't shadow the job's own packages.
+    """
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    return f'export PYTHONPATH="${{PYTHONPATH:+$PYTHONPATH:}}{root}"'
+
+
 def get_hash(input_string):
     return hashlib.sha256(input_string.encode("utf-8")).hexdigest()
 
@@ -161,7 +213,91 @@ def chown_file(path):
         logger.debug(f"Did not chown {path}")
 
 
-def chown_dir(directory):
+_chowned_dirs = {}  # directory -> (mtime_ns, subdirectories) when we last made sure everything in it was correct
+_chowned_lock = threading.Lock()
+MAX_CHOWNED_DIRS = 100000  # The registry is cleared past this many directories, so it can't grow without bound
+
+
+def _fix_entry(path, is_dir, entry_stat, group_id):
+    # Files made read-only (like those hardlinked from the task cache) stay that way, so the group can't change them either
+    if is_dir:
+        mode = 0o770
+    else:
+        mode = 0o660 if entry_stat.st_mode & stat.S_IWUSR else 0o440
+    if entry_stat.st_gid != group_id:
+        os.chown(path, -1, group_id, follow_symlinks=False)
+    if stat.S_IMODE(entry_stat.st_mode) != mode:
+        os.chmod(path, mode)
+
+
+def _chown_entries(directory, group_id, skip_unchanged):
+    """ Fix the group and permissions of everything directly inside directory
+
+    :return: the subdirectories to process next
+    """
+    logger = get_logger()
+    try:
+        dir_stat = os.stat(directory)
+    except OSError:
+        return []
+    if skip_unchanged:
+        with _chowned_lock:
+            previous = _chowned_dirs.get(directory)
+        if previous is not None and previous[0] == dir_stat.st_mtime_ns:
+            return previous[1]
+
+    subdirs = []
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        logger.warning(f"Chown error: cannot list {directory}")
+        return []
+    for entry in entries:
+        if entry.is_symlink():
+            continue
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+            _fix_entry(entry.path, is_dir, entry.stat(follow_symlinks=False), group_id)
+        except Exception:
+            logger.warning(f"Chown error: {entry.path}")
+            continue
+        if is_dir:
+            subdirs.append(entry.path)
+    # Like git's racy timestamps, don't trust a directory modified so recently that a change might share its mtime
+    if skip_unchanged and dir_stat.st_mtime_ns < time.time_ns() - 2 * 10 ** 9:
+        with _chowned_lock:
+            if len(_chowned_dirs) >= MAX_CHOWNED_DIRS:
+                _chowned_dirs.clear()
+            _chowned_dirs[directory] = (dir_stat.st_mtime_ns, subdirs)
+    return subdirs
+
+
+def forget_chowned(directory):
+    """ Drops what we remember about directory and everything under it, once its task has finished with it """
+    directory = os.path.abspath(directory)
+    with _chowned_lock:
+        for d in [d for d in _chowned_dirs if d == directory or d.startswith(directory + os.sep)]:
+            del _chowned_dirs[d]
+
+
+def _chown_tree(directory, group_id, max_workers=8, skip_unchanged=True):
+    """ Walks directory with a thread pool, fixing the group and permissions of everything under it.
+
+    Entries which already have the right group and mode are left alone. With skip_unchanged, directories whose
+    modification time has not changed since we last processed them (so nothing has been added or removed) are
+    not listed again, only their subdirectories are revisited. The directory mtime is the only marker: a file
+    rewritten in place or chmod'ed without adding or removing anything isn't looked at again, so whatever does
+    that should fix its permissions itself with chown_file.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = [executor.submit(_chown_entries, directory, group_id, skip_unchanged)]
+        while pending:
+            future = pending.pop()
+            for subdir in future.result():
+                pending.append(executor.submit(_chown_entries, subdir, group_id, skip_unchanged))
+
+
+def chown_dir(directory, skip_unchanged=True):
     try:
         import grp
     except ModuleNotFoundError:
@@ -172,26 +308,15 @@ def chown_dir(directory):
     try:
         groupinfo = grp.getgrnam(global_config["SNANA"]["group"])
         group_id = groupinfo.gr_gid
-        shutil.chown(directory, group=global_config["SNANA"]["group"])
-        os.chmod(directory, 0o770)
+        dir_stat = os.stat(directory)
+        if dir_stat.st_gid != group_id:
+            shutil.chown(directory, group=global_config["SNANA"]["group"])
+        if stat.S_IMODE(dir_stat.st_mode) != 0o770:
+            os.chmod(directory, 0o770)
     except Exception as e:
         logger.exception(f"Chown error: {directory}")
         return
-    for root, dirs, files in os.walk(directory):
-        for d in dirs:
-            if not os.path.islink(os.path.join(root, d)):
-                try:
-                    os.chown(os.path.join(root, d), -1, group_id, follow_symlinks=False)
-                    os.chmod(os.path.join(root, d), 0o770)
-                except Exception as e:
-                    logger.warning(f"Chown error: {os.path.join(root, d)}")
-        for f in files:
-            if not os.path.islink(os.path.join(root, f)):
-                try:
-                    os.chown(os.path.join(root, f), -1, group_id, follow_symlinks=False)
-                    os.chmod(os.path.join(root, f), 0o660)
-                except Exception as e:
-                    logger.warning(f"Chown error: {os.path.join(root, f)}")
+    _chown_tree(os.path.abspath(directory), group_id, skip_unchanged=skip_unchanged)
 
 
 def ensure_list(a):
@@ -1,5 +1,4 @@
 import shutil
-import subprocess
 import os
 from pathlib import Path
 import numpy as np
@@ -38,6 +37,8 @@ class CosmoMC(Task):  # TODO: Define the location of the output so we can run th
 
     """
 
+    can_run_locally = True
+
     def __init__(self, name, output_dir, options, global_config, dependencies=None):
         super().__init__(name, output_dir, dependencies=dependencies)
         self.options = options
@@ -134,6 +135,9 @@ else
 fi
 """
 
+    def get_done_files(self):
+        return [self.done_file] + [os.path.join(self.output_dir, d) for d in self.done_files]
+
     def _check_completion(self, squeue):
         if os.path.exists(self.done_file):
             self.logger.debug(f"Done file found at f{self.done_file}")
@@ -262,7 +266,7 @@ fi
                     os.symlink(original_data_dir, new_data_dir, target_is_directory=True)
 
                 self.logger.info(f"Submitting batch job for data prep")
-                subprocess.run(["sbatch", slurm_output_file], cwd=self.output_dir)
+                self.submit_job(slurm_output_file)
             else:
                 self.should_be_done()
                 self.logger.info("Hash check passed, not rerunning")
@@ -1,6 +1,5 @@
 import inspect
 import shutil
-import subprocess
 import os
 from pathlib import Path
 
@@ -36,6 +35,8 @@ class CreateCov(ConfigBasedExecutable):
 
     """
 
+    can_run_locally = True
+
     def __init__(self, name, output_dir, options, global_config, dependencies=None, index=0):
 
         base_file = get_data_loc("create_cov/input_file.txt")
@@ -165,7 +166,7 @@ python create_covariance_staticbins.py {input_file} {done_file}
                 f.write(final_slurm)
 
             self.logger.info(f"Submitting batch job for data prep")
-            subprocess.run(["sbatch", slurm_output_file], cwd=self.output_dir)
+            self.submit_job(slurm_output_file)
         else:
             self.should_be_done()
             self.logger.info("Hash check passed, not rerunning")
@@ -0,0 +1,114 @@
+import heapq
+from collections import deque
+
+
+class TaskGraph:
+    """ Keeps track of which tasks are waiting, ready to launch or blocked.
+
+    Each waiting task keeps a count of its unfinished dependencies, and is pushed onto a ready heap
+    once that count hits zero, so finding something to submit does not rescan every waiting task.
+    The heap is ordered by critical path length (the most expensive chain of tasks starting at a task), so the
+    tasks holding up the most downstream work go first, and then by the order the tasks were created in.
+
+    :param tasks: the tasks, with their dependencies
+    :param costs: optional dict of estimated cost per task, such as expected wall time. Every task costs 1 if not given.
+    """
+
+    def __init__(self, tasks, costs=None):
+        self.tasks = list(tasks)
+        self.costs = costs if costs is not None else {t: 1 for t in self.tasks}
+        self.order = {t: i for i, t in enumerate(self.tasks)}
+        self.dependents = {t: [] for t in self.tasks}
+        self.num_pending = {}
+        for t in self.tasks:
+            deps = set(d for d in t.dependencies if d in self.order)
+            self.num_pending[t] = len(deps)
+            for d in deps:
+                self.dependents[d].append(t)
+        self.critical_path = self._get_critical_paths()
+
+        self.waiting = set(self.tasks)
+        self.ready = []
+        for t in self.tasks:
+            if self.num_pending[t] == 0:
+                self._push(t)
+
+    def _get_critical_paths(self):
+        """ Total cost along the most expensive path from each task to the end of the graph, including itself """
+        num_pending = dict(self.num_pending)
+        queue = deque(t for t in self.tasks if num_pending[t] == 0)
+        topological = []
+        while queue:
+            t = queue.popleft()
+            topological.append(t)
+            for d in self.dependents[t]:
+                num_pending[d] -= 1
+                if num_pending[d] == 0:
+                    queue.append(d)
+        assert len(topological) == len(self.tasks), "Task dependencies contain a cycle"
+
+        critical_path = {}
+        for t in reversed(topological):
+            critical_path[t] = self.costs.get(t, 1) + max((critical_path[d] for d in self.dependents[t]), default=0)
+        return critical_path
+
+    def _push(self, t):
+        heapq.heappush(self.ready, (-self.critical_path[t], self.order[t], t))
+
+    def pop_ready(self, can_run=None):
+        """ Removes and returns the highest priority task whose dependencies are all done.
+
+        :param can_run: optional function of a task, returning false if it cannot be launched right now (eg queue limits)
+        :return: the task, or None if there is nothing that can run
+        """
+        skipped = []
+        result = None
+        while self.ready:
+            item = heapq.heappop(self.ready)
+            t = item[2]
+            if t not in self.waiting:
+                continue
+            if can_run is None or can_run(t):
+                self.waiting.remove(t)
+                result = t
+                break
+            skipped.append(item)
+        for item in skipped:
+            heapq.heappush(self.ready, item)
+        return result
+
+    def mark_done(self, t):
+        """ Tells the graph t finished successfully, releasing any dependents which are now ready """
+        for d in self.dependents.get(t, []):
+            self.num_pending[d] -= 1
+            if self.num_pending[d] == 0 and d in self.waiting:
+                self._push(d)
+
+    def block(self, t):
+        """ Removes every waiting task downstream of t
+
+        :return: the newly blocked tasks, in creation order
+        """
+        blocked = []
+        seen = {t}
+        queue = deque([t])
+        while queue:
+            for d in self.dependents.get(queue.popleft(), []):
+                if d in seen:
+                    continue
+                seen.add(d)
+                queue.append(d)
+                if d in self.waiting:
+                    self.waiting.remove(d)
+                    blocked.append(d)
+        return sorted(blocked, key=self.order.get)
+
+    def get_makespan(self):
+        """ The length of the longest critical path, ie how long everything takes given unlimited jobs """
+        return max(self.critical_path.values(), default=0)
+
+    def get_waiting(self):
+        return sorted(self.waiting, key=self.order.get)
+
+    def __len__(self):
+        return len(self.waiting)
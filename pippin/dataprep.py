@@ -1,10 +1,10 @@
 import shutil
-import subprocess
 import os
 from collections import OrderedDict
 from pathlib import Path
 
 from pippin.config import mkdirs, get_output_loc, get_config, get_data_loc
+from pippin.sntypes import TypeLookup
 from pippin.task import Task
 
 
@@ -21,11 +21,14 @@ class DataPrep(Task):  # TODO: Define the location of the output so we can run t
         raw_dir: input directory
         clump_file: clumping file with estimate of t0 for each event
         types_dict: dict mapping IA and NONIA to types
+        type_lookup: TypeLookup built from types_dict, for labelling SNTYPE columns
         types: dict mapping numbers to types, used by Supernnova
         blind: bool - whether or not to blind cosmo results
         is_sim: bool - whether or not the input is a simulation
     """
 
+    can_run_locally = True
+
     def __init__(self, name, output_dir, options, global_config, dependencies=None):
         super().__init__(name, output_dir, dependencies=dependencies)
         self.options = options
@@ -69,6 +72,7 @@ class DataPrep(Task):  # TODO: Define the location of the output so we can run t
         self.logger.debug(f"\tIA types are {self.types_dict['IA']}")
         self.logger.debug(f"\tNONIA types are {self.types_dict['NONIA']}")
         self.output["types_dict"] = self.types_dict
+        self.output["type_lookup"] = TypeLookup(self.types_dict)
         self.types = OrderedDict()
         for n in self.types_dict["IA"]:
             self.types.update({n: "Ia"})
@@ -153,7 +157,7 @@ fi
                 f.write(command_string)
 
             self.logger.info(f"Submitting batch job for data prep")
-            subprocess.run(["sbatch", slurm_output_file], cwd=self.output_dir)
+            self.submit_job(slurm_output_file)
         else:
             self.should_be_done()
             self.logger.info("Hash check passed, not rerunning")
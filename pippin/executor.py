@@ -0,0 +1,204 @@
+import multiprocessing
+import os
+import re
+import subprocess
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from pippin.config import get_config, get_logger
+
+
+class Executor(ABC):
+    """ Runs the job scripts tasks write out. Tasks still find out they are finished through their done files. """
+
+    name = None
+
+    @abstractmethod
+    def submit(self, script, cwd):
+        """ Starts the job script, returning once it has been submitted.
+
+        :param script: path to the job script, with #SBATCH directives
+        :param cwd: directory to run from
+        """
+        pass
+
+    @abstractmethod
+    def get_num_jobs(self, match, squeue):
+        """ Number of this executor's jobs whose name contains match, or None if it can't be known right now """
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class SlurmExecutor(Executor):
+    """ Submits job scripts with sbatch.
+
+    :param partition: if set, overrides the partition in the job scripts
+    :param account: if set, overrides the account in the job scripts
+    """
+
+    name = "slurm"
+
+    def __init__(self, partition=None, account=None):
+        self.partition = partition
+        self.account = account
+
+    def get_command(self, script):
+        command = ["sbatch"]
+        if self.partition:
+            command.append(f"--partition={self.partition}")
+        if self.account:
+            command.append(f"--account={self.account}")
+        return command + [script]
+
+    def submit(self, script, cwd):
+        subprocess.run(self.get_command(script), cwd=cwd)
+
+    def get_num_jobs(self, match, squeue):
+        if squeue is None:
+            return None
+        return squeue.count(match)
+
+
+def get_directives(script):
+    """ The #SBATCH options of a job script, as a dict of option name (without the dashes) to value """
+    directives = {}
+    with open(script) as f:
+        for line in f:
+            m = re.match(r"#SBATCH\s+--?([\w-]+)(?:[=\s]\s*(\S+))?", line)
+            if m:
+                directives[m.group(1)] = m.group(2)
+    return directives
+
+
+def get_array_indexes(array):
+    """ The task ids of a slurm --array option like 1-4, 0,2,5 or 1-10:2. Any %limit is ignored. """
+    indexes = []
+    for part in array.split("%")[0].split(","):
+        step = 1
+        if ":" in part:
+            part, step = part.split(":")
+            step = int(step)
+        if "-" in part:
+            start, end = part.split("-")
+            indexes += list(range(int(start), int(end) + 1, step))
+        else:
+            indexes.append(int(part))
+    return indexes
+
+
+class LocalPoolExecutor(Executor):
+    """ Runs job scripts with bash on this machine, at most max_workers at once, instead of waiting in the slurm queue.
+
+    The SLURM_ environment variables the scripts use are set, array jobs are run as one process per task id, and output
+    goes to the file given by --output (relative to the script's directory) like it would under slurm.
+
+    :param max_workers: the most scripts to run at the same time
+    """
+
+    name = "local"
+
+    def __init__(self, max_workers=4):
+        self.logger = get_logger()
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="local_job")
+        self.lock = threading.Lock()
+        self.jobs = []  # (job name, future)
+
+    def get_env(self, directives, job_name, index=None):
+        env = dict(os.environ)
+        env["SLURM_JOB_NAME"] = job_name
+        env["SLURM_JOB_ID"] = "local"
+        env["SLURM_CPUS_PER_TASK"] = directives.get("cpus-per-task") or "1"
+        env["SLURM_NTASKS"] = directives.get("ntasks") or "1"
+        if index is not None:
+            env["SLURM_ARRAY_TASK_ID"] = str(index)
+        return env
+
+    def get_output_file(self, directives, cwd, index=None):
+        output = directives.get("output") or "slurm-local.out"
+        output = output.replace("%j", "local").replace("%A", "local").replace("%a", str(index) if index is not None else "")
+        return os.path.join(cwd, output)
+
+    def run(self, script, cwd, env, output_file):
+        with open(output_file, "a") as f:
+            result = subprocess.run(["bash", script], cwd=cwd, env=env, stdout=f, stderr=subprocess.STDOUT)
+        if result.returncode != 0:
+            self.logger.warning(f"Local job {script} exited with code {result.returncode}, see {output_file}")
+        return result.returncode
+
+    def submit(self, script, cwd):
+        directives = get_directives(script)
+        job_name = directives.get("job-name") or os.path.basename(script)
+        indexes = get_array_indexes(directives["array"]) if directives.get("array") else [None]
+        self.logger.debug(f"Running {script} locally as {len(indexes)} jobs")
+        with self.lock:
+            for index in indexes:
+                env = self.get_env(directives, job_name, index)
+                future = self.pool.submit(self.run, script, cwd, env, self.get_output_file(directives, cwd, index))
+                self.jobs.append((job_name, future))
+
+    def get_num_jobs(self, match, squeue):
+        with self.lock:
+            self.jobs = [(name, future) for name, future in self.jobs if not future.done()]
+            return sum(1 for name, _ in self.jobs if match in name)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+
+def get_process_pool(max_workers):
+    """ A pool of python processes, for tasks like the Aggregator and Merger which do their work in the manager rather than in jobs.
+
+    Spawned rather than forked, as the manager has other threads (such as the local job pool) which may hold a lock
+    a forked child would inherit and deadlock on.
+    """
+    return ProcessPoolExecutor(max_workers=max(1, max_workers), mp_context=multiprocessing.get_context("spawn"))
+
+
+_slurm = None
+
+
+def get_default_executor():
+    """ The slurm executor used by tasks which haven't been given one, with the partition and account from the config """
+    global _slurm
+    if _slurm is None:
+        config = get_config().get("EXECUTOR") or {}
+        _slurm = SlurmExecutor(config.get("partition"), config.get("account"))
+    return _slurm
+
+
+def get_executors(tasks, global_config=None, history=None):
+    """ Chooses how each task's job scripts are run, from the EXECUTOR section of the global config.
+
+    Tasks whose type is in local_tasks, or whose wall time in previous runs was under local_max_wall_time seconds, run on
+    a local pool of local_workers processes. Everything else is submitted to slurm. Only tasks which submit their own job
+    scripts (can_run_locally) can run locally, SNANA submits the sim and fit jobs itself.
+
+    :param history: the WallTimeHistory, used for the estimated wall times
+    :return: dict of task to executor, and the local executor (None if no task uses it)
+    """
+    if global_config is None:
+        global_config = get_config()
+    config = global_config.get("EXECUTOR", {}) or {}
+    local_types = config.get("local_tasks", []) or []
+    max_wall_time = config.get("local_max_wall_time", 0) or 0
+    slurm = SlurmExecutor(config.get("partition"), config.get("account"))
+
+    local = None
+    executors = {}
+    for t in tasks:
+        run_local = False
+        if t.can_run_locally:
+            run_local = t.__class__.__name__ in local_types
+            if not run_local and max_wall_time and history is not None and history.has_estimate(t):
+                run_local = history.estimate(t) < max_wall_time
+        if run_local:
+            if local is None:
+                local = LocalPoolExecutor(config.get("local_workers", 4))
+            executors[t] = local
+        else:
+            executors[t] = slurm
+    return executors, local
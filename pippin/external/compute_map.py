@@ -3,6 +3,14 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from scipy.interpolate import griddata
 import os
+import sys
+
+try:
+    from pippin.io.fitres import load_fitres
+except ModuleNotFoundError:
+    # Run as a script somewhere without Pippin on the PYTHONPATH, so find it from where this file is
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+    from pippin.io.fitres import load_fitres
 
 field_names = ["SHALLOW", "DEEP"]
 bands = ["g", "r", "i", "z"]
@@ -17,7 +25,7 @@ def parse_data(filename):
     print(f"Parsing {filename}")
     filename_obs = filename.replace(".pkl", ".fitres")
     print(f"Reading FITRES dump file {filename_obs}")
-    all_data = pd.read_csv(filename_obs, delim_whitespace=True, comment="#")
+    all_data = load_fitres(filename_obs)
 
     # Generate extra columns
     all_data["ERRRATIO"] = all_data["FLUXCAL_DATA_ERR"] / all_data["FLUXERRCALC_SIM"]
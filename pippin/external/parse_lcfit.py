@@ -8,6 +8,13 @@ import logging
 import yaml
 from astropy.cosmology import FlatLambdaCDM
 
+try:
+    from pippin.io.fitres import load_fitres
+except ModuleNotFoundError:
+    # Run as a script somewhere without Pippin on the PYTHONPATH, so find it from where this file is
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+    from pippin.io.fitres import load_fitres
+
 
 def setup_logging():
     fmt = "[%(levelname)8s |%(funcName)21s:%(lineno)3d]   %(message)s"
@@ -45,7 +52,7 @@ def add_muref(df, filename, alpha=0.14, beta=3.1, om=0.311, h0=70, MB=-19.361):
 def load_file(infile, outfile):
 
     logging.info(f"Attempting to load in original file {infile}")
-    df = pd.read_csv(infile, delim_whitespace=True, comment="#")
+    df = load_fitres(infile)
 
     df.replace(-999, np.nan, inplace=True)
     add_muref(df, infile)
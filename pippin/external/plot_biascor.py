@@ -9,6 +9,13 @@ import logging
 import matplotlib.pyplot as plt
 from scipy.interpolate import interp1d
 
+try:
+    from pippin.io.fitres import load_fitres
+except ModuleNotFoundError:
+    # Run as a script somewhere without Pippin on the PYTHONPATH, so find it from where this file is
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+    from pippin.io.fitres import load_fitres
+
 
 def setup_logging():
     fmt = "[%(levelname)8s |%(funcName)21s:%(lineno)3d]   %(message)s"
@@ -152,7 +159,7 @@ def make_hubble_plot(fitres_file, m0diff_file, prob_col_name, args):
     name, sim_num, *_ = fitres_file.split("_")
     sim_num = int(sim_num)
 
-    df = pd.read_csv(fitres_file, delim_whitespace=True, comment="#")
+    df = load_fitres(fitres_file)
     dfm = pd.read_csv(m0diff_file)
     dfm = dfm[(dfm.name == name) & (dfm.sim_num == sim_num) & (dfm.muopt_num == 0) & (dfm.fitopt_num == 0)]
 
@@ -0,0 +1,88 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from pippin.config import get_logger
+
+PREFETCH_EXTENSIONS = (".input", ".nml", ".fitopts", ".yml", ".yaml", ".txt")  # Text inputs that tasks read with read_file
+MAX_PREFETCH_SIZE = 1024 ** 2  # Larger files aren't prefetched, they aren't base files
+MAX_CACHE_SIZE = 64 * 1024 ** 2  # Least recently read files are dropped once the cached contents are bigger than this
+
+_contents = OrderedDict()  # absolute path -> (mtime_ns, size, contents), least recently read first
+_total_size = 0
+_lock = threading.Lock()
+
+
+def read_file(path):
+    """ Returns the text of a file, reusing the last read if the file has not changed since.
+
+    Task constructors read the same base, fitopts and sys scale files over and over when a config expands into many tasks,
+    so this saves reopening them. A stat is still done on each call, so edited files are picked up.
+    """
+    global _total_size
+    path = os.path.abspath(path)
+    s = os.stat(path)
+    with _lock:
+        cached = _contents.get(path)
+        if cached is not None:
+            _contents.move_to_end(path)
+    if cached is not None and cached[0] == s.st_mtime_ns and cached[1] == s.st_size:
+        return cached[2]
+    with open(path, "r") as f:
+        contents = f.read()
+    with _lock:
+        old = _contents.pop(path, None)
+        if old is not None:
+            _total_size -= old[1]
+        _contents[path] = (s.st_mtime_ns, s.st_size, contents)
+        _total_size += s.st_size
+        while _total_size > MAX_CACHE_SIZE and len(_contents) > 1:
+            _, evicted = _contents.popitem(last=False)
+            _total_size -= evicted[1]
+    return contents
+
+
+def read_lines(path):
+    """ The lines of a file, without line endings. A new list each time, so callers can modify it. """
+    return read_file(path).splitlines()
+
+
+def _prefetch(path):
+    try:
+        read_file(path)
+        return True
+    except (OSError, UnicodeDecodeError):
+        return False
+
+
+def should_prefetch(path):
+    """ Whether path is a small text input, not a model or data file which read_file will never be asked for """
+    if not path.lower().endswith(PREFETCH_EXTENSIONS):
+        return False
+    try:
+        return os.path.getsize(path) <= MAX_PREFETCH_SIZE
+    except OSError:
+        return False
+
+
+def prefetch_files(paths, max_workers=8):
+    """ Reads the given files concurrently, so later calls to read_file are served from memory.
+    Only small text inputs are read, see should_prefetch.
+
+    :return: the number of files read successfully
+    """
+    paths = sorted(set(p for p in paths if p is not None and should_prefetch(p)))
+    if not paths:
+        return 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        num_read = sum(executor.map(_prefetch, paths))
+    get_logger().debug(f"Prefetched {num_read} of {len(paths)} data files")
+    return num_read
+
+
+def clear():
+    global _total_size
+    with _lock:
+        _contents.clear()
+        _total_size = 0
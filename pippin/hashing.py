@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+from pippin.config import get_logger, get_output_dir, chown_file
+
+# A file which only exists in memory, such as an input file Pippin has modified but not yet written out
+InMemoryFile = namedtuple("InMemoryFile", ["name", "content"])
+
+
+def normalise_newlines(content):
+    """ Matches what reading a file in text mode does, so in memory files hash the same as their written out versions """
+    return content.replace("\r\n", "\n").replace("\r", "\n")
+
+
+class HashMemo:
+    """ Remembers the hash of a set of input files, keyed on their paths, sizes and modification times.
+
+    The hashes depend on the entire contents of every file, so unchanged BASE and INCLUDE files would otherwise be read
+    in full on every invocation. The memo is a small json file in the output directory, capped at max_entries.
+    """
+
+    max_entries = 5000
+
+    def __init__(self, path):
+        self.logger = get_logger()
+        self.path = path
+        self.memo = None
+
+    def _load(self):
+        if self.memo is not None:
+            return
+        self.memo = {}
+        if self.path is not None and os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.memo = json.load(f)
+            except (OSError, ValueError):
+                self.logger.debug(f"Unable to read hash memo {self.path}, starting a new one")
+
+    def get(self, key):
+        self._load()
+        return self.memo.get(key)
+
+    def set(self, key, value):
+        self._load()
+        self.memo.pop(key, None)
+        self.memo[key] = value
+        while len(self.memo) > self.max_entries:
+            del self.memo[next(iter(self.memo))]
+        if self.path is None:
+            return
+        try:
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.memo, f)
+            os.replace(self.path + ".tmp", self.path)
+            chown_file(self.path)
+        except OSError as e:
+            self.logger.debug(f"Unable to save hash memo to {self.path}: {e}")
+
+
+_memo = None
+
+
+def get_hash_memo():
+    global _memo
+    if _memo is None:
+        _memo = HashMemo(os.path.join(get_output_dir(), ".hash_memo.json"))
+    return _memo
+
+
+def get_signature(source):
+    """ Something which changes when the source's contents do, without reading a file """
+    if isinstance(source, InMemoryFile):
+        return ["memory", source.name, hashlib.sha256(source.content.encode("utf-8")).hexdigest()]
+    s = os.stat(source)
+    return [os.path.abspath(source), s.st_size, s.st_mtime_ns]
+
+
+def stream_hash(sources, suffix="", chunk_size=1024 * 1024):
+    """ sha256 of the text of every source followed by the suffix, the same as hashing them concatenated in one string.
+
+    :param sources: list of file paths or InMemoryFiles
+    :param suffix: string to add after the file contents
+    :param chunk_size: characters to read from files at a time
+    :return: the hex digest
+    """
+    hasher = hashlib.sha256()
+    for source in sources:
+        if isinstance(source, InMemoryFile):
+            hasher.update(normalise_newlines(source.content).encode("utf-8"))
+            continue
+        with open(source, "r") as f:
+            for chunk in iter(lambda: f.read(chunk_size), ""):
+                hasher.update(chunk.encode("utf-8"))
+    hasher.update(suffix.encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def get_hash_of_files(sources, suffix="", memo=None):
+    """ Hashes the sources with `stream_hash`, reusing the memoised hash if none of the files have changed.
+
+    :param sources: list of file paths or InMemoryFiles
+    :param suffix: string to add after the file contents
+    :param memo: HashMemo to use, defaults to the one in the output directory
+    :return: the hex digest
+    """
+    if memo is None:
+        memo = get_hash_memo()
+    key = hashlib.sha256(json.dumps([get_signature(s) for s in sources] + [suffix]).encode("utf-8")).hexdigest()
+    result = memo.get(key)
+    if result is None:
+        result = stream_hash(sources, suffix=suffix)
+        memo.set(key, result)
+    return result
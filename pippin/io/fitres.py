@@ -0,0 +1,285 @@
+import gzip
+import hashlib
+import json
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+# This module is also imported by the standalone scripts in pippin/external and pippin/classifiers, which run in other
+# environments, so it should only depend on numpy and pandas.
+
+
+SIDECAR_DIR_VARIABLE = "PIPPIN_FITRES_CACHE"
+
+
+def get_sidecar_dir():
+    """ Where binary copies of FITRES files are kept: $PIPPIN_FITRES_CACHE, which Pippin sets for its jobs, or ~/.cache/pippin/fitres
+
+    They're kept away from the FITRES files themselves so nothing listing an SNANA output directory trips over them.
+    """
+    directory = os.environ.get(SIDECAR_DIR_VARIABLE)
+    if not directory:
+        directory = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "pippin", "fitres")
+    return directory
+
+
+def get_sidecar_path(path):
+    """ Where the binary copy of a FITRES file lives, keyed by a hash of its real path """
+    key = hashlib.sha256(os.path.realpath(path).encode("utf-8")).hexdigest()
+    return os.path.join(get_sidecar_dir(), key[:2], f"{key}.npz")
+
+
+def open_text(path):
+    if _is_gzip(path):
+        return gzip.open(path, "rt", errors="replace")
+    return open(path, errors="replace")
+
+
+def read_header(path):
+    """ Finds the header of a FITRES or csv file: the first line which isn't blank, a comment or an old style NVAR line.
+
+    :return: (the header line with any comment removed, the number of lines up to and including it). The line is None
+    if the file has no header.
+    """
+    with open_text(path) as f:
+        for i, line in enumerate(f):
+            line = line.split("#")[0].strip()
+            if line and not line.startswith("NVAR:"):
+                return line, i + 1
+    return None, 0
+
+
+def is_fitres_format(path):
+    """ Whether a file uses the whitespace delimited VARNAMES:/SN: format rather than being a csv """
+    line, _ = read_header(path)
+    return line is not None and line.startswith("VARNAMES:") and "," not in line
+
+
+def get_fitres_columns(path):
+    """ The column names of a FITRES file, from its VARNAMES line. The first is the VARNAMES: row label column. """
+    line, _ = read_header(path)
+    return [] if line is None else line.split()
+
+
+def read_fitres(path, columns=None, dtype=None, float32=False, chunksize=None):
+    """ Parses a whitespace delimited FITRES (or other SNANA VARNAMES:/SN:) file, which may be gzipped.
+
+    The header is found by reading up to the VARNAMES line, so pandas can be told the column names and which ones
+    to convert rather than sniffing them. Without any options the result is the same as
+    pd.read_csv(path, delim_whitespace=True, comment="#"), including the VARNAMES: column of SN: row labels.
+
+    :param path: the file
+    :param columns: optional list of columns to load. The rest are skipped while parsing. Raises a ValueError if any are missing.
+    :param dtype: optional dtype or dictionary of column to dtype, such as {"CID": str}
+    :param float32: convert float columns to float32, halving their memory
+    :param chunksize: if set, return an iterator of dataframes of this many rows instead of one dataframe
+    :return: a dataframe, or an iterator of them
+    """
+    line, num_header_lines = read_header(path)
+    names = [] if line is None else line.split()
+    if len(set(names)) != len(names):
+        # Leave pandas to rename duplicate columns the way it always has
+        if chunksize is not None or dtype is not None or float32:
+            raise ValueError(f"{path} has duplicate column names {names}")
+        df = pd.read_csv(path, sep=r"\s+", comment="#")
+        return df if columns is None else select_columns(df, columns, path)
+    if columns is not None:
+        missing = [c for c in columns if c not in names]
+        if missing:
+            raise ValueError(f"Columns {missing} are not in {path}, which has columns {names}")
+
+    reader = pd.read_csv(
+        path,
+        sep=r"\s+",
+        comment="#",
+        header=None,
+        names=names,
+        skiprows=num_header_lines,
+        usecols=None if columns is None else list(columns),
+        dtype=dtype,
+        chunksize=chunksize,
+        compression="gzip" if _is_gzip(path) else None,
+    )
+
+    def finalise(df):
+        if columns is not None:
+            df = df[list(columns)]
+        if float32:
+            df = df.astype({c: np.float32 for c in df.columns if df[c].dtype == np.float64})
+        return df
+
+    if chunksize is None:
+        return finalise(reader)
+    return _iterate_chunks(reader, finalise)
+
+
+def _iterate_chunks(reader, finalise):
+    with reader:
+        for chunk in reader:
+            yield finalise(chunk)
+
+
+def _is_gzip(path):
+    with open(path, "rb") as f:
+        return f.read(2) == b"\x1f\x8b"
+
+
+def select_columns(df, columns, path):
+    missing = [c for c in columns if c not in df.columns]
+    if missing:
+        raise ValueError(f"Columns {missing} are not in {path}, which has columns {list(df.columns)}")
+    return df[list(columns)]
+
+
+def _get_signature(path):
+    s = os.stat(path)
+    return [os.path.realpath(path), s.st_size, s.st_mtime_ns]
+
+
+def _can_store(series):
+    return series.dtype.kind in "biuf" or pd.api.types.infer_dtype(series, skipna=False) == "string"
+
+
+def _save_sidecar(sidecar, signature, df):
+    if not all(_can_store(df[c]) for c in df.columns):
+        return False
+    meta = {"signature": signature, "columns": list(df.columns)}
+    arrays = {f"c{i}": df[c].to_numpy(dtype=str) if df[c].dtype == object else df[c].to_numpy() for i, c in enumerate(df.columns)}
+    temp_path = f"{sidecar}.tmp{os.getpid()}.npz"
+    try:
+        os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+        np.savez(temp_path, __meta__=np.array(json.dumps(meta)), **arrays)
+        os.replace(temp_path, sidecar)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    return True
+
+
+def _load_sidecar(path, sidecar, signature, columns):
+    if not os.path.exists(sidecar):
+        return None
+    try:
+        with np.load(sidecar, allow_pickle=False) as data:
+            meta = json.loads(str(data["__meta__"]))
+            if meta["signature"] != signature:
+                return None
+            all_columns = meta["columns"]
+            missing = [] if columns is None else [c for c in columns if c not in all_columns]
+            if not missing:
+                result = {}
+                for c in all_columns if columns is None else columns:
+                    values = data[f"c{all_columns.index(c)}"]
+                    result[c] = values.astype(object) if values.dtype.kind == "U" else values
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+    if missing:
+        raise ValueError(f"Columns {missing} are not in {path}, which has columns {all_columns}")
+    return pd.DataFrame(result)
+
+
+def load_fitres(path, columns=None, cache=True):
+    """ Loads a FITRES file into a dataframe, the same as pd.read_csv(path, delim_whitespace=True, comment="#").
+
+    Parsing multi-GB text files is slow, so the first time a file is read it is also saved in a binary columnar format
+    (an uncompressed npz with one array per column) in the sidecar directory, see `get_sidecar_dir`. Later reads, from
+    any task or script, load only the columns they ask for from that instead. The binary copy is ignored once the size
+    or modification time of the text file changes. If it can't be written we just parse the text.
+
+    :param path: the FITRES file, which may be gzipped
+    :param columns: optional list of columns to load. A ValueError is raised if any are missing.
+    :param cache: whether to use and create the binary copy
+    :return: the dataframe
+    """
+    if not cache:
+        return read_fitres(path, columns=columns)
+    sidecar = get_sidecar_path(path)
+    signature = _get_signature(path)
+    df = _load_sidecar(path, sidecar, signature, columns)
+    if df is not None:
+        return df
+    df = read_fitres(path)
+    _save_sidecar(sidecar, signature, df)
+    return df if columns is None else select_columns(df, columns, path)
+
+
+def read_key_values(key_file):
+    """ Reads a key file (such as the aggregator's merged_*.key) into its value columns and a map of CID to value text.
+
+    Values are kept as the text in the file so they are written out exactly as they came in.
+    """
+    names, values = None, {}
+    with open_text(key_file) as f:
+        for line in f:
+            tokens = line.split("#")[0].split()
+            if not tokens:
+                continue
+            if tokens[0] == "VARNAMES:":
+                names = tokens[1:]
+            elif names is not None and tokens[0] == "SN:":
+                values[tokens[1]] = " ".join(tokens[2:])
+    if names is None:
+        raise ValueError(f"Key file {key_file} has no VARNAMES line")
+    return names[1:], values
+
+
+def combine_fitres(fitres_file, key_file, output_file, fill_value="0"):
+    """ Left joins the columns of a key file onto a FITRES file by CID, streaming a line at a time.
+
+    This replaces running combine_fitres.exe followed by sed to turn its -888 (missing) values into zeros: the output
+    has the FITRES columns followed by the key file's, and rows whose CID isn't in the key file get fill_value for the
+    new columns. Everything else, including comments and the formatting of the original values, is copied unchanged.
+
+    :param fitres_file: FITRES file to add columns to, which may be gzipped
+    :param key_file: VARNAMES:/SN: file with CID as the first column
+    :param output_file: where to write the combined text file
+    :param fill_value: text to use for missing values
+    :return: the number of rows, and how many of those had no match in the key file
+    """
+    new_columns, values = read_key_values(key_file)
+    fill = " ".join([fill_value] * len(new_columns))
+    cid_index = None
+    num_rows, num_missing = 0, 0
+    temp_file = f"{output_file}.tmp{os.getpid()}"
+    try:
+        with open_text(fitres_file) as f, open(temp_file, "w") as out:
+            for line in f:
+                content, sep, comment = line.partition("#")
+                tokens = content.split()
+                if not tokens:
+                    out.write(line)
+                elif tokens[0] == "VARNAMES:":
+                    duplicates = [c for c in new_columns if c in tokens]
+                    if duplicates:
+                        raise ValueError(f"Columns {duplicates} from {key_file} are already in {fitres_file}")
+                    if "CID" not in tokens:
+                        raise ValueError(f"{fitres_file} has no CID column")
+                    cid_index = tokens.index("CID")
+                    out.write(" ".join(tokens + new_columns) + "\n")
+                elif tokens[0] == "NVAR:":
+                    out.write(f"NVAR: {int(tokens[1]) + len(new_columns)}\n")
+                elif cid_index is not None and tokens[0] == "SN:":
+                    cid = tokens[cid_index]
+                    extra = values.get(cid)
+                    if extra is None and cid.lstrip("-").isdigit():
+                        extra = values.get(str(int(cid)))
+                    if extra is None:
+                        extra = fill
+                        num_missing += 1
+                    num_rows += 1
+                    if sep:
+                        out.write(f"{content.rstrip()} {extra}  #{comment.rstrip()}\n")
+                    else:
+                        out.write(f"{content.rstrip()} {extra}\n")
+                else:
+                    out.write(line)
+        if cid_index is None:
+            raise ValueError(f"{fitres_file} has no VARNAMES line")
+        os.replace(temp_file, output_file)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    return num_rows, num_missing
@@ -1,23 +1,32 @@
 import copy
+import datetime
 import os
 import inspect
 import shutil
-import subprocess
 import time
 
 from pippin.aggregator import Aggregator
 from pippin.analyse import AnalyseChains
 from pippin.biascor import BiasCor
+from pippin.cache import get_task_cache
 from pippin.classifiers.classifier import Classifier
 from pippin.classifiers.factory import ClassifierFactory
-from pippin.config import get_logger, get_config, ensure_list, get_output_dir, mkdirs, chown_dir, chown_file
+from pippin.config import get_logger, get_config, ensure_list, get_output_dir, mkdirs, chown_dir, chown_file, forget_chowned, get_data_loc, get_data_loc_stats
 from pippin.cosmomc import CosmoMC
 from pippin.create_cov import CreateCov
+from pippin.dag import TaskGraph
 from pippin.dataprep import DataPrep
+from pippin.executor import get_executors, get_process_pool
+from pippin.file_cache import prefetch_files
+from pippin.io.fitres import SIDECAR_DIR_VARIABLE
 from pippin.merge import Merger
 from pippin.snana_fit import SNANALightCurveFit
 from pippin.snana_sim import SNANASimulation
+from pippin.state import StateStore
 from pippin.task import Task
+from pippin.queue_snapshot import QueueMonitor
+from pippin.wall_times import WallTimeHistory
+from pippin.watcher import DoneFileWatcher
 
 
 class Manager:
@@ -38,9 +47,20 @@ class Manager:
         self.max_jobs_gpu = int(self.global_config["QUEUE"]["max_gpu_jobs"])
         self.max_jobs_in_queue = int(self.global_config["QUEUE"]["max_jobs_in_queue"])
         self.max_jobs_in_queue_gpu = int(self.global_config["QUEUE"]["max_gpu_jobs_in_queue"])
+        self.queue = QueueMonitor(command=self.global_config["QUEUE"].get("squeue_command"), ttl=self.global_config["QUEUE"].get("squeue_ttl", 10))
 
         self.output_dir = os.path.join(get_output_dir(), self.filename)
         self.tasks = None
+        self.stage_timings = []
+        self.graph = None
+        self.history = None
+        self.local_executor = None
+        self.worker_pool = None
+        self.state_store = None
+        self.task_cache = None
+        self.use_state_db = self.global_config["OUTPUT"].get("state_db", False)
+        self.predicted_makespan = None
+        self.execute_start = None
         self.num_jobs_queue = 0
         self.num_jobs_queue_gpu = 0
 
@@ -48,6 +68,9 @@ class Manager:
         self.finish = None
         self.force_refresh = False
 
+        self.event_driven = self.global_config["OUTPUT"].get("event_driven", True)
+        self.watcher = None
+
     def get_force_refresh(self, task):
         if self.start is None:
             return self.force_refresh
@@ -83,18 +106,42 @@ class Manager:
         assert 0 <= num < len(Manager.stages), f"Stage {num} is not in recognised values is not valid - from 0 to {len(Manager.stages) - 1}"
         return num
 
+    def get_referenced_files(self, config):
+        """ Any strings in the config which look like data files, resolved against the data directories """
+        paths = []
+        stack = [config]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, dict):
+                stack += list(value.values())
+            elif isinstance(value, list):
+                stack += value
+            elif isinstance(value, str) and " " not in value.strip() and ("/" in value or "." in value):
+                path = get_data_loc(value.strip(), quiet=True)
+                if path is not None and os.path.isfile(path):
+                    paths.append(path)
+        return paths
+
     def get_tasks(self, config):
 
         total_tasks = []
+        self.stage_timings = []
+        start = time.time()
+        num_prefetched = prefetch_files(self.get_referenced_files(config))
+        self.stage_timings.append(("PREFETCH", time.time() - start, num_prefetched))
         try:
             for i, task in enumerate(Manager.task_order):
                 if self.finish is None or i <= self.finish:
+                    start = time.time()
                     new_tasks = task.get_tasks(config, total_tasks, self.output_dir, i, self.prefix, self.global_config)
                     if new_tasks is not None:
                         total_tasks += new_tasks
+                    self.stage_timings.append((Manager.stages[i], time.time() - start, len(new_tasks or [])))
         except Exception as e:
             self.logger.exception(e, exc_info=False)
             raise e
+        stats = get_data_loc_stats()
+        self.logger.debug(f"Data file lookups: {stats['hits']} cache hits, {stats['misses']} misses")
         self.logger.info("")
         self.logger.notice("Listing tasks:")
         for task in total_tasks:
@@ -102,46 +149,44 @@ class Manager:
         self.logger.info("")
         return total_tasks
 
+    def log_stage_timings(self):
+        self.logger.info("Time spent setting up each stage:")
+        for stage, duration, num in self.stage_timings:
+            label = "files read" if stage == "PREFETCH" else "tasks"
+            self.logger.info(f"\t{stage:>10s}: {duration:7.3f}s, {num} {label}")
+        self.logger.info(f"\t{'TOTAL':>10s}: {sum(t[1] for t in self.stage_timings):7.3f}s")
+
     def get_num_running_jobs(self):
-        num_jobs = int(subprocess.check_output("squeue -ho %A -u $USER | wc -l", shell=True, stderr=subprocess.STDOUT))
-        return num_jobs
-
-    def get_task_to_run(self, tasks_to_run, done_tasks):
-        for t in tasks_to_run:
-            can_run = True
-            for dep in t.dependencies:
-                if dep not in done_tasks:
-                    can_run = False
-            if t.gpu and self.num_jobs_queue_gpu + t.num_jobs >= self.max_jobs_in_queue_gpu:
-                self.logger.warning(f"Cant submit {t} because num jobs {t.num_jobs} would take us over the limit with {self.num_jobs_queue_gpu} already running")
-                can_run = False
-
-            if not t.gpu and self.num_jobs_queue + t.num_jobs >= self.max_jobs_in_queue:
-                self.logger.warning(f"Cant submit {t} because num jobs {t.num_jobs} would take us over the limit with {self.num_jobs_queue} already running")
-                can_run = False
-
-            if can_run:
-                return t
-        return None
+        return self.get_squeue().num_jobs
+
+    def get_num_queued_jobs(self):
+        """ Jobs we think are in the queue, from our own accounting or the last queue snapshot, whichever is larger """
+        snapshot = self.queue.latest
+        if snapshot is None:
+            return self.num_jobs_queue, self.num_jobs_queue_gpu
+        return max(self.num_jobs_queue, snapshot.num_cpu_jobs), max(self.num_jobs_queue_gpu, snapshot.num_gpu_jobs)
+
+    def get_task_to_run(self):
+        num_queued, num_queued_gpu = self.get_num_queued_jobs()
+
+        def can_run(t):
+            if t.gpu and num_queued_gpu + t.num_jobs >= self.max_jobs_in_queue_gpu:
+                self.logger.warning(f"Cant submit {t} because num jobs {t.num_jobs} would take us over the limit with {num_queued_gpu} already running")
+                return False
+            if not t.gpu and num_queued + t.num_jobs >= self.max_jobs_in_queue:
+                self.logger.warning(f"Cant submit {t} because num jobs {t.num_jobs} would take us over the limit with {num_queued} already running")
+                return False
+            return True
+
+        return self.graph.pop_ready(can_run)
 
     def fail_task(self, t, running, failed, blocked):
         if t in running:
             running.remove(t)
         failed.append(t)
         self.logger.error(f"FAILED: {t}")
-        if os.path.exists(t.hash_file):
-            os.remove(t.hash_file)
-
-        modified = True
-        while modified:
-            modified = False
-            for t2 in self.tasks:
-                for d in t2.dependencies:
-                    if d in failed or d in blocked:
-                        self.tasks.remove(t2)
-                        blocked.append(t2)
-                        modified = True
-                        break
+        t.clear_hash()
+        blocked += self.graph.block(t)
 
     def log_status(self, waiting, running, done, failed, blocked):
         self.logger.debug("")
@@ -156,6 +201,23 @@ class Manager:
             self.logger.debug(f"    Blocked: {[t.name for t in blocked]}")
         self.logger.debug("")
 
+    def wait_for_changes(self, sleep_time):
+        """ Sleep until either the sleep time is up or, in event driven mode, a running task's done file appears.
+
+        :return: true if woken up by a done file, false if the full time elapsed
+        """
+        if self.watcher is None:
+            time.sleep(sleep_time)
+            return False
+        changed = self.watcher.wait(sleep_time)
+        for path in changed:
+            self.logger.debug(f"Woken up by done file {path}")
+        return len(changed) > 0
+
+    def get_squeue(self):
+        """ The current queue snapshot, shared by every task this tick. Only calls squeue when the last snapshot has expired. """
+        return self.queue.get()
+
     def execute(self, check_config):
         self.logger.info(f"Executing pipeline for prefix {self.prefix}")
         self.logger.info(f"Output will be located in {self.output_dir}")
@@ -168,6 +230,7 @@ class Manager:
         self.tasks = self.get_tasks(c)
 
         if check_config:
+            self.log_stage_timings()
             self.logger.notice("Config verified, exiting")
             return
 
@@ -182,6 +245,9 @@ class Manager:
         start_sleep_time = self.global_config["OUTPUT"]["ping_frequency"]
         max_sleep_time = self.global_config["OUTPUT"]["max_ping_frequency"]
         current_sleep_time = start_sleep_time
+        if self.event_driven:
+            self.watcher = DoneFileWatcher(poll_frequency=self.global_config["OUTPUT"].get("watch_poll_frequency", 5))
+            self.logger.debug(f"Event driven mode enabled, watching done files {'with inotify' if self.watcher.uses_inotify else 'by polling'}")
 
         config_file_output = os.path.join(self.output_dir, os.path.basename(self.filename_path))
         if not check_config and self.filename_path != config_file_output:
@@ -189,8 +255,43 @@ class Manager:
             shutil.copy(self.filename_path, config_file_output)
             chown_file(config_file_output)
 
+        if self.use_state_db:
+            self.state_store = StateStore(self.output_dir)
+            for t in self.tasks:
+                t.state_store = self.state_store
+            if self.state_store.is_new:
+                self.state_store.import_tasks(self.tasks)
+
+        self.task_cache = get_task_cache(self.global_config)
+        if self.task_cache is not None:
+            self.logger.info(f"Using shared task cache at {self.task_cache.cache_dir}")
+            for t in self.tasks:
+                t.task_cache = self.task_cache
+
+        # Binary copies of FITRES files, shared by every task and the jobs they submit
+        os.environ.setdefault(SIDECAR_DIR_VARIABLE, os.path.join(get_output_dir(), ".fitres_cache"))
+
+        history_path = self.global_config["OUTPUT"].get("wall_time_history") or os.path.join(get_output_dir(), "wall_times.json")
+        self.history = WallTimeHistory(history_path)
+        self.graph = TaskGraph(self.tasks, costs={t: self.history.estimate(t) for t in self.tasks})
+        self.predicted_makespan = self.graph.get_makespan()
+        num_known = len([t for t in self.tasks if self.history.has_estimate(t)])
+        self.logger.info(f"Found previous wall times for {num_known}/{len(self.tasks)} tasks, predicted makespan is {self.format_time(self.predicted_makespan)}")
+
+        executors, self.local_executor = get_executors(self.tasks, self.global_config, self.history)
+        for t, executor in executors.items():
+            t.executor = executor
+        num_local = len([e for e in executors.values() if e is self.local_executor])
+        if num_local:
+            self.logger.info(f"Running {num_local} tasks on a local pool of {self.local_executor.max_workers} workers instead of slurm")
+        # One bounded pool of processes for every task which does its own work in python, like the Aggregator and Merger
+        self.worker_pool = get_process_pool((self.global_config.get("EXECUTOR") or {}).get("worker_processes", 4))
+        for t in self.tasks:
+            t.worker_pool = self.worker_pool
+        self.execute_start = time.time()
+
         # Welcome to the primary loop
-        while self.tasks or running_tasks:
+        while self.graph or running_tasks:
             small_wait = False
 
             # Check status of current jobs
@@ -205,10 +306,9 @@ class Manager:
             # Submit new jobs if needed
             while self.num_jobs_queue < self.max_jobs:
 
-                t = self.get_task_to_run(self.tasks, done_tasks)
+                t = self.get_task_to_run()
                 if t is not None:
                     self.logger.info("")
-                    self.tasks.remove(t)
                     self.logger.notice(f"LAUNCHING: {t}")
                     try:
                         started = t.run(self.get_force_refresh(t))
@@ -222,6 +322,8 @@ class Manager:
                             self.num_jobs_queue += t.num_jobs
                         self.logger.notice(f"LAUNCHED: {t} with total {self.num_jobs_queue} jobs")
                         running_tasks.append(t)
+                        if self.watcher is not None:
+                            self.watcher.watch(t.get_done_files())
                         completed = self.check_task_completion(t, blocked_tasks, done_tasks, failed_tasks, running_tasks, squeue)
                         small_wait = small_wait or completed
                     else:
@@ -231,22 +333,40 @@ class Manager:
                 else:
                     break
 
+            if self.state_store is not None:
+                self.state_store.commit()
+
             # Check quickly if we've added a new job, etc, in case of immediate failure
             if small_wait:
-                self.log_status(self.tasks, running_tasks, done_tasks, failed_tasks, blocked_tasks)
+                self.log_status(self.graph.get_waiting(), running_tasks, done_tasks, failed_tasks, blocked_tasks)
                 current_sleep_time = start_sleep_time
                 time.sleep(0.1)
                 squeue = None
+            elif self.wait_for_changes(current_sleep_time):
+                # A done file turned up, so go check on tasks straight away without bothering the queue
+                current_sleep_time = start_sleep_time
+                squeue = None
             else:
-                time.sleep(current_sleep_time)
                 current_sleep_time *= 2
                 if current_sleep_time > max_sleep_time:
                     current_sleep_time = max_sleep_time
-                squeue = [i.strip() for i in subprocess.check_output(f"squeue -h -u $USER -o '%.200j'", shell=True, text=True).splitlines()]
+                squeue = self.get_squeue()
                 n = len(squeue)
                 if n == 0 or n > self.max_jobs:
-                    self.logger.debug(f"Squeue is reporting {n} jobs in the queue... this is either 0 or toeing the line as to too many")
-
+                    self.logger.debug(f"Squeue is reporting {n} jobs in the queue ({squeue.num_gpu_jobs} gpu)... this is either 0 or toeing the line as to too many")
+
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+        if self.local_executor is not None:
+            self.local_executor.shutdown()
+            self.local_executor = None
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+            self.worker_pool = None
+        self.history.save()
+        if self.state_store is not None:
+            self.state_store.close()
         self.log_finals(done_tasks, failed_tasks, blocked_tasks)
 
     def check_task_completion(self, t, blocked_tasks, done_tasks, failed_tasks, running_tasks, squeue):
@@ -261,12 +381,23 @@ class Manager:
                 running_tasks.remove(t)
                 self.logger.notice(f"FINISHED: {t}, total jobs now {self.num_jobs_queue}")
                 done_tasks.append(t)
+                self.graph.mark_done(t)
+                if t.fresh_run:
+                    self.history.record(t)
+                t.store_in_cache()
             else:
                 self.fail_task(t, running_tasks, failed_tasks, blocked_tasks)
+            if self.watcher is not None:
+                self.watcher.unwatch(t.get_done_files())
             chown_dir(t.output_dir)
+            forget_chowned(t.output_dir)
             return True
         return False
 
+    @staticmethod
+    def format_time(seconds):
+        return str(datetime.timedelta(seconds=int(seconds + 0.5)))
+
     def log_finals(self, done_tasks, failed_tasks, blocked_tasks):
         self.logger.info("")
         self.logger.info("All tasks finished. Task summary as follows.")
@@ -305,3 +436,8 @@ class Manager:
 
         for w in es:
             self.logger.error(f"\t{w.message}")
+
+        if self.execute_start is not None:
+            actual = time.time() - self.execute_start
+            self.logger.info("")
+            self.logger.info(f"Predicted makespan {self.format_time(self.predicted_makespan)}, actual makespan {self.format_time(actual)}")
@@ -1,18 +1,37 @@
+import json
 import shutil
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from pippin.aggregator import Aggregator
 from pippin.config import chown_dir, mkdirs
 from pippin.dataprep import DataPrep
+from pippin.executor import get_process_pool
+from pippin.hashing import stream_hash
+from pippin.io.fitres import combine_fitres, is_fitres_format
 from pippin.snana_fit import SNANALightCurveFit
 from pippin.snana_sim import SNANASimulation
 from pippin.task import Task
 import os
 
 
+def is_fitres_table(fitres_dir, filename):
+    """ Whether a file in an LCFIT output directory is a FITRES table to merge, not a hidden file or something else named FITRES """
+    if filename.startswith(".") or "FITRES" not in filename:
+        return False
+    try:
+        return is_fitres_format(os.path.join(fitres_dir, filename))
+    except OSError:
+        return False
+
+
 class Merger(Task):
     """ Merge fitres files and aggregator output
 
+    Rerunning only recombines the FITRES files whose FITRES or key file changed, see `get_changed_files`.
+    Use the force refresh option to start from scratch.
+
     CONFIGURATION:
     ==============
     MERGE:
@@ -21,6 +40,9 @@ class Merger(Task):
             MASK_SIM: partial match on sim
             MASK_FIT: partial match on lcfit
             MASK_AGG: partial match on aggregation task
+            OPTS:
+                COMBINE: combine_fitres  # Or python, to join the predictions on in Pippin itself instead of calling combine_fitres.exe
+                MAX_WORKERS: 8  # How many FITRES files to combine at once. With python under the manager, EXECUTOR: worker_processes instead
 
     OUTPUTS:
     ========
@@ -41,8 +63,16 @@ class Merger(Task):
     def __init__(self, name, output_dir, dependencies, options):
         super().__init__(name, output_dir, dependencies=dependencies)
         self.options = options
+        self.combine = options.get("COMBINE", "combine_fitres")
+        if self.combine not in ["combine_fitres", "python"]:
+            Task.fail_config(f"MERGE option COMBINE should be combine_fitres or python, not {self.combine}")
+        self.max_workers = int(options.get("MAX_WORKERS", 8))
+        self.thread = None
+        self.new_hash = None
+        self.log_lock = threading.Lock()
         self.passed = False
         self.logfile = os.path.join(self.output_dir, "output.log")
+        self.manifest_file = os.path.join(self.output_dir, "merge_manifest.json")
         self.original_output = os.path.join(self.output_dir, "FITOPT000.FITRES")
         self.done_file = os.path.join(self.output_dir, "done.txt")
         self.lc_fit = self.get_lcfit_dep()
@@ -81,8 +111,18 @@ class Merger(Task):
 
     def _check_completion(self, squeue):
         if os.path.exists(self.done_file):
+            with open(self.done_file) as f:
+                if "FAILURE" in f.read():
+                    self.logger.error(f"Merging failed, see {self.logfile} and the log above for details")
+                    return Task.FINISHED_FAILURE
+            if self.new_hash is not None:
+                # Only saved once the merge has finished, so one interrupted part way through is run again
+                self.save_new_hash(self.new_hash)
+                self.new_hash = None
             self.logger.debug(f"Merger finished, see combined fitres at {self.suboutput_dir}")
             return Task.FINISHED_SUCCESS
+        elif self.thread is not None and self.thread.is_alive():
+            return self.num_jobs
         else:
             output_error = False
             if os.path.exists(self.logfile):
@@ -95,79 +135,193 @@ class Merger(Task):
                             self.logger.info(f"Excerpt: {line}")
                 if output_error:
                     self.logger.debug("Removing hash on failure")
-                    os.remove(self.hash_file)
+                    self.clear_hash()
                     chown_dir(self.output_dir)
             else:
                 self.logger.error("Combine task failed with no output log. Please debug")
             return Task.FINISHED_FAILURE
 
-    def add_to_fitres(self, fitres_file, outdir, lcfit, index=0):
+    def get_key_file(self, lcfit, index):
         if not self.agg["lcfit_names"]:
             lcfit_index = 0
         else:
             lcfit_index = self.agg["lcfit_names"].index(lcfit)
-        command = ["combine_fitres.exe", fitres_file, self.agg["merge_key_filename"][index][lcfit_index], "--outfile_text", os.path.basename(fitres_file), "T"]
+        return self.agg["merge_key_filename"][index][lcfit_index]
+
+    def add_to_fitres(self, fitres_file, outdir, lcfit, index=0):
+        command = ["combine_fitres.exe", fitres_file, self.get_key_file(lcfit, index), "--outfile_text", os.path.basename(fitres_file), "T"]
         try:
-            self.logger.debug(f"Executing command {' '.join(command)}")
-            with open(self.logfile, "w+") as f:
-                subprocess.run(command, stdout=f, stderr=subprocess.STDOUT, cwd=outdir, check=True)
+            self.run_command(command, outdir)
             # Run sed command
             sed_command = ["sed", "-i", "s/ -888/ 0/", os.path.basename(fitres_file)]
-            self.logger.debug(f"Executing command {' '.join(sed_command)}")
-            with open(self.logfile, "w+") as f:
-                subprocess.run(sed_command, stdout=f, stderr=subprocess.STDOUT, cwd=outdir, check=True)
+            self.run_command(sed_command, outdir)
 
         except subprocess.CalledProcessError as e:
             self.logger.error(f"Error invoking command {command}")
             raise e
 
+    def run_command(self, command, cwd):
+        """ Runs a command, adding its output to the log file. Several can run at once, so output is only written at the end. """
+        self.logger.debug(f"Executing command {' '.join(command)}")
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd)
+        with self.log_lock:
+            with open(self.logfile, "a") as f:
+                f.write(process.stdout.decode("utf-8", errors="replace"))
+        process.check_returncode()
+
+    def run_combine_fitres(self, fitres_files):
+        """ Adds the predictions to every FITRES file with combine_fitres.exe, a few files at a time """
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            futures = [executor.submit(self.add_to_fitres, os.path.join(d, f), outdir, lcfit, index=index) for d, outdir, f, index, lcfit in fitres_files]
+            for future in futures:
+                future.result()
+
+    def combine_all(self, fitres_files):
+        """ Adds the predictions to every FITRES file with `combine_fitres`, a few files at a time in separate processes.
+
+        Under the manager this uses its worker pool, shared with every other task, otherwise a pool of MAX_WORKERS processes.
+        """
+        jobs = [(os.path.join(d, f), self.get_key_file(lcfit, index), os.path.join(outdir, f)) for d, outdir, f, index, lcfit in fitres_files]
+        self.logger.debug(f"Combining {len(jobs)} FITRES files in worker processes")
+        pool = self.worker_pool
+        own_pool = None
+        if pool is None:
+            pool = own_pool = get_process_pool(min(self.max_workers, len(jobs)))
+        try:
+            futures = [pool.submit(combine_fitres, *job) for job in jobs]
+            for (fitres_file, key_file, output_file), future in zip(jobs, futures):
+                num_rows, num_missing = future.result()
+                self.logger.debug(f"Added {key_file} to {num_rows} rows of {fitres_file}, {num_missing} with no predictions")
+        finally:
+            if own_pool is not None:
+                own_pool.shutdown()
+
     def _run(self, force_refresh):
         fitres_files, symlink_files = [], []
         for index, (fitres_dir, outdir) in enumerate(zip(self.lc_fit["fitres_dirs"], self.fitres_outdirs)):
-            files = os.listdir(fitres_dir)
-            fitres_files += [(fitres_dir, outdir, f, index, self.lc_fit["name"]) for f in files if "FITRES" in f and not os.path.islink(os.path.join(fitres_dir, f))]
-            symlink_files += [(fitres_dir, outdir, f, index, self.lc_fit["name"]) for f in files if "FITRES" in f and os.path.islink(os.path.join(fitres_dir, f))]
+            files = [f for f in os.listdir(fitres_dir) if is_fitres_table(fitres_dir, f)]
+            fitres_files += [(fitres_dir, outdir, f, index, self.lc_fit["name"]) for f in files if not os.path.islink(os.path.join(fitres_dir, f))]
+            symlink_files += [(fitres_dir, outdir, f, index, self.lc_fit["name"]) for f in files if os.path.islink(os.path.join(fitres_dir, f))]
 
-        new_hash = self.get_hash_from_string(" ".join([a + b + c + f"{d}" + e for a, b, c, d, e in (fitres_files + symlink_files)]))
+        string_to_hash = " ".join([a + b + c + f"{d}" + e for a, b, c, d, e in (fitres_files + symlink_files)])
+        if self.combine != "combine_fitres":
+            string_to_hash += self.combine
+        new_hash = self.get_hash_from_string(string_to_hash)
         old_hash = self.get_old_hash()
 
         if force_refresh or new_hash != old_hash:
-            shutil.rmtree(self.output_dir, ignore_errors=True)
-            self.logger.debug("Regenerating, running combine_fitres")
-            try:
-                for fitres_dir in self.fitres_outdirs:
-                    self.logger.debug(f"Creating directory {fitres_dir}")
-                    mkdirs(fitres_dir)
-                    for f in fitres_files:
-                        if f[1] == fitres_dir:
-                            self.add_to_fitres(os.path.join(f[0], f[2]), f[1], f[4], index=f[3])
-                    for s in symlink_files:
-                        if s[1] == fitres_dir:
-                            self.logger.debug(f"Creating symlink for {os.path.join(s[1], s[2])} to {os.path.join(s[1], 'FITOPT000.FITRES')}")
-                            os.symlink(os.path.join(s[1], "FITOPT000.FITRES"), os.path.join(s[1], s[2]))
-
-                    self.logger.debug(f"Copying MERGE.LOG and FITOPT.README")
-                    filenames = ["MERGE.LOG", "FITOPT.README"]
-                    for f in filenames:
-                        original = os.path.join(self.lc_fit["lc_output_dir"], f)
-                        moved = os.path.join(self.suboutput_dir, f)
-                        if not os.path.exists(moved):
-                            self.logger.debug(f"Copying file {f} into output directory")
-                            shutil.copy(original, moved)
-
-                    self.save_new_hash(new_hash)
-                    with open(self.done_file, "w") as f:
-                        f.write("SUCCESS")
-            except Exception as e:
-                self.logger.error("Error running merger!")
-                self.logger.error(f"Check log at {self.logfile}")
-                self.logger.exception(e, exc_info=True)
-                return False
+            if force_refresh:
+                shutil.rmtree(self.output_dir, ignore_errors=True)
+            else:
+                # Keep the combined files, merge will only redo the ones whose inputs changed
+                for f in [self.done_file, self.logfile]:
+                    if os.path.exists(f):
+                        os.remove(f)
+            for fitres_dir in self.fitres_outdirs:
+                self.logger.debug(f"Creating directory {fitres_dir}")
+                mkdirs(fitres_dir)
+            self.clear_hash()
+            self.new_hash = new_hash
+            # Combining can take a long time, so do it in the background and let _check_completion look for the done file
+            self.logger.info(f"Merging {len(fitres_files)} FITRES files in the background")
+            self.thread = threading.Thread(target=self.merge, args=(fitres_files, symlink_files), daemon=True)
+            self.thread.start()
         else:
             self.should_be_done()
             self.logger.info("Hash check passed, not rerunning")
         return True
 
+    def load_manifest(self):
+        """ Map of each combined file (relative to the output dir) to the signature of the inputs it was made from """
+        if not os.path.exists(self.manifest_file):
+            return {}
+        try:
+            with open(self.manifest_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            self.logger.warning(f"Unable to read merge manifest {self.manifest_file}, recombining everything")
+            return {}
+
+    def save_manifest(self, manifest):
+        with open(self.manifest_file + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(self.manifest_file + ".tmp", self.manifest_file)
+
+    def get_changed_files(self, fitres_files):
+        """ Works out which FITRES files need combining again, and removes combined files which are no longer needed.
+
+        The signature of each output is the size and modification time of its FITRES file, a hash of the contents of
+        its key file (the aggregator rewrites every key file each time it runs, so their times are no use) and the
+        combine mode. Outputs which exist and whose signature hasn't changed are left alone.
+
+        :return: (the entries of fitres_files to combine, the manifest of unchanged files, the new manifest entries for the ones to combine)
+        """
+        old_manifest = self.load_manifest()
+        key_hashes = {}
+        signatures = {}
+        for d, outdir, f, index, lcfit in fitres_files:
+            key_file = self.get_key_file(lcfit, index)
+            if key_file not in key_hashes:
+                key_hashes[key_file] = stream_hash([key_file])
+            stat = os.stat(os.path.join(d, f))
+            output = os.path.relpath(os.path.join(outdir, f), self.output_dir)
+            signatures[output] = [stat.st_size, stat.st_mtime_ns, key_hashes[key_file], self.combine]
+
+        for output in old_manifest:
+            if output not in signatures and os.path.exists(os.path.join(self.output_dir, output)):
+                self.logger.debug(f"Removing {output}, which is no longer an output")
+                os.remove(os.path.join(self.output_dir, output))
+
+        changed, kept, new_entries = [], {}, {}
+        for entry in fitres_files:
+            output = os.path.relpath(os.path.join(entry[1], entry[2]), self.output_dir)
+            if old_manifest.get(output) == signatures[output] and os.path.exists(os.path.join(self.output_dir, output)):
+                kept[output] = signatures[output]
+            else:
+                changed.append(entry)
+                new_entries[output] = signatures[output]
+        return changed, kept, new_entries
+
+    def merge(self, fitres_files, symlink_files):
+        """ Adds the predictions to every FITRES file whose inputs changed, then writes the done file. Runs in a background thread. """
+        try:
+            changed, manifest, new_entries = self.get_changed_files(fitres_files)
+            self.logger.info(f"Combining {len(changed)} of {len(fitres_files)} FITRES files, the rest are unchanged")
+            self.save_manifest(manifest)
+            if self.combine == "python":
+                self.combine_all(changed)
+            else:
+                self.run_combine_fitres(changed)
+            manifest.update(new_entries)
+            self.save_manifest(manifest)
+
+            for fitres_dir in self.fitres_outdirs:
+                for s in symlink_files:
+                    if s[1] == fitres_dir:
+                        link = os.path.join(s[1], s[2])
+                        self.logger.debug(f"Creating symlink for {link} to {os.path.join(s[1], 'FITOPT000.FITRES')}")
+                        if os.path.lexists(link):
+                            os.remove(link)
+                        os.symlink(os.path.join(s[1], "FITOPT000.FITRES"), link)
+
+            self.logger.debug(f"Copying MERGE.LOG and FITOPT.README")
+            filenames = ["MERGE.LOG", "FITOPT.README"]
+            for f in filenames:
+                original = os.path.join(self.lc_fit["lc_output_dir"], f)
+                moved = os.path.join(self.suboutput_dir, f)
+                # Copied rather than linked, so nothing written to ours can end up in the light curve fit's
+                if os.path.lexists(moved):
+                    os.remove(moved)
+                shutil.copy(original, moved)
+            result = "SUCCESS"
+        except Exception as e:
+            self.logger.error("Error running merger!")
+            self.logger.error(f"Check log at {self.logfile}")
+            self.logger.exception(e, exc_info=True)
+            result = "FAILURE"
+        with open(self.done_file, "w") as f:
+            f.write(result)
+
     @staticmethod
     def get_tasks(c, prior_tasks, base_output_dir, stage_number, prefix, global_config):
         agg_tasks = Task.get_task_of_type(prior_tasks, Aggregator)
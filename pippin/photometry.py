@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+
+from pippin.config import get_logger, chown_file
+
+try:
+    import fitsio
+except ModuleNotFoundError:
+    fitsio = None
+
+INDEX_FILENAME = ".pippin_header_index.npz"
+UNKNOWN_TYPE = -9  # What SNANA uses for objects without a type
+
+_indexes = {}  # photometry dir -> (signature, dataframe)
+_lock = threading.Lock()
+
+
+def get_header_files(photometry_dir):
+    """ The FITS HEAD files in a photometry directory, sorted so the index is the same whatever order listdir gives """
+    return sorted(os.path.join(photometry_dir, f) for f in os.listdir(photometry_dir) if "HEAD" in f)
+
+
+def get_text_files(photometry_dir):
+    """ Candidate SNANA text format files, for when there are no HEAD files. Hidden files (like the index) are skipped. """
+    files = []
+    for entry in os.scandir(photometry_dir):
+        if not entry.name.startswith(".") and entry.is_file():
+            files.append(entry.path)
+    return sorted(files)
+
+
+def get_signature(files):
+    signature = []
+    for f in files:
+        s = os.stat(f)
+        signature.append([os.path.basename(f), s.st_size, s.st_mtime_ns])
+    return json.dumps(signature)
+
+
+def _to_str(values):
+    values = np.asarray(values)
+    if values.dtype.kind == "S":
+        values = np.char.decode(values, "ascii")
+    return np.char.strip(values.astype(str))
+
+
+def read_header_file(path):
+    """ SNID and SNTYPE columns of a FITS HEAD file, reading only those columns.
+
+    Uses fitsio if it's installed, otherwise a memory mapped astropy table.
+    """
+    if fitsio is not None:
+        with fitsio.FITS(path) as f:
+            names = f[1].get_colnames()
+            columns = ["SNID"] + (["SNTYPE"] if "SNTYPE" in names else [])
+            data = f[1].read(columns=columns)
+            snid = data["SNID"]
+            sntype = data["SNTYPE"] if "SNTYPE" in names else None
+    else:
+        with fits.open(path, memmap=True) as hdul:
+            data = hdul[1].data
+            snid = np.array(data.field("SNID"))
+            sntype = np.array(data.field("SNTYPE")) if "SNTYPE" in hdul[1].columns.names else None
+    if sntype is None:
+        sntype = np.full(snid.shape, UNKNOWN_TYPE)
+    return _to_str(snid), np.asarray(sntype).astype(np.int64)
+
+
+def read_text_header(path):
+    """ SNID and SNTYPE from the header of a SNANA text format file, stopping at the observations.
+
+    :return: (snid, sntype), or None if the file has no SNID
+    """
+    snid, sntype = None, UNKNOWN_TYPE
+    try:
+        with open(path, errors="ignore") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "SNID":
+                    snid = value.split("#")[0].strip()
+                elif key == "SNTYPE":
+                    try:
+                        sntype = int(float(value.split("#")[0].strip()))
+                    except ValueError:
+                        pass
+                elif key in ["NOBS", "OBS", "NVAR", "VARLIST"]:
+                    break
+    except OSError:
+        return None
+    if not snid:
+        return None
+    return snid, sntype
+
+
+def build_header_index(photometry_dir):
+    """ Reads SNID and SNTYPE for every object in the directory, from the HEAD files if there are any or else the text files.
+
+    :return: (signature, dataframe with SNID and SNTYPE columns, first occurrence of each SNID only)
+    """
+    logger = get_logger()
+    headers = get_header_files(photometry_dir)
+    if headers:
+        signature = get_signature(headers)
+        results = [read_header_file(h) for h in headers]
+        snid = np.concatenate([r[0] for r in results])
+        sntype = np.concatenate([r[1] for r in results])
+    else:
+        logger.warning(f"No HEAD fits files found in {photometry_dir}, reading the headers of the text files instead")
+        files = get_text_files(photometry_dir)
+        signature = get_signature(files)
+        results = [r for r in (read_text_header(f) for f in files) if r is not None]
+        snid = np.array([r[0] for r in results], dtype=str)
+        sntype = np.array([r[1] for r in results], dtype=np.int64)
+    df = pd.DataFrame({"SNID": snid, "SNTYPE": sntype})
+    df = df.drop_duplicates(subset="SNID").reset_index(drop=True)
+    return signature, df
+
+
+def _load_index_file(path, signature):
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["signature"]) != signature:
+                return None
+            return pd.DataFrame({"SNID": data["snid"], "SNTYPE": data["sntype"]})
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _save_index_file(path, signature, df):
+    temp_path = f"{path}.tmp{os.getpid()}.npz"
+    try:
+        np.savez(temp_path, signature=np.array(signature), snid=df["SNID"].to_numpy(dtype=str), sntype=df["SNTYPE"].to_numpy())
+        os.replace(temp_path, path)
+        chown_file(path)
+    except OSError as e:
+        get_logger().debug(f"Unable to save header index to {path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def get_header_index(photometry_dir):
+    """ SNID and SNTYPE of every object in a photometry directory.
+
+    The aggregators and the perfect and unity classifiers all need this, for every version of every sim, and reading
+    thousands of HEAD files (or grepping thousands of text files) each time adds up. The index is built once, kept in
+    memory and saved next to the photometry as a small npz file, so other tasks and later runs can reuse it. It is
+    rebuilt if the names, sizes or modification times of the files it was read from change.
+
+    :param photometry_dir: directory containing the HEAD/PHOT FITS files or the text files
+    :return: a dataframe with the SNID (stripped strings) and SNTYPE (int) columns. Do not modify it.
+    """
+    logger = get_logger()
+    photometry_dir = os.path.abspath(photometry_dir)
+    headers = get_header_files(photometry_dir)
+    signature = get_signature(headers if headers else get_text_files(photometry_dir))
+
+    with _lock:
+        cached = _indexes.get(photometry_dir)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    path = os.path.join(photometry_dir, INDEX_FILENAME)
+    df = _load_index_file(path, signature)
+    if df is not None:
+        logger.debug(f"Loaded header index of {df.shape[0]} objects from {path}")
+    else:
+        signature, df = build_header_index(photometry_dir)
+        logger.debug(f"Built header index of {df.shape[0]} objects for {photometry_dir}")
+        _save_index_file(path, signature, df)
+
+    with _lock:
+        _indexes[photometry_dir] = (signature, df)
+    return df
+
+
+def clear():
+    with _lock:
+        _indexes.clear()
@@ -0,0 +1,83 @@
+import subprocess
+import time
+from collections import Counter
+
+from pippin.config import get_logger
+
+
+class QueueSnapshot:
+    """ The state of the user's slurm queue at one point in time.
+
+    Built from a single squeue call per tick and shared between the manager and every task, so
+    nobody has to shell out themselves. Jobs are grouped by name (array jobs share one), and the count
+    for each match is worked out once per snapshot, or carried over from the last snapshot if the
+    queue hasn't changed.
+    """
+
+    def __init__(self, lines, timestamp=None):
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.names = []
+        self.num_gpu_jobs = 0
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            comps = line.split("|", 3)
+            if len(comps) == 4:
+                _, partition, gres, name = comps
+                if "gpu" in partition.lower() or "gpu" in gres.lower():
+                    self.num_gpu_jobs += 1
+            else:
+                name = line
+            self.names.append(name.strip())
+        self.num_jobs = len(self.names)
+        self.num_cpu_jobs = self.num_jobs - self.num_gpu_jobs
+        self._name_counts = Counter(self.names)
+        self._counts = {}  # match -> number of jobs whose name contains it
+
+    def count(self, match):
+        """ Number of jobs in the queue whose name contains match. """
+        num = self._counts.get(match)
+        if num is None:
+            # A substring match, as some external scripts prepend to the job name we give them
+            num = sum(n for name, n in self._name_counts.items() if match in name)
+            self._counts[match] = num
+        return num
+
+    def reuse_counts(self, previous):
+        """ Takes the counts already worked out by previous, if it has exactly the same jobs """
+        if previous is not None and previous._name_counts == self._name_counts:
+            self._counts = previous._counts
+
+    def get_age(self):
+        return time.time() - self.timestamp
+
+    def __len__(self):
+        return self.num_jobs
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __str__(self):
+        return f"QueueSnapshot({self.num_cpu_jobs} cpu jobs, {self.num_gpu_jobs} gpu jobs)"
+
+
+class QueueMonitor:
+    """ Fetches QueueSnapshots, reusing the last one until it is older than the ttl """
+
+    default_command = "squeue -h -u $USER -o '%A|%P|%b|%.200j'"
+
+    def __init__(self, command=None, ttl=10):
+        self.logger = get_logger()
+        self.command = command or self.default_command
+        self.ttl = ttl
+        self.latest = None
+
+    def get(self, force=False):
+        if force or self.latest is None or self.latest.get_age() >= self.ttl:
+            output = subprocess.check_output(self.command, shell=True, text=True)
+            snapshot = QueueSnapshot(output.splitlines())
+            snapshot.reuse_counts(self.latest)
+            self.latest = snapshot
+            self.logger.debug(f"Fetched new queue snapshot: {self.latest}")
+        return self.latest
@@ -2,12 +2,13 @@ import os
 import shutil
 import subprocess
 import re
-import pandas as pd
 import numpy as np
 
 from pippin.base import ConfigBasedExecutable
 from pippin.config import mkdirs, get_data_loc, chown_dir
 from pippin.dataprep import DataPrep
+from pippin.file_cache import read_lines
+from pippin.io.fitres import load_fitres
 from pippin.snana_sim import SNANASimulation
 from pippin.task import Task
 
@@ -29,6 +30,8 @@ class SNANALightCurveFit(ConfigBasedExecutable):
         blind: bool - whether or not to blind cosmo results
     """
 
+    cacheable = True
+
     def __init__(self, name, output_dir, sim_task, config, global_config):
 
         self.config = config
@@ -82,10 +85,9 @@ class SNANALightCurveFit(ConfigBasedExecutable):
             potential_path = get_data_loc(f)
             if os.path.exists(potential_path):
                 self.logger.debug(f"Loading in fitopts from {potential_path}")
-                with open(potential_path) as f:
-                    new_fitopts = list(f.read().splitlines())
-                    self.fitopts += new_fitopts
-                    self.logger.debug(f"Loaded {len(new_fitopts)} fitopts file from {potential_path}")
+                new_fitopts = read_lines(potential_path)
+                self.fitopts += new_fitopts
+                self.logger.debug(f"Loaded {len(new_fitopts)} fitopts file from {potential_path}")
             else:
                 assert "[" in f and "]" in f, f"Manual fitopt {f} for lcfit {self.name} should specify a label in square brackets"
                 if not f.startswith("FITOPT:"):
@@ -129,7 +131,7 @@ class SNANALightCurveFit(ConfigBasedExecutable):
                 if not os.path.exists(full_path):
                     self.logger.info(f"{full_path} not found, seeing if it was gzipped")
                     full_path += ".gz"
-                data = pd.read_csv(full_path, delim_whitespace=True, comment="#", compression="infer")
+                data = load_fitres(full_path, columns=["CID", "TYPE"])
                 d = data.groupby("TYPE").agg(num=("CID", "count"))
                 self.logger.info("Types:  " + ("  ".join([f"{k}:{v}" for k, v in zip(d.index, d["num"].values)])))
                 d.to_csv(os.path.join(path, "stats.txt"))
@@ -208,9 +210,13 @@ class SNANALightCurveFit(ConfigBasedExecutable):
         # We want to do our hashing check here
         string_to_hash = self.fitopts + self.base
         new_hash = self.get_hash_from_string("".join(string_to_hash))
+        self.cache_key = self.get_cache_key("".join(string_to_hash))
         old_hash = self.get_old_hash()
         regenerate = force_refresh or (old_hash is None or old_hash != new_hash)
 
+        if regenerate and not force_refresh and self.restore_from_cache(new_hash):
+            return False, new_hash
+
         if regenerate:
             self.logger.info(f"Running Light curve fit. Removing output_dir")
             shutil.rmtree(self.output_dir, ignore_errors=True)
@@ -226,6 +232,11 @@ class SNANALightCurveFit(ConfigBasedExecutable):
 
         return regenerate, new_hash
 
+    def get_cache_values(self):
+        values = super().get_cache_values()
+        values["$PIPPIN_GENVERSION"] = self.sim_version
+        return values
+
     def _run(self, force_refresh):
         regenerate, new_hash = self.write_nml(force_refresh)
         if not regenerate:
@@ -3,12 +3,14 @@ import inspect
 import logging
 import shutil
 import subprocess
-import tempfile
 import collections
 import json
 
 from pippin.base import ConfigBasedExecutable
-from pippin.config import chown_dir, copytree, mkdirs, get_data_loc, get_hash
+from pippin.config import chown_dir, mkdirs, get_data_loc, get_hash
+from pippin.file_cache import read_lines
+from pippin.hashing import InMemoryFile
+from pippin.sntypes import TypeLookup
 from pippin.task import Task
 
 
@@ -35,11 +37,14 @@ class SNANASimulation(ConfigBasedExecutable):
         genversion: genversion of sim
         types_dict: dict map from IA or NONIA to numeric gentypes
         types: dict map from numeric gentype to string (Ia, II, etc)
+        type_lookup: TypeLookup built from types_dict, for labelling SNTYPE columns
         photometry_dirs: location of fits files with photometry. is a list.
         ranseed_change: true or false for if RANSEED_CHANGE was set
         blind: bool - whether to blind cosmo results
     """
 
+    cacheable = True
+
     def __init__(self, name, output_dir, genversion, config, global_config, combine="combine.input"):
         self.data_dirs = global_config["DATA_DIRS"]
         base_file = get_data_loc(combine)
@@ -73,12 +78,11 @@ class SNANASimulation(ConfigBasedExecutable):
                 Task.fail_config(f"Cannot find sim component {k} base file at {base_path} for sim name {self.name}")
 
             gentype, genmodel = None, None
-            with open(base_path) as f:
-                for line in f.read().splitlines():
-                    if line.upper().strip().startswith("GENTYPE:"):
-                        gentype = line.upper().split(":")[1].strip()
-                    if line.upper().strip().startswith("GENMODEL:"):
-                        genmodel = line.upper().split(":")[1].strip()
+            for line in read_lines(base_path):
+                if line.upper().strip().startswith("GENTYPE:"):
+                    gentype = line.upper().split(":")[1].strip()
+                if line.upper().strip().startswith("GENMODEL:"):
+                    genmodel = line.upper().split(":")[1].strip()
             gentype = gentype or d.get("GENTYPE")
             genmodel = genmodel or d.get("GENMODEL")
 
@@ -104,6 +108,7 @@ class SNANASimulation(ConfigBasedExecutable):
         sorted_types = collections.OrderedDict(sorted(types.items()))
         self.logger.debug(f"Types found: {json.dumps(sorted_types)}")
         self.output["types_dict"] = types_dict
+        self.output["type_lookup"] = TypeLookup(types_dict)
         self.output["types"] = sorted_types
         self.global_config = global_config
 
@@ -206,66 +211,71 @@ class SNANASimulation(ConfigBasedExecutable):
         self.set_property("SIMGEN_INFILE_NONIa", " ".join([os.path.basename(f) for f in self.base_cc]) if self.base_cc else None)
         self.set_property("GENPREFIX", self.genprefix)
 
-        # Put config in a temp directory
-        temp_dir_obj = tempfile.TemporaryDirectory()
-        temp_dir = temp_dir_obj.name
-
-        # Copy the base files across
-        input_paths = []
+        # Work out the input files in memory. Unmodified files are hashed and copied straight from their source.
+        input_files = collections.OrderedDict()  # basename -> path of the original, or InMemoryFile if we modify it
         for f in self.base_ia + self.base_cc:
             resolved = get_data_loc(f)
-            shutil.copy(resolved, temp_dir)
-            input_paths.append(os.path.join(temp_dir, os.path.basename(f)))
-            self.logger.debug(f"Copying input file {resolved} to {temp_dir}")
+            input_files[os.path.basename(f)] = resolved
+            self.logger.debug(f"Using input file {resolved}")
 
-        # Copy the include input file if there is one
+        def read_input(basename):
+            source = input_files[basename]
+            if isinstance(source, InMemoryFile):
+                return source.content
+            with open(source, "r", newline="") as f:
+                return f.read()
+
+        # Add the include input files if there are any
         input_copied = []
         fs = self.base_ia + self.base_cc
         for ff in fs:
             if ff not in input_copied:
                 input_copied.append(ff)
-                path = get_data_loc(ff)
-                copied_path = os.path.join(temp_dir, os.path.basename(path))
-                with open(path, "r") as f:
-                    for line in f.readlines():
-                        line = line.strip()
-                        if line.startswith("INPUT_FILE_INCLUDE"):
-                            include_file = line.split(":")[-1].strip()
-                            include_file_path = get_data_loc(include_file)
-                            self.logger.debug(f"Copying INPUT_FILE_INCLUDE file {include_file_path} to {temp_dir}")
-
-                            include_file_basename = os.path.basename(include_file_path)
-                            include_file_output = os.path.join(temp_dir, include_file_basename)
-
-                            if include_file_output not in input_copied:
-
-                                # Copy include file into the temp dir
-                                shutil.copy(include_file_path, temp_dir)
-
-                                # Then SED the file to replace the full path with just the basename
-                                if include_file != include_file_basename:
-                                    sed_command = f"sed -i -e 's|{include_file}|{include_file_basename}|g' {copied_path}"
-                                    self.logger.debug(f"Running sed command: {sed_command}")
-                                    subprocess.run(sed_command, stderr=subprocess.STDOUT, cwd=temp_dir, shell=True)
-
-                                # And make sure we dont do this file again
-                                fs.append(include_file_output)
-
-        # Write the primary input file
-        main_input_file = f"{temp_dir}/{self.genversion}.input"
-        with open(main_input_file, "w") as f:
-            f.writelines(map(lambda s: s + "\n", self.base))
-        self.logger.info(f"Input file written to {main_input_file}")
-
-        # Remove any duplicates and order the output files
-        output_files = [f"{temp_dir}/{a}" for a in sorted(os.listdir(temp_dir))]
+                if isinstance(ff, InMemoryFile):
+                    basename = ff.name
+                    lines = read_input(basename).splitlines()
+                else:
+                    path = get_data_loc(ff)
+                    basename = os.path.basename(path)
+                    lines = read_lines(path)
+                for line in lines:
+                    line = line.strip()
+                    if line.startswith("INPUT_FILE_INCLUDE"):
+                        include_file = line.split(":")[-1].strip()
+                        include_file_path = get_data_loc(include_file)
+                        self.logger.debug(f"Using INPUT_FILE_INCLUDE file {include_file_path}")
+
+                        include_file_basename = os.path.basename(include_file_path)
+                        include_file_output = InMemoryFile(include_file_basename, None)
+
+                        if include_file_output not in input_copied:
+                            input_files[include_file_basename] = include_file_path
+
+                            # Then replace the full path with just the basename in the including file
+                            if include_file != include_file_basename:
+                                self.logger.debug(f"Replacing {include_file} with {include_file_basename} in {basename}")
+                                input_files[basename] = InMemoryFile(basename, read_input(basename).replace(include_file, include_file_basename))
+
+                            # And make sure we dont do this file again
+                            fs.append(include_file_output)
+
+        # The primary input file
+        main_input_name = f"{self.genversion}.input"
+        input_files[main_input_name] = InMemoryFile(main_input_name, "".join(s + "\n" for s in self.base))
+
+        # Order the input files as they would be listed in the output directory
+        output_files = [input_files[name] for name in sorted(input_files.keys())]
         self.logger.debug(f"{len(output_files)} files used to create simulation. Hashing them.")
 
         # Get current hash
         new_hash = self.get_hash_from_files(output_files)
+        self.cache_key = self.get_cache_key_from_files(output_files)
         old_hash = self.get_old_hash()
         regenerate = force_refresh or (old_hash is None or old_hash != new_hash)
 
+        if regenerate and not force_refresh and self.restore_from_cache(new_hash):
+            return False, new_hash
+
         if regenerate:
             self.logger.info(f"Running simulation")
             # Clean output dir. God I feel dangerous doing this, so hopefully unnecessary check
@@ -273,8 +283,14 @@ class SNANASimulation(ConfigBasedExecutable):
                 self.logger.debug(f"Cleaning output directory {self.output_dir}")
                 shutil.rmtree(self.output_dir, ignore_errors=True)
                 mkdirs(self.output_dir)
-                self.logger.debug(f"Copying from {temp_dir} to {self.output_dir}")
-                copytree(temp_dir, self.output_dir)
+                self.logger.debug(f"Writing input files to {self.output_dir}")
+                for name, source in input_files.items():
+                    if isinstance(source, InMemoryFile):
+                        with open(os.path.join(self.output_dir, name), "w", newline="") as f:
+                            f.write(source.content)
+                    else:
+                        shutil.copy2(source, os.path.join(self.output_dir, name))
+                self.logger.info(f"Input file written to {self.config_path}")
                 self.save_new_hash(new_hash)
             else:
                 self.logger.error(f"Seems to be an issue with the output dir path: {self.output_dir}")
@@ -282,9 +298,18 @@ class SNANASimulation(ConfigBasedExecutable):
             chown_dir(self.output_dir)
         else:
             self.logger.info("Hash check passed, not rerunning")
-        temp_dir_obj.cleanup()
         return regenerate, new_hash
 
+    def get_cache_dirs(self):
+        return self.sim_folders
+
+    def get_cache_values(self):
+        values = super().get_cache_values()
+        values["$PIPPIN_GENVERSION"] = self.genversion
+        if self.genprefix != self.genversion:
+            values["$PIPPIN_GENPREFIX"] = self.genprefix
+        return values
+
     def _run(self, force_refresh):
 
         regenerate, new_hash = self.write_input(force_refresh)
@@ -339,7 +364,7 @@ class SNANASimulation(ConfigBasedExecutable):
                 if not os.path.exists(s_end):
                     self.logger.debug(f"Linking {s} -> {s_end}")
                     os.symlink(s, s_end, target_is_directory=True)
-                chown_dir(self.output_dir)
+            chown_dir(self.output_dir)
             self.output.update({"photometry_dirs": s_ends})
             return Task.FINISHED_SUCCESS
 
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+
+class TypeLookup:
+    """ Maps SNANA SNTYPE values to a truth label: 1.0 for Ia, 0.0 for non-Ia and NaN for anything else.
+
+    Built once by the simulation and data prep tasks from their types_dict, so every aggregator labels
+    millions of rows with a couple of vectorised membership tests instead of a python lambda per row.
+    """
+
+    def __init__(self, types_dict):
+        self.ia = np.unique(np.array(types_dict.get("IA", []), dtype=np.float64))
+        self.nonia = np.unique(np.array(types_dict.get("NONIA", []), dtype=np.float64))
+
+    def has_ia(self):
+        return self.ia.size > 0
+
+    def has_nonia(self):
+        return self.nonia.size > 0
+
+    def label(self, sntypes):
+        """ Labels an array or series of SNTYPEs. Values which are not numbers (including strings like "1") are converted first.
+
+        :param sntypes: array like of types
+        :return: float array of 1.0 (Ia), 0.0 (non-Ia) or NaN (unknown)
+        """
+        values = pd.to_numeric(pd.Series(np.asarray(sntypes)), errors="coerce").to_numpy(dtype=np.float64)
+        is_ia = np.isin(values, self.ia)
+        result = np.full(values.shape, np.nan)
+        result[np.isin(values, self.nonia)] = 0.0
+        result[is_ia] = 1.0  # Ia wins if a type is listed as both
+        return result
+
+    def __str__(self):
+        return f"TypeLookup(IA={self.ia.astype(int).tolist()}, NONIA={self.nonia.astype(int).tolist()})"
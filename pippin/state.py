@@ -0,0 +1,110 @@
+import json
+import os
+import sqlite3
+import time
+
+from pippin.config import get_logger, chown_file
+
+
+class StateStore:
+    """ Keeps the state of every task in a run in a single sqlite database, instead of a hash.txt per task.
+
+    Restarting a run with thousands of tasks otherwise means opening thousands of small files, which is very slow on
+    shared network filesystems. Writes are not committed straight away, the manager calls `commit` once per loop so
+    they are batched into a single transaction.
+
+    Enable it by setting `state_db: True` in the OUTPUT section of the global config. The database lives in the run's
+    output directory as `pippin_state.db`. Existing runs which used hash files are imported the first time the database
+    is created.
+    """
+
+    filename = "pippin_state.db"
+    RUNNING = "running"
+    SUCCESS = "success"
+    FAILURE = "failure"
+    IMPORTED = "imported"
+
+    def __init__(self, output_dir):
+        self.logger = get_logger()
+        self.path = os.path.join(output_dir, self.filename)
+        self.is_new = not os.path.exists(self.path)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "output_dir TEXT PRIMARY KEY, name TEXT, type TEXT, hash TEXT, status TEXT, "
+            "start_time REAL, end_time REAL, wall_time INTEGER, output TEXT)"
+        )
+        self.connection.commit()
+        if self.is_new:
+            chown_file(self.path)
+        self.rows = {row[0]: list(row) for row in self.connection.execute("SELECT * FROM tasks")}
+        self.num_pending = 0
+
+    def _get(self, task):
+        return self.rows.get(task.output_dir)
+
+    def _update(self, task, **values):
+        row = self.rows.get(task.output_dir)
+        if row is None:
+            row = [task.output_dir, task.name, task.__class__.__name__, None, None, None, None, None, None]
+            self.rows[task.output_dir] = row
+        columns = ["output_dir", "name", "type", "hash", "status", "start_time", "end_time", "wall_time", "output"]
+        for key, value in values.items():
+            row[columns.index(key)] = value
+        self.connection.execute(f"INSERT OR REPLACE INTO tasks VALUES ({', '.join('?' * len(columns))})", row)
+        self.num_pending += 1
+
+    def get_hash(self, task):
+        row = self._get(task)
+        if row is None or row[3] is None:
+            return None
+        if not os.path.isdir(task.output_dir):
+            self.logger.debug(f"Output directory for {task} has been removed, ignoring stored hash")
+            return None
+        return row[3]
+
+    def save_hash(self, task, new_hash):
+        self._update(task, hash=new_hash, status=self.RUNNING, start_time=time.time(), end_time=None, wall_time=None)
+
+    def clear_hash(self, task):
+        if self._get(task) is not None:
+            self._update(task, hash=None)
+
+    def get_start_time(self, task):
+        row = self._get(task)
+        return None if row is None else row[5]
+
+    def get_status(self, task):
+        row = self._get(task)
+        return None if row is None else row[4]
+
+    def set_finished(self, task, success):
+        """ Records the result, times and outputs of a finished task """
+        output = json.dumps(task.output, default=str)
+        status = self.SUCCESS if success else self.FAILURE
+        self._update(task, status=status, start_time=task.start_time, end_time=task.end_time, wall_time=task.wall_time, output=output)
+
+    def import_tasks(self, tasks):
+        """ Reads in the hash and done files of tasks from a run which predates the database. Only needs to happen once. """
+        num_imported = 0
+        for task in tasks:
+            if self._get(task) is not None or not os.path.exists(task.hash_file):
+                continue
+            with open(task.hash_file) as f:
+                old_hash = f.read().strip()
+            start_time = os.path.getmtime(task.hash_file)
+            end_time = os.path.getmtime(task.done_file) if os.path.exists(task.done_file) else None
+            self._update(task, hash=old_hash, status=self.IMPORTED, start_time=start_time, end_time=end_time)
+            num_imported += 1
+        self.commit()
+        self.logger.info(f"Imported {num_imported} task hashes from hash files into {self.path}")
+
+    def commit(self):
+        if self.num_pending:
+            self.connection.commit()
+            self.logger.debug(f"Committed {self.num_pending} task state updates")
+            self.num_pending = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
 from pippin.config import get_logger, get_hash, ensure_list
+from pippin.hashing import InMemoryFile, get_hash_of_files
 import os
 import datetime
 import numpy as np
@@ -9,6 +10,12 @@ class Task(ABC):
     FINISHED_SUCCESS = -1
     FINISHED_FAILURE = -9
     logger = get_logger()
+    state_store = None  # Set by the manager when using a StateStore instead of hash files
+    task_cache = None  # Set by the manager when a shared TaskCache is configured
+    executor = None  # Set by the manager, to run job scripts through slurm or a local pool. Defaults to slurm.
+    worker_pool = None  # Set by the manager, a process pool shared by every task which runs python in worker processes
+    can_run_locally = False  # Whether the job scripts of this task type can be run by a LocalPoolExecutor
+    cacheable = False  # Whether the outputs of this task type can be shared between runs through the TaskCache
 
     def __init__(self, name, output_dir, dependencies=None):
         self.name = name
@@ -18,6 +25,7 @@ class Task(ABC):
             dependencies = []
         self.dependencies = dependencies
         self.hash = None
+        self.cache_key = None
         self.output = {"name": name, "output_dir": output_dir}
         self.hash_file = os.path.join(self.output_dir, "hash.txt")
         self.done_file = os.path.join(self.output_dir, "done.txt")
@@ -31,11 +39,20 @@ class Task(ABC):
         self.display_threshold = 0
         self.gpu = False
 
+    def get_executor(self):
+        from pippin.executor import get_default_executor
+
+        return self.executor if self.executor is not None else get_default_executor()
+
+    def submit_job(self, script):
+        """ Runs a job script through this task's executor, from the output directory """
+        self.get_executor().submit(script, self.output_dir)
+
     def check_for_job(self, squeue, match):
-        if squeue is None:
+        num_jobs = self.get_executor().get_num_jobs(match, squeue)
+        if num_jobs is None:
             return self.num_jobs
 
-        num_jobs = len([i for i in squeue if match in i])
         if num_jobs == 0:
             self.num_empty += 1
             if self.num_empty >= self.num_empty_threshold:
@@ -46,6 +63,10 @@ class Task(ABC):
             return 0
         return num_jobs
 
+    def get_done_files(self):
+        """ The files whose appearance signals that this task might have finished. Used to wake up the manager. """
+        return [self.done_file]
+
     def should_be_done(self):
         self.fresh_run = False
 
@@ -53,25 +74,29 @@ class Task(ABC):
         self.stage = stage
 
     def get_old_hash(self, quiet=False, required=False):
-        if os.path.exists(self.hash_file):
+        if self.state_store is not None:
+            old_hash = self.state_store.get_hash(self)
+            if old_hash is not None:
+                if not quiet:
+                    self.logger.debug(f"Previous result found, hash is {old_hash}")
+                return old_hash
+        elif os.path.exists(self.hash_file):
             with open(self.hash_file, "r") as f:
                 old_hash = f.read().strip()
                 if not quiet:
                     self.logger.debug(f"Previous result found, hash is {old_hash}")
                 return old_hash
+        if required:
+            self.logger.error(f"No hash found for {self}")
         else:
-            if required:
-                self.logger.error(f"No hash found for {self}")
-            else:
-                self.logger.debug(f"No hash found for {self}")
+            self.logger.debug(f"No hash found for {self}")
         return None
 
     def get_hash_from_files(self, output_files):
-        string_to_hash = ""
-        for file in output_files:
-            with open(file, "r") as f:
-                string_to_hash += f.read()
-        new_hash = self.get_hash_from_string(string_to_hash)
+        """ Hash of the contents of the files (paths or InMemoryFiles) and our dependencies' hashes, as if concatenated into one string """
+        hashes = sorted([dep.get_old_hash(quiet=True, required=True) for dep in self.dependencies])
+        new_hash = get_hash_of_files(output_files, suffix=" ".join(hashes))
+        self.logger.debug(f"Current hash set to {new_hash}")
         return new_hash
 
     def get_hash_from_string(self, string_to_hash):
@@ -82,11 +107,79 @@ class Task(ABC):
         return new_hash
 
     def save_new_hash(self, new_hash):
+        if self.state_store is not None:
+            self.state_store.save_hash(self, str(new_hash))
+            self.logger.debug(f"New hash {new_hash} saved to state store")
+            return
         with open(self.hash_file, "w") as f:
             f.write(str(new_hash))
             self.logger.debug(f"New hash {new_hash}")
             self.logger.debug(f"New hash saved to {self.hash_file}")
 
+    def clear_hash(self):
+        """ Forgets the saved hash, so the task reruns next time """
+        if self.state_store is not None:
+            self.state_store.clear_hash(self)
+        elif os.path.exists(self.hash_file):
+            os.remove(self.hash_file)
+
+    def get_cache_values(self):
+        """ Strings in this task's inputs and outputs which come from its name or where it runs rather than what it does.
+
+        They're replaced with the placeholders in the cache key, so the key can match across runs and configs, and the
+        TaskCache swaps them for this task's values when restoring outputs.
+
+        :return: dictionary of placeholder to value
+        """
+        return {"$PIPPIN_TASK_OUTPUT": self.output_dir}
+
+    def normalise_for_cache(self, text):
+        # Longest first, so a value containing another (like the output directory containing the GENVERSION) is replaced whole
+        for placeholder, value in sorted(self.get_cache_values().items(), key=lambda v: len(v[1]), reverse=True):
+            if value:
+                text = text.replace(value, placeholder)
+        return text
+
+    def get_dependency_cache_keys(self):
+        """ The cache keys of our dependencies, or their hashes if they aren't cacheable """
+        return sorted([dep.cache_key if dep.cache_key is not None else str(dep.get_old_hash(quiet=True, required=True)) for dep in self.dependencies])
+
+    def get_cache_key(self, string_to_hash):
+        """ A hash of the inputs which does not depend on what this task is called or where its outputs go, so it can match across runs """
+        return get_hash(self.normalise_for_cache(string_to_hash) + " ".join(self.get_dependency_cache_keys()))
+
+    def get_cache_key_from_files(self, output_files):
+        """ Like `get_cache_key`, for the input files (paths or InMemoryFiles) given to `get_hash_from_files`.
+
+        Only the InMemoryFiles are normalised, the files on disk come from the config rather than being written per task.
+        """
+        sources = [InMemoryFile(s.name, self.normalise_for_cache(s.content)) if isinstance(s, InMemoryFile) else s for s in output_files]
+        return get_hash_of_files(sources, suffix=" ".join(self.get_dependency_cache_keys()))
+
+    def get_cache_dirs(self):
+        """ Directories outside output_dir which hold outputs of this task and should be cached with it """
+        return []
+
+    def restore_from_cache(self, new_hash):
+        """ If an identical task has finished before, put its outputs into place instead of running again.
+
+        :param new_hash: the hash to save if the outputs are restored
+        :return: true if the outputs were restored from the cache
+        """
+        if self.task_cache is None or not self.cacheable or self.cache_key is None:
+            return False
+        if not self.task_cache.restore(self.cache_key, self.output_dir, self.get_cache_dirs(), self.get_cache_values()):
+            return False
+        self.save_new_hash(new_hash)
+        self.should_be_done()
+        return True
+
+    def store_in_cache(self):
+        """ Adds the outputs of this task to the shared cache, if it has one. Called by the manager once successfully finished. """
+        if self.task_cache is None or not self.cacheable or self.cache_key is None or not self.fresh_run:
+            return
+        self.task_cache.store(self.cache_key, self.name, self.__class__.__name__, self.output_dir, self.get_cache_dirs(), self.get_cache_values())
+
     def set_num_jobs(self, num_jobs):
         self.num_jobs = num_jobs
 
@@ -189,19 +282,23 @@ class Task(ABC):
         if result in [Task.FINISHED_SUCCESS, Task.FINISHED_FAILURE]:
             if os.path.exists(self.done_file):
                 self.end_time = os.path.getmtime(self.done_file)
-                if self.start_time is None and os.path.exists(self.hash_file):
-                    self.start_time = os.path.getmtime(self.hash_file)
+                if self.start_time is None:
+                    if self.state_store is not None:
+                        self.start_time = self.state_store.get_start_time(self)
+                    elif os.path.exists(self.hash_file):
+                        self.start_time = os.path.getmtime(self.hash_file)
                 if self.end_time is not None and self.start_time is not None:
                     self.wall_time = int(self.end_time - self.start_time + 0.5)  # round up
                     self.logger.info(f"Task finished with wall time {self.get_wall_time_str()}")
-            if result == Task.FINISHED_FAILURE and os.path.exists(self.hash_file):
-                os.remove(self.hash_file)
+            if result == Task.FINISHED_FAILURE:
+                self.clear_hash()
+            if self.state_store is not None:
+                self.state_store.set_finished(self, result == Task.FINISHED_SUCCESS)
         elif not self.fresh_run:
             self.logger.error("Hash check had passed, so the task should be done, but it said it wasn't!")
             self.logger.error(f"This means it probably crashed, have a look in {self.output_dir}")
             self.logger.error(f"Removing hash from {self.hash_file}")
-            if os.path.exists(self.hash_file):
-                os.remove(self.hash_file)
+            self.clear_hash()
             return Task.FINISHED_FAILURE
         return result
 
@@ -0,0 +1,83 @@
+import json
+import os
+from collections import defaultdict
+
+from pippin.config import get_logger, chown_file
+
+
+class WallTimeHistory:
+    """ Remembers how long tasks took in previous runs, so the scheduler can estimate how long they will take this time.
+
+    Wall times are stored per task as "Type/name" in a small json file, keeping a running mean. Tasks never seen before
+    are estimated with the mean of their task type, and if the type has never been seen either, the default.
+    """
+
+    max_count = 10  # Cap on the number of runs in the running mean, so estimates follow changes to a task
+
+    def __init__(self, path, default=60):
+        self.logger = get_logger()
+        self.path = path
+        self.default = default
+        self.history = self._load()
+        self.recorded = {}
+        self._update_type_means()
+
+    def _load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Unable to read wall time history from {self.path}, ignoring it: {e}")
+            return {}
+
+    def _update_type_means(self):
+        totals = defaultdict(list)
+        for key, value in self.history.items():
+            totals[key.split("/")[0]].append(value["mean"])
+        self.type_means = {k: sum(v) / len(v) for k, v in totals.items()}
+
+    @staticmethod
+    def get_key(task):
+        return f"{task.__class__.__name__}/{task.name}"
+
+    def has_estimate(self, task):
+        return self.get_key(task) in self.history
+
+    def estimate(self, task):
+        """ Estimated wall time of the task in seconds """
+        entry = self.history.get(self.get_key(task))
+        if entry is not None:
+            return entry["mean"]
+        return self.type_means.get(task.__class__.__name__, self.default)
+
+    def record(self, task):
+        """ Adds the wall time of a task which has just finished running """
+        if task.wall_time is None:
+            return
+        self.recorded[self.get_key(task)] = task.wall_time
+
+    def save(self):
+        """ Merges this run's wall times into the history file, rereading it first in case another run has updated it """
+        if self.path is None or not self.recorded:
+            return
+        history = self._load()
+        for key, wall_time in self.recorded.items():
+            entry = history.get(key, {"mean": 0.0, "count": 0})
+            count = min(entry["count"], self.max_count - 1)
+            entry["mean"] = (entry["mean"] * count + wall_time) / (count + 1)
+            entry["count"] = count + 1
+            history[key] = entry
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(history, f, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+            chown_file(self.path)
+        except OSError as e:
+            self.logger.warning(f"Unable to save wall time history to {self.path}: {e}")
+            return
+        self.history = history
+        self.recorded = {}
+        self._update_type_means()
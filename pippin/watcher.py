@@ -0,0 +1,160 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from pippin.config import get_logger
+
+
+class DoneFileWatcher:
+    """ Wait for done files to appear, instead of sleeping blindly between queue checks.
+
+    Uses inotify on Linux to be woken as soon as a done file is written locally, and falls back
+    to periodically stat'ing the watched paths. The polling is always active, because inotify
+    does not see writes made by other nodes on network filesystems (Lustre, GPFS, NFS), which
+    is exactly what happens when a slurm job writes its done file.
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO  # Not IN_CREATE, the done file would still be empty
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, poll_frequency=5, use_inotify=True):
+        self.logger = get_logger()
+        self.poll_frequency = poll_frequency
+        self.watched = {}  # path -> last seen (mtime_ns, size) or None if it doesn't exist
+        self.dir_watches = {}  # directory -> inotify watch descriptor
+        self.wd_dirs = {}  # inotify watch descriptor -> directory
+        self.libc = None
+        self.fd = None
+        if use_inotify:
+            self._init_inotify()
+
+    def _init_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        except (OSError, AttributeError, TypeError):
+            self.logger.debug("inotify not available, done file watcher will only poll")
+            return
+        if fd < 0:
+            self.logger.debug(f"inotify_init1 failed with errno {ctypes.get_errno()}, done file watcher will only poll")
+            return
+        self.libc = libc
+        self.fd = fd
+
+    @property
+    def uses_inotify(self):
+        return self.fd is not None
+
+    def _stat(self, path):
+        try:
+            s = os.stat(path)
+            return s.st_mtime_ns, s.st_size
+        except OSError:
+            return None
+
+    def _add_dir_watch(self, directory):
+        if self.fd is None or directory in self.dir_watches or not os.path.isdir(directory):
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if wd < 0:
+            self.logger.debug(f"Unable to add inotify watch on {directory}, will poll it instead")
+            return
+        self.dir_watches[directory] = wd
+        self.wd_dirs[wd] = directory
+
+    def watch(self, paths):
+        """ Start watching the given done files. Their parent directories do not need to exist yet. """
+        for path in paths:
+            path = os.path.abspath(path)
+            if path in self.watched:
+                continue
+            self.watched[path] = self._stat(path)
+            self._add_dir_watch(os.path.dirname(path))
+
+    def unwatch(self, paths):
+        for path in paths:
+            self.watched.pop(os.path.abspath(path), None)
+        if self.fd is None:
+            return
+        needed = set(os.path.dirname(p) for p in self.watched)
+        for directory in [d for d in self.dir_watches if d not in needed]:
+            wd = self.dir_watches.pop(directory)
+            self.wd_dirs.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def _read_events(self):
+        changed = []
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(buffer):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(buffer, offset)
+            offset += self.EVENT_HEADER.size
+            name = buffer[offset : offset + length].rstrip(b"\0")
+            offset += length
+            directory = self.wd_dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if path in self.watched:
+                changed.append(path)
+        return changed
+
+    def _poll(self):
+        changed = []
+        for path, previous in self.watched.items():
+            current = self._stat(path)
+            if current != previous:
+                self.watched[path] = current
+                if current is not None and current[1] > 0:
+                    changed.append(path)
+            # Directories are normally created after the task is launched, so pick them up as we go
+            if self.fd is not None and os.path.dirname(path) not in self.dir_watches:
+                self._add_dir_watch(os.path.dirname(path))
+        return changed
+
+    def wait(self, timeout):
+        """ Block for up to timeout seconds, returning early if any watched done file changes.
+
+        :param timeout: maximum number of seconds to wait
+        :return: a list of the done files that changed, empty if we timed out
+        """
+        end = time.time() + timeout
+        next_poll = 0
+        while True:
+            now = time.time()
+            if now >= next_poll:
+                changed = self._poll()
+                if changed:
+                    return changed
+                next_poll = now + self.poll_frequency
+            remaining = end - now
+            if remaining <= 0:
+                return []
+            step = min(remaining, next_poll - now)
+            if self.fd is not None:
+                readable, _, _ = select.select([self.fd], [], [], step)
+                if readable:
+                    changed = self._read_events()
+                    for path in changed:
+                        self.watched[path] = self._stat(path)
+                    if changed:
+                        return changed
+            else:
+                time.sleep(step)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.dir_watches = {}
+            self.wd_dirs = {}
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from pippin.aggregator import join_predictions
+
+
+def chained_merge(dataframes, key="CID"):
+    df = dataframes[0]
+    for dataframe in dataframes[1:]:
+        df = pd.merge(df, dataframe, on=key, how="outer")
+    return df
+
+
+def make_predictions(rng, num_classifiers=5, num_rows=200):
+    dataframes = []
+    for i in range(num_classifiers):
+        cids = rng.choice(num_rows * 2, size=num_rows, replace=False).astype(str)
+        dataframes.append(pd.DataFrame({"CID": cids, f"PROB_C{i}": rng.random(num_rows)}))
+    return dataframes
+
+
+def test_join_matches_chained_merge_csv():
+    dataframes = make_predictions(np.random.default_rng(0))
+    expected = chained_merge(dataframes).to_csv(index=False, float_format="%0.4f")
+    actual = join_predictions(dataframes, "CID").to_csv(index=False, float_format="%0.4f")
+    assert actual == expected
+
+
+def test_single_file_unchanged():
+    df = pd.DataFrame({"CID": ["3", "1"], "PROB_A": [0.1, 0.9]})
+    assert join_predictions([df], "CID") is df
+
+
+def test_duplicate_cids_fall_back_to_merge():
+    a = pd.DataFrame({"CID": ["1", "1", "2"], "PROB_A": [0.1, 0.2, 0.3]})
+    b = pd.DataFrame({"CID": ["1", "3"], "PROB_B": [0.5, 0.6]})
+    pd.testing.assert_frame_equal(join_predictions([a, b], "CID"), chained_merge([a, b]))
+
+
+def test_clashing_columns_fall_back_to_merge():
+    a = pd.DataFrame({"CID": ["1", "2"], "PROB_A": [0.1, 0.2]})
+    b = pd.DataFrame({"CID": ["2", "3"], "PROB_A": [0.5, 0.6]})
+    pd.testing.assert_frame_equal(join_predictions([a, b], "CID"), chained_merge([a, b]))
@@ -0,0 +1,112 @@
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+from astropy.table import Table
+
+from pippin.aggregator import Aggregator
+from pippin.executor import LocalPoolExecutor, get_process_pool
+from pippin.state import StateStore
+from pippin.task import Task
+from tests.utils import get_manager
+
+
+def get_aggregator(tmp_path, prediction_files):
+    manager = get_manager(yaml="tests/config_files/valid_agg.yml", check=True)
+    agg = manager.tasks[-1]
+    sim_task = agg.sim_task
+
+    phot_dir = tmp_path / "phot"
+    phot_dir.mkdir()
+    Table({"SNID": ["1", "2", "3"], "SNTYPE": [1, 20, 1]}).write(str(phot_dir / "SIM_HEAD.FITS"))
+    sim_task.output["photometry_dirs"] = [str(phot_dir)]
+    for c, f in zip(agg.classifiers, prediction_files):
+        c.output["predictions_filename"] = f
+        c.output["predictions_filenames"] = [f]
+        c.get_old_hash = lambda quiet=False, required=False, name=c.name: name
+
+    return Aggregator("AGG", str(tmp_path / "agg"), agg.dependencies, {"PLOT": False, "MAX_WORKERS": 2}, None)
+
+
+def wait_for(agg, timeout=60):
+    start = time.time()
+    while time.time() - start < timeout:
+        result = agg.check_completion(None)
+        if result in [Task.FINISHED_SUCCESS, Task.FINISHED_FAILURE]:
+            return result
+        time.sleep(0.1)
+    raise TimeoutError("Aggregator did not finish")
+
+
+def write_predictions(tmp_path):
+    files = []
+    for i, cids in enumerate([[1, 2, 3], [2, 3]]):
+        path = str(tmp_path / f"predictions_{i}.csv")
+        pd.DataFrame({"SNID": cids, f"PROB_{i}": np.linspace(0.1, 0.9, len(cids))}).to_csv(path, index=False)
+        files.append(path)
+    return files
+
+
+def test_versions_run_in_workers(tmp_path):
+    agg = get_aggregator(tmp_path, write_predictions(tmp_path))
+    agg.executor = LocalPoolExecutor(1)  # Set by the manager, and must not be sent to the workers
+
+    assert agg.run(False)
+    assert agg.get_old_hash(quiet=True) is None
+    assert wait_for(agg) == Task.FINISHED_SUCCESS
+    assert os.path.exists(agg.done_file)
+    assert agg.pool is None
+    assert agg.get_old_hash(quiet=True) == agg.new_hash
+    agg.executor.shutdown()
+
+    df = pd.read_csv(agg.output["merge_predictions_filename"][0])
+    assert list(df["CID"]) == [1, 2, 3]
+    assert list(df["IA"]) == [1.0, 0.0, 1.0]
+
+
+def test_worker_failure_is_reported(tmp_path):
+    agg = get_aggregator(tmp_path, [str(tmp_path / "missing.csv")] * 2)
+
+    assert agg.run(False)
+    assert wait_for(agg) == Task.FINISHED_FAILURE
+    assert agg.get_old_hash(quiet=True) is None
+
+
+def test_unfinished_aggregation_is_rerun(tmp_path):
+    path = str(tmp_path / "predictions.csv")
+    pd.DataFrame({"SNID": [1, 2, 3], "PROB_A": [0.1, 0.5, 0.9]}).to_csv(path, index=False)
+    agg = get_aggregator(tmp_path, [path, path])
+    assert agg.run(False)
+    assert wait_for(agg) == Task.FINISHED_SUCCESS
+
+    # Hash check passes and the done file is there, so nothing is run
+    assert agg.run(False)
+    assert agg.futures is None
+    assert agg.check_completion(None) == Task.FINISHED_SUCCESS
+
+    # As if the manager died before the versions finished, then was started again
+    os.remove(agg.done_file)
+    agg = Aggregator("AGG", agg.output_dir, agg.dependencies, {"PLOT": False, "MAX_WORKERS": 2}, None)
+    assert agg.run(False)
+    assert agg.futures is not None
+    assert wait_for(agg) == Task.FINISHED_SUCCESS
+
+
+def test_shared_pool_and_state_store(tmp_path):
+    agg = get_aggregator(tmp_path, write_predictions(tmp_path))
+    agg.state_store = StateStore(str(tmp_path))  # Holds an sqlite connection, which can't be pickled
+    agg.worker_pool = get_process_pool(2)
+    state = pickle.loads(pickle.dumps(agg)).__dict__
+    assert set(state) == set(Aggregator.worker_attributes)
+
+    assert agg.run(False)
+    assert wait_for(agg) == Task.FINISHED_SUCCESS
+    assert agg.pool is None
+    assert agg.state_store.get_hash(agg) == agg.new_hash
+
+    # The manager's pool is left running for the other tasks
+    assert agg.worker_pool.submit(max, 1, 2).result() == 2
+    agg.worker_pool.shutdown()
+    agg.state_store.close()
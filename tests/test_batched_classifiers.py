@@ -0,0 +1,62 @@
+import os
+
+import pandas as pd
+
+from pippin.classifiers.fitprob import FitProbClassifier
+from pippin.classifiers.perfect import PerfectClassifier
+from pippin.classifiers.unity import UnityClassifier
+from pippin.task import Task
+from tests.utils import get_manager
+
+
+def get_tasks():
+    return get_manager(yaml="tests/config_files/valid_classify_batched.yml", check=True).tasks
+
+
+def test_instant_classifiers_cover_every_version():
+    tasks = get_tasks()
+    fitprob = [t for t in tasks if isinstance(t, FitProbClassifier)]
+    perfect = [t for t in tasks if isinstance(t, PerfectClassifier)]
+    unity = [t for t in tasks if isinstance(t, UnityClassifier)]
+
+    assert len(fitprob) == 1 and len(perfect) == 1
+    assert len(unity) == 3
+    assert fitprob[0].indexes == [0, 1, 2]
+    assert [os.path.basename(f) for f in perfect[0].output["predictions_filenames"]] == [
+        "predictions_0001.csv",
+        "predictions_0002.csv",
+        "predictions_0003.csv",
+    ]
+
+
+def test_aggregator_reads_each_version_from_batched_classifier():
+    agg = get_tasks()[-1]
+    agg.sim_task.output["photometry_dirs"] = ["phot_1", "phot_2", "phot_3"]
+    job = agg.get_version_job(1)
+    files = {column: f for f, column, _ in job["predictions"]}
+    assert os.path.basename(files["PROB_PERFECT"]) == "predictions_0002.csv"
+    assert os.path.basename(files["PROB_FITPROBTEST_D_ASIM"]) == "predictions_0002.csv"
+    assert len(files) == 3
+
+
+def test_fitprob_classifies_all_versions(tmp_path):
+    fitprob = [t for t in get_tasks() if isinstance(t, FitProbClassifier)][0]
+    lcfit = fitprob.get_fit_dependency(output=False)
+    fitres_dirs = []
+    for i in range(3):
+        d = tmp_path / f"PIP_SIM_{i + 1:04d}"
+        d.mkdir()
+        (d / "FITOPT000.FITRES").write_text(f"VARNAMES: CID zHD FITPROB\nSN: {i} 0.1 0.{i + 1}\n")
+        fitres_dirs.append(str(d))
+    lcfit.output["fitres_dirs"] = fitres_dirs
+    lcfit.output["fitopt_map"] = {"DEFAULT": "FITOPT000.FITRES"}
+    for d in fitprob.dependencies:
+        d.get_old_hash = lambda quiet=False, required=False, name=d.name: name
+    fitprob = FitProbClassifier("FITPROBTEST", str(tmp_path / "clas"), fitprob.dependencies, fitprob.mode, {}, indexes=[0, 1, 2])
+
+    assert fitprob.run(False)
+    assert fitprob.check_completion(None) == Task.FINISHED_SUCCESS
+    for i in range(3):
+        df = pd.read_csv(fitprob.get_predictions_filename(i))
+        assert list(df["CID"]) == [i]
+        assert list(df[fitprob.get_prob_column_name()]) == [float(f"0.{i + 1}")]
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+from scipy.interpolate import interp1d
+from scipy.stats import binned_statistic
+
+from pippin import calibration
+from pippin.calibration import BINS, binned_means, get_bin_index, get_calibration_curves, load_calibration_curve, recalibrate
+
+
+def get_predictions(num=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    truth = rng.integers(0, 2, num).astype(float)
+    df = pd.DataFrame({"SNID": np.arange(num), "IA": truth})
+    df["PROB_A"] = np.clip(truth * 0.6 + rng.random(num) * 0.4, 0, 1)
+    df["PROB_B"] = rng.random(num)
+    df.loc[::7, "PROB_B"] = np.nan
+    df.loc[::11, "IA"] = np.nan
+    df.loc[:4, "PROB_A"] = [0.0, 0.05, 0.5, 1.0, 2.0]  # Bin edges, including the last one
+    return df
+
+
+def test_bin_index_matches_digitize():
+    values = np.concatenate((BINS, BINS + 1e-12, BINS - 1e-12, [-5, 5, np.nan], np.random.default_rng(1).uniform(-2, 3, 1000)))
+    expected = np.where(np.isnan(values), -1, np.digitize(values, BINS) - 1)
+    assert np.array_equal(get_bin_index(values, BINS), expected)
+    uneven = np.array([0, 0.1, 0.5, 1])
+    assert np.array_equal(get_bin_index(values, uneven), np.where(np.isnan(values), -1, np.digitize(values, uneven) - 1))
+
+
+def test_binned_means_match_binned_statistic():
+    df = get_predictions()
+    means, num_usable = binned_means(df[["PROB_A", "PROB_B"]].to_numpy(), df["IA"].to_numpy())
+    for i, c in enumerate(["PROB_A", "PROB_B"]):
+        mask = np.isfinite(df[c]) & np.isfinite(df["IA"])
+        expected, _, _ = binned_statistic(df[c][mask], df["IA"][mask], bins=BINS, statistic="mean")
+        assert np.allclose(means[i], expected, equal_nan=True)
+        assert num_usable[i] == mask.sum()
+
+
+def test_calibration_curves_skip_unusable_columns():
+    df = get_predictions()
+    df["PROB_NAN"] = np.nan
+    df["PROB_FEW"] = np.nan
+    df.loc[:50, "PROB_FEW"] = 0.5
+
+    curves = get_calibration_curves(df)
+    assert list(curves.columns) == ["bins", "PROB_A", "PROB_B"]
+    assert curves["bins"].iloc[0] == 0 and curves["bins"].iloc[-1] == 1
+    assert curves["PROB_A"].between(0, 1).all()
+
+
+def test_recalibrate_matches_interp1d(tmp_path):
+    df = get_predictions()
+    df = df[df["PROB_A"] <= 1]
+    path = str(tmp_path / "calibration.csv")
+    get_calibration_curves(df).to_csv(path, index=False)
+    curves = load_calibration_curve(path)
+
+    df = df.assign(PROB_FITPROB=0.3)
+    missing = recalibrate(df, curves)
+    assert missing == ["PROB_FITPROB"]
+    for c in ["PROB_A", "PROB_B"]:
+        expected = interp1d(curves["bins"], curves[c])(df[c])
+        assert np.allclose(df[c.replace("PROB_", "CPROB_")], expected, equal_nan=True)
+    assert (df["CPROB_FITPROB"] == 0.3).all()
+
+
+def test_calibration_curve_is_cached_until_changed(tmp_path):
+    calibration.clear()
+    path = tmp_path / "calibration.csv"
+    path.write_text("bins,PROB_A\n0,0\n1,1\n")
+    first = load_calibration_curve(str(path))
+    assert load_calibration_curve(str(path)) is first
+
+    path.write_text("bins,PROB_A\n0,0\n0.5,0.4\n1,1\n")
+    assert load_calibration_curve(str(path)).shape[0] == 3
@@ -0,0 +1,60 @@
+import os
+import stat
+
+from pippin.config import _chown_tree, _chowned_dirs, forget_chowned
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_chown_tree_sets_modes_and_skips_unchanged_dirs(tmp_path, monkeypatch):
+    sub = tmp_path / "output" / "SPLIT"
+    os.makedirs(sub)
+    f = sub / "FIT.LOG"
+    f.write_text("")
+    os.chmod(f, 0o644)
+    read_only = sub / "FITOPT000.FITRES"
+    read_only.write_text("")
+    os.chmod(read_only, 0o444)
+    os.symlink(str(f), str(tmp_path / "link"))
+
+    # Directories modified in the last couple of seconds are always rescanned, so backdate them
+    for d in [tmp_path, tmp_path / "output", sub]:
+        os.utime(d, (1e9, 1e9))
+    _chown_tree(str(tmp_path), os.getgid())
+    assert mode(f) == 0o660
+    assert mode(read_only) == 0o440
+    assert mode(sub) == 0o770
+
+    # Nothing added to the directory, so it is not listed again. Whatever rewrote the file should have fixed it.
+    os.chmod(f, 0o644)
+    listed = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda path: listed.append(path) or scandir(path))
+    _chown_tree(str(tmp_path), os.getgid())
+    monkeypatch.undo()
+    assert listed == []
+    assert mode(f) == 0o644
+
+    (sub / "NEW.LOG").write_text("")
+    _chown_tree(str(tmp_path), os.getgid())
+    assert mode(f) == 0o660
+    assert mode(sub / "NEW.LOG") == 0o660
+
+
+def test_forget_chowned_rescans_finished_task(tmp_path):
+    sub = tmp_path / "TASK" / "SPLIT"
+    os.makedirs(sub)
+    f = sub / "FIT.LOG"
+    f.write_text("")
+    for d in [tmp_path / "TASK", sub]:
+        os.utime(d, (1e9, 1e9))
+    _chown_tree(str(tmp_path / "TASK"), os.getgid())
+    assert str(sub) in _chowned_dirs
+
+    forget_chowned(str(tmp_path / "TASK"))
+    assert str(sub) not in _chowned_dirs and str(tmp_path / "TASK") not in _chowned_dirs
+    os.chmod(f, 0o644)
+    _chown_tree(str(tmp_path / "TASK"), os.getgid())
+    assert mode(f) == 0o660
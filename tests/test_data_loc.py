@@ -0,0 +1,23 @@
+import os
+
+from pippin.config import get_data_loc, clear_data_loc_cache, get_data_loc_stats
+
+
+def test_lookups_are_cached_including_misses(tmp_path):
+    clear_data_loc_cache()
+    data_dir = str(tmp_path)
+    assert get_data_loc("sims/base.input", extra=data_dir, quiet=True) is None
+
+    # Created after the first lookup, so the cached miss still applies
+    os.makedirs(tmp_path / "sims")
+    (tmp_path / "sims" / "base.input").write_text("GENTYPE: 1\n")
+    assert get_data_loc("sims/base.input", extra=data_dir, quiet=True) is None
+    assert get_data_loc_stats() == {"hits": 1, "misses": 1}
+
+    # A different set of data dirs is a different key
+    other = get_data_loc("base.input", extra=str(tmp_path / "sims"))
+    assert other == os.path.join(str(tmp_path / "sims"), "base.input")
+
+    clear_data_loc_cache()
+    assert get_data_loc("sims/base.input", extra=data_dir) == os.path.join(data_dir, "sims/base.input")
+    assert get_data_loc_stats() == {"hits": 0, "misses": 1}
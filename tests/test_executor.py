@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+from pippin.executor import Executor, LocalPoolExecutor, SlurmExecutor, get_array_indexes, get_directives, get_executors
+from pippin.wall_times import WallTimeHistory
+
+
+class LocalTask:
+    can_run_locally = True
+
+    def __init__(self, name, wall_time=None):
+        self.name = name
+        self.wall_time = wall_time
+
+
+class CreateCov(LocalTask):
+    pass
+
+
+class SNANASimulation(LocalTask):
+    can_run_locally = False
+
+
+def wait_for(executor, match, timeout=10):
+    start = time.time()
+    while executor.get_num_jobs(match, None) and time.time() - start < timeout:
+        time.sleep(0.05)
+    return executor.get_num_jobs(match, None)
+
+
+def test_parse_directives(tmp_path):
+    script = tmp_path / "job.slurm"
+    script.write_text("#!/bin/bash\n#SBATCH --job-name=PIP_TEST\n#SBATCH --array=1-3\n#SBATCH --output=out_%a.log\n#SBATCH -N 1\necho\n")
+    assert get_directives(str(script)) == {"job-name": "PIP_TEST", "array": "1-3", "output": "out_%a.log", "N": "1"}
+    assert get_array_indexes("1-4") == [1, 2, 3, 4]
+    assert get_array_indexes("0,2,5%2") == [0, 2, 5]
+    assert get_array_indexes("1-10:3") == [1, 4, 7, 10]
+
+
+def test_slurm_overrides():
+    assert SlurmExecutor().get_command("job.slurm") == ["sbatch", "job.slurm"]
+    assert SlurmExecutor("gpu", "pi-me").get_command("job.slurm") == ["sbatch", "--partition=gpu", "--account=pi-me", "job.slurm"]
+    assert SlurmExecutor().get_num_jobs("PIP", None) is None
+
+
+def test_local_pool_runs_array_jobs(tmp_path):
+    script = tmp_path / "job.slurm"
+    script.write_text(
+        "#!/bin/bash\n#SBATCH --job-name=PIP_LOCAL\n#SBATCH --array=1-3\n#SBATCH --output=output_%a.log\n"
+        "sleep 0.2\necho $SLURM_JOB_NAME\necho DONE > done_$SLURM_ARRAY_TASK_ID.txt\n"
+    )
+    executor = LocalPoolExecutor(max_workers=2)
+    executor.submit(str(script), str(tmp_path))
+    assert executor.get_num_jobs("LOCAL", None) == 3
+    assert executor.get_num_jobs("OTHER", None) == 0
+
+    assert wait_for(executor, "LOCAL") == 0
+    executor.shutdown()
+    for i in range(1, 4):
+        assert (tmp_path / f"done_{i}.txt").read_text().strip() == "DONE"
+        assert (tmp_path / f"output_{i}.log").read_text().strip() == "PIP_LOCAL"
+
+
+def test_get_executors_by_type_and_wall_time(tmp_path):
+    history = WallTimeHistory(str(tmp_path / "wall_times.json"))
+    quick, slow, sim = LocalTask("QUICK", wall_time=10), LocalTask("SLOW", wall_time=1000), SNANASimulation("SIM", wall_time=1)
+    for t in [quick, slow, sim]:
+        history.record(t)
+    history.save()
+    history = WallTimeHistory(str(tmp_path / "wall_times.json"))
+    cov, new = CreateCov("COV"), LocalTask("NEW")
+    tasks = [quick, slow, sim, cov, new]
+
+    executors, local = get_executors(tasks, {"EXECUTOR": {"local_tasks": ["CreateCov", "SNANASimulation"], "local_max_wall_time": 60}}, history)
+    assert [executors[t] is local for t in tasks] == [True, False, False, True, False]
+    assert local.max_workers == 4
+    local.shutdown()
+
+    # Nothing runs locally by default
+    executors, local = get_executors(tasks, {}, history)
+    assert local is None
+    assert all(isinstance(e, SlurmExecutor) for e in executors.values())
+
+
+def test_executor_is_abstract():
+    with pytest.raises(TypeError):
+        Executor()
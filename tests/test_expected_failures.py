@@ -65,3 +65,8 @@ def test_classify_trained_model_not_found_snirf():
 def test_classify_trained_model_not_found_snn():
     with pytest.raises(ValueError):
         get_manager(yaml="tests/config_files/fail_classify6.yml", check=True)
+
+
+def test_classify_nn_predict_with_training_options():
+    with pytest.raises(ValueError):
+        get_manager(yaml="tests/config_files/fail_classify7.yml", check=True)
@@ -0,0 +1,52 @@
+import os
+
+from pippin import file_cache
+
+
+def test_read_file_reuses_contents_until_changed(tmp_path):
+    path = str(tmp_path / "base.input")
+    with open(path, "w") as f:
+        f.write("GENTYPE: 1\nGENMODEL: SALT2\n")
+    file_cache.clear()
+    assert file_cache.prefetch_files([path, str(tmp_path / "missing.input"), None]) == 1
+    assert file_cache.read_lines(path) == ["GENTYPE: 1", "GENMODEL: SALT2"]
+
+    lines = file_cache.read_lines(path)
+    lines.append("modified by a caller")
+    assert len(file_cache.read_lines(path)) == 2
+
+    stat = os.stat(path)
+    with open(path, "w") as f:
+        f.write("GENTYPE: 20\n")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert file_cache.read_lines(path) == ["GENTYPE: 20"]
+
+
+def test_prefetch_only_small_text_inputs(tmp_path, monkeypatch):
+    text, model = str(tmp_path / "base.input"), str(tmp_path / "model.pt")
+    big = str(tmp_path / "huge.txt")
+    with open(text, "w") as f:
+        f.write("GENTYPE: 1\n")
+    with open(model, "wb") as f:
+        f.write(b"\xff\xfe\x00binary")
+    with open(big, "w") as f:
+        f.write("x" * 2000)
+    monkeypatch.setattr(file_cache, "MAX_PREFETCH_SIZE", 1000)
+    file_cache.clear()
+    assert file_cache.prefetch_files([text, model, big]) == 1
+    assert list(file_cache._contents) == [text]
+
+
+def test_cache_evicts_least_recently_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_cache, "MAX_CACHE_SIZE", 250)
+    file_cache.clear()
+    paths = [str(tmp_path / f"{i}.input") for i in range(3)]
+    for path in paths:
+        with open(path, "w") as f:
+            f.write("x" * 100)
+    file_cache.read_file(paths[0])
+    file_cache.read_file(paths[1])
+    file_cache.read_file(paths[0])
+    file_cache.read_file(paths[2])
+    assert list(file_cache._contents) == [paths[0], paths[2]]
+    assert file_cache._total_size == 200
@@ -0,0 +1,118 @@
+import gzip
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pippin.io.fitres import SIDECAR_DIR_VARIABLE, load_fitres, get_sidecar_path, read_fitres, is_fitres_format, combine_fitres
+
+FITRES = """# Some comment
+VARNAMES: CID IDSURVEY TYPE zHD x1 c FITPROB
+SN: 1001 10 1 0.1234 0.5 -0.02 0.9
+SN: 1002 10 20 0.2345 -1.25 0.1 0.05
+SN: abc 10 1 0.5 0.0 0.0 1.0e-5
+"""
+
+
+@pytest.fixture(autouse=True)
+def sidecar_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv(SIDECAR_DIR_VARIABLE, str(tmp_path / "sidecars"))
+
+
+def write_fitres(path, content=FITRES):
+    with open(path, "w") as f:
+        f.write(content)
+    return str(path)
+
+
+def test_matches_text_parsing(tmp_path):
+    path = write_fitres(tmp_path / "FITOPT000.FITRES")
+    expected = pd.read_csv(path, sep=r"\s+", comment="#")
+
+    pd.testing.assert_frame_equal(load_fitres(path), expected)
+    assert os.path.exists(get_sidecar_path(path))
+    assert get_sidecar_path(path).startswith(str(tmp_path / "sidecars"))
+    assert sorted(os.listdir(tmp_path)) == ["FITOPT000.FITRES", "sidecars"]
+    pd.testing.assert_frame_equal(load_fitres(path), expected)
+    pd.testing.assert_frame_equal(load_fitres(path, columns=["CID", "FITPROB"]), expected[["CID", "FITPROB"]])
+
+
+def test_sidecar_invalidated_when_file_changes(tmp_path):
+    path = write_fitres(tmp_path / "FITOPT000.FITRES")
+    load_fitres(path)
+    write_fitres(path, FITRES.replace("0.9", "0.8"))
+    os.utime(path, ns=(0, 0))
+    assert load_fitres(path, columns=["FITPROB"])["FITPROB"].iloc[0] == 0.8
+
+
+def test_missing_columns(tmp_path):
+    path = write_fitres(tmp_path / "FITOPT000.FITRES")
+    for _ in range(2):  # Once parsing the text, once from the sidecar
+        with pytest.raises(ValueError):
+            load_fitres(path, columns=["CID", "PROB_MISSING"])
+
+
+def test_unwritable_directory_still_loads(tmp_path, monkeypatch):
+    path = write_fitres(tmp_path / "FITOPT000.FITRES")
+    def read_only(*args, **kwargs):
+        raise PermissionError("Read only filesystem")
+
+    monkeypatch.setattr("pippin.io.fitres.np.savez", read_only)
+    assert load_fitres(path).shape == (3, 8)
+    assert not os.path.exists(get_sidecar_path(path))
+
+
+def test_read_fitres_options(tmp_path):
+    path = write_fitres(tmp_path / "FITOPT000.FITRES")
+
+    df = read_fitres(path, columns=["CID", "x1"], dtype={"CID": str}, float32=True)
+    assert list(df.columns) == ["CID", "x1"]
+    assert list(df["CID"]) == ["1001", "1002", "abc"]
+    assert df["x1"].dtype == np.float32
+
+    chunks = list(read_fitres(path, columns=["zHD"], chunksize=2))
+    assert [len(c) for c in chunks] == [2, 1]
+    assert pd.concat(chunks)["zHD"].tolist() == [0.1234, 0.2345, 0.5]
+
+
+def test_read_gzipped(tmp_path):
+    path = str(tmp_path / "FITOPT000.FITRES.gz")
+    with gzip.open(path, "wt") as f:
+        f.write(FITRES)
+    assert is_fitres_format(path)
+    pd.testing.assert_frame_equal(read_fitres(path), pd.read_csv(path, sep=r"\s+", comment="#"))
+
+
+def test_csv_is_not_fitres(tmp_path):
+    path = write_fitres(tmp_path / "predictions.csv", "# VARNAMES: are not used here\nCID,PROB_A\n1,0.5\n")
+    assert not is_fitres_format(path)
+
+
+def test_combine_fitres(tmp_path):
+    fitres = write_fitres(tmp_path / "FITOPT000.FITRES", "# header\nNVAR: 3\nVARNAMES: CID TYPE zHD\nSN: 1001 1 0.12300  # note\nSN: 01002 20 0.2\nSN: 1003 1 0.3\n")
+    key = write_fitres(tmp_path / "merged_0.key", "VARNAMES: CID PROB_A PROB_B\nSN: 1001 0.9000 0.8000\nSN: 1002 0.1000 0.2000\n")
+    output = str(tmp_path / "out.FITRES")
+
+    assert combine_fitres(fitres, key, output) == (3, 1)
+    with open(output) as f:
+        lines = f.read().splitlines()
+    assert lines == [
+        "# header",
+        "NVAR: 5",
+        "VARNAMES: CID TYPE zHD PROB_A PROB_B",
+        "SN: 1001 1 0.12300 0.9000 0.8000  # note",
+        "SN: 01002 20 0.2 0.1000 0.2000",
+        "SN: 1003 1 0.3 0 0",
+    ]
+    df = read_fitres(output)
+    assert list(df.columns) == ["VARNAMES:", "CID", "TYPE", "zHD", "PROB_A", "PROB_B"]
+
+
+def test_combine_fitres_rejects_existing_columns(tmp_path):
+    fitres = write_fitres(tmp_path / "FITOPT000.FITRES")
+    key = write_fitres(tmp_path / "merged_0.key", "VARNAMES: CID FITPROB\nSN: 1001 0.9\n")
+    output = str(tmp_path / "out.FITRES")
+    with pytest.raises(ValueError):
+        combine_fitres(fitres, key, output)
+    assert sorted(os.listdir(tmp_path)) == ["FITOPT000.FITRES", "merged_0.key"]
@@ -0,0 +1,41 @@
+import os
+
+from pippin.config import get_hash
+from pippin.hashing import HashMemo, InMemoryFile, get_hash_of_files, stream_hash
+
+
+def write(path, content):
+    with open(path, "w", newline="") as f:
+        f.write(content)
+    return str(path)
+
+
+def test_stream_hash_matches_concatenated_string(tmp_path):
+    a = write(tmp_path / "a.input", "GENVERSION: TEST\r\nNGEN: 10\r\n")
+    b = write(tmp_path / "b.input", "SOLID_ANGLE: 1\rZRANGE: 0.1 1.0 é\n")
+    expected = ""
+    for path in [a, b]:
+        with open(path, "r") as f:
+            expected += f.read()
+    assert stream_hash([a, b], suffix="dep1 dep2", chunk_size=7) == get_hash(expected + "dep1 dep2")
+
+
+def test_in_memory_files_hash_like_written_files(tmp_path):
+    content = "GENVERSION: TEST\r\nINPUT_FILE_INCLUDE: include.input\n"
+    path = write(tmp_path / "a.input", content)
+    assert stream_hash([InMemoryFile("a.input", content)]) == stream_hash([path])
+
+
+def test_memo_skips_unchanged_files(tmp_path):
+    memo = HashMemo(str(tmp_path / "memo.json"))
+    path = write(tmp_path / "a.input", "NGEN: 10\n")
+    first = get_hash_of_files([path], suffix="x", memo=memo)
+
+    # Same size and modification time, so the memo is trusted without reading the file
+    stat = os.stat(path)
+    write(path, "NGEN: 99\n")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert get_hash_of_files([path], suffix="x", memo=HashMemo(memo.path)) == first
+
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert get_hash_of_files([path], suffix="x", memo=memo) == stream_hash([path], suffix="x") != first
@@ -0,0 +1,114 @@
+import os
+import time
+
+from pippin.io.fitres import SIDECAR_DIR_VARIABLE, load_fitres
+from pippin.merge import Merger
+from pippin.task import Task
+from tests.utils import get_manager
+
+
+def get_merger(tmp_path, options):
+    manager = get_manager(yaml="tests/config_files/valid_merge.yml", check=True)
+    merger = [t for t in manager.tasks if isinstance(t, Merger)][0]
+    lcfit, agg = merger.dependencies
+
+    lc_output_dir = tmp_path / "lcfit" / "output"
+    fitres_dir = lc_output_dir / "PIP_SIM_0001"
+    fitres_dir.mkdir(parents=True)
+    for f in ["MERGE.LOG", "FITOPT.README"]:
+        (lc_output_dir / f).write_text("")
+    for fitopt in ["FITOPT000.FITRES", "FITOPT001.FITRES"]:
+        (fitres_dir / fitopt).write_text("VARNAMES: CID zHD\nSN: 1 0.1\nSN: 2 0.2\n")
+    (tmp_path / "merged_0.key").write_text("VARNAMES: CID PROB_A\nSN: 1 0.9000\n")
+
+    lcfit.output["fitres_dirs"] = [str(fitres_dir)]
+    lcfit.output["lc_output_dir"] = str(lc_output_dir)
+    agg.output["merge_key_filename"] = [[str(tmp_path / "merged_0.key")]]
+    for d in [lcfit, agg]:
+        d.get_old_hash = lambda quiet=False, required=False, name=d.name: name
+    return Merger("MERGE", str(tmp_path / "merge"), [lcfit, agg], options)
+
+
+def wait_for(task, timeout=60):
+    start = time.time()
+    while time.time() - start < timeout:
+        result = task.check_completion(None)
+        if result in [Task.FINISHED_SUCCESS, Task.FINISHED_FAILURE]:
+            return result
+        time.sleep(0.05)
+    raise TimeoutError(f"{task} did not finish")
+
+
+def test_python_merge_runs_in_background(tmp_path):
+    merger = get_merger(tmp_path, {"COMBINE": "python", "MAX_WORKERS": 2})
+
+    assert merger.run(False)
+    assert merger.get_old_hash(quiet=True) is None
+    new_hash = merger.new_hash
+    assert wait_for(merger) == Task.FINISHED_SUCCESS
+    assert merger.get_old_hash(quiet=True) == new_hash
+    for fitopt in ["FITOPT000.FITRES", "FITOPT001.FITRES"]:
+        with open(os.path.join(merger.fitres_outdirs[0], fitopt)) as f:
+            assert f.read() == "VARNAMES: CID zHD PROB_A\nSN: 1 0.1 0.9000\nSN: 2 0.2 0\n"
+    for f in ["MERGE.LOG", "FITOPT.README"]:
+        assert os.stat(os.path.join(merger.suboutput_dir, f)).st_nlink == 1
+
+
+def test_background_failure_is_reported(tmp_path):
+    merger = get_merger(tmp_path, {"COMBINE": "python"})
+    os.remove(tmp_path / "merged_0.key")
+
+    assert merger.run(False)
+    assert wait_for(merger) == Task.FINISHED_FAILURE
+    assert merger.get_old_hash(quiet=True) is None
+
+
+def test_rerun_only_recombines_changed_files(tmp_path):
+    merger = get_merger(tmp_path, {"COMBINE": "python"})
+    assert merger.run(False)
+    assert wait_for(merger) == Task.FINISHED_SUCCESS
+    outputs = [os.path.join(merger.fitres_outdirs[0], f) for f in ["FITOPT000.FITRES", "FITOPT001.FITRES"]]
+    for output in outputs:
+        os.utime(output, ns=(1, 1))
+
+    lcfit = merger.dependencies[0]
+    fitres_dir = lcfit.output["fitres_dirs"][0]
+    with open(os.path.join(fitres_dir, "FITOPT001.FITRES"), "w") as f:
+        f.write("VARNAMES: CID zHD\nSN: 1 0.5\n")
+    lcfit.get_old_hash = lambda quiet=False, required=False: "rerun"
+
+    assert merger.run(False)
+    assert wait_for(merger) == Task.FINISHED_SUCCESS
+    assert os.stat(outputs[0]).st_mtime_ns == 1
+    with open(outputs[1]) as f:
+        assert f.read() == "VARNAMES: CID zHD PROB_A\nSN: 1 0.5 0.9000\n"
+
+
+def test_changed_key_file_recombines_version(tmp_path):
+    merger = get_merger(tmp_path, {"COMBINE": "python"})
+    assert merger.run(False)
+    assert wait_for(merger) == Task.FINISHED_SUCCESS
+
+    (tmp_path / "merged_0.key").write_text("VARNAMES: CID PROB_A\nSN: 2 0.1000\n")
+    merger.dependencies[1].get_old_hash = lambda quiet=False, required=False: "rerun"
+    assert merger.run(False)
+    assert wait_for(merger) == Task.FINISHED_SUCCESS
+    with open(os.path.join(merger.fitres_outdirs[0], "FITOPT000.FITRES")) as f:
+        assert f.read() == "VARNAMES: CID zHD PROB_A\nSN: 1 0.1 0\nSN: 2 0.2 0.1000\n"
+
+
+def test_merge_ignores_fitres_cache_and_hidden_files(tmp_path, monkeypatch):
+    monkeypatch.setenv(SIDECAR_DIR_VARIABLE, str(tmp_path / "sidecars"))
+    merger = get_merger(tmp_path, {"COMBINE": "python"})
+    fitres_dir = merger.dependencies[0].output["fitres_dirs"][0]
+    for fitopt in ["FITOPT000.FITRES", "FITOPT001.FITRES"]:
+        load_fitres(os.path.join(fitres_dir, fitopt))
+    # Left behind by older versions, which kept the binary copies next to the FITRES files
+    with open(os.path.join(fitres_dir, ".FITOPT000.FITRES.pippin.npz"), "wb") as f:
+        f.write(b"PK")
+    with open(os.path.join(fitres_dir, "FITRES_SUMMARY.LOG"), "w") as f:
+        f.write("Not a table\n")
+
+    assert merger.run(False)
+    assert wait_for(merger) == Task.FINISHED_SUCCESS
+    assert sorted(os.listdir(merger.fitres_outdirs[0])) == ["FITOPT000.FITRES", "FITOPT001.FITRES"]
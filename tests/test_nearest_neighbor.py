@@ -0,0 +1,187 @@
+import argparse
+import json
+import mmap
+import os
+import pickle
+import shlex
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+import sklearn
+from sklearn.neighbors import KNeighborsClassifier, NearestNeighbors
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from pippin.classifiers import nearest_neighbor_code
+from pippin.classifiers.approx_knn import ApproxKNeighborsClassifier
+from pippin.classifiers.nearest_neighbor_python import NearestNeighborPyClassifier
+from pippin.config import get_pythonpath_export
+from tests.utils import get_manager
+
+
+def write_fitres(path, num, seed):
+    rng = np.random.default_rng(seed)
+    types = rng.choice([1, 20], num)
+    x1 = rng.normal(0, 1, num) + (types == 1)
+    c = rng.normal(0, 0.1, num)
+    lines = ["VARNAMES: CID TYPE x1 c"] + [f"SN: {i} {t} {a:0.4f} {b:0.4f}" for i, (t, a, b) in enumerate(zip(types, x1, c))]
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def get_args(fitres_files, **kwargs):
+    args = dict(predict=False, model="model", model_version=None, done_file="done.txt", features=["x1", "c"], types=[1], output=["predictions.csv"])
+    args.update(chunk_size=100000, name="PROB_NN", n_jobs=1, algorithm="kd_tree", n_neighbors=50, n_trees=10, float32=False)
+    args.update(kwargs)
+    return argparse.Namespace(fitres_file=fitres_files, **args)
+
+
+def test_predict_many_files_in_chunks(tmp_path):
+    model = str(tmp_path / "model")
+    nearest_neighbor_code.train(get_args([write_fitres(tmp_path / "train.FITRES", 1000, 0)], model=model))
+
+    files = [write_fitres(tmp_path / f"FITOPT000_{i}.FITRES", 300, i + 1) for i in range(3)]
+    outputs = [str(tmp_path / f"predictions_{i}.csv") for i in range(3)]
+    nearest_neighbor_code.predict(get_args(files, predict=True, model=model, output=outputs, chunk_size=64))
+    single = str(tmp_path / "single.csv")
+    nearest_neighbor_code.predict(get_args(files[1:2], predict=True, model=model, output=[single]))
+
+    for output in outputs:
+        df = pd.read_csv(output)
+        assert list(df["SNID"]) == list(range(300))
+        assert df["PROB_NN"].between(0, 1).all()
+    assert pd.read_csv(outputs[1]).equals(pd.read_csv(single))
+
+
+def test_one_predict_job_covers_all_versions():
+    tasks = get_manager(yaml="tests/config_files/valid_classify_nn_batched.yml", check=True).tasks
+    predict = [t for t in tasks if isinstance(t, NearestNeighborPyClassifier) and t.name == "NNPREDICT"]
+
+    assert len(predict) == 1
+    assert predict[0].indexes == [0, 1, 2]
+    assert len(set(predict[0].fitres_files)) == 3
+    assert [os.path.basename(f) for f in predict[0].output["predictions_filenames"]] == [
+        "predictions_0001.csv",
+        "predictions_0002.csv",
+        "predictions_0003.csv",
+    ]
+
+
+def test_algorithms_and_parallel_chunks(tmp_path):
+    train_file = write_fitres(tmp_path / "train.FITRES", 1000, 0)
+    fitres_file = write_fitres(tmp_path / "FITOPT000.FITRES", 500, 1)
+    results = {}
+    for algorithm in nearest_neighbor_code.ALGORITHMS:
+        model = str(tmp_path / algorithm)
+        output = str(tmp_path / f"{algorithm}.csv")
+        nearest_neighbor_code.train(get_args([train_file], model=model, algorithm=algorithm, float32=algorithm == "approx"))
+        nearest_neighbor_code.predict(get_args([fitres_file], predict=True, model=model, output=[output], chunk_size=50, n_jobs=4))
+        results[algorithm] = pd.read_csv(output)["PROB_NN"]
+    assert results["kd_tree"].equals(results["ball_tree"])
+    assert np.abs(results["brute"] - results["kd_tree"]).max() < 0.05
+    assert np.abs(results["approx"] - results["kd_tree"]).mean() < 0.05
+
+
+def test_approx_knn_is_exact_with_one_leaf():
+    rng = np.random.default_rng(0)
+    X, Q = rng.normal(size=(300, 4)), rng.normal(size=(50, 4))
+    approx = ApproxKNeighborsClassifier(n_neighbors=7, n_trees=2, leaf_size=300).fit(X, X[:, 0] > 0)
+    _, exact = NearestNeighbors(n_neighbors=7).fit(X).kneighbors(Q)
+    assert np.array_equal(np.sort(approx.kneighbors(Q), axis=1), np.sort(exact, axis=1))
+
+    # Small leaves still find most of the true neighbours
+    approx = ApproxKNeighborsClassifier(n_neighbors=7, n_trees=10, leaf_size=16).fit(X, X[:, 0] > 0)
+    found = np.mean([len(set(a) & set(e)) / 7 for a, e in zip(approx.kneighbors(Q), exact)])
+    assert found > 0.8
+
+
+def test_model_artifact_matches_trained_pipeline(tmp_path):
+    rng = np.random.default_rng(0)
+    X, Q = rng.normal(size=(500, 3)), rng.normal(size=(100, 3))
+    y = X[:, 0] + rng.normal(0, 0.5, 500) > 0
+    for algorithm in nearest_neighbor_code.ALGORITHMS:
+        args = get_args([], algorithm=algorithm, n_neighbors=10)
+        clf = Pipeline([("scaler", StandardScaler()), ("knn", nearest_neighbor_code.get_neighbours_classifier(algorithm, 10))]).fit(X, y)
+        path = str(tmp_path / algorithm)
+        nearest_neighbor_code.save_model(path, clf, args, version="abc")
+
+        assert os.path.exists(os.path.join(path, "model.json")) and os.path.exists(os.path.join(path, "X.npy"))
+        loaded = nearest_neighbor_code.load_model(path, version="abc")
+        assert np.array_equal(loaded.predict_proba(Q), clf.predict_proba(Q))
+        if algorithm in ["kd_tree", "ball_tree"]:
+            # The saved tree is used as it is, rather than rebuilt from the training points
+            tree = loaded.named_steps["knn"]._tree
+            assert isinstance(tree.get_arrays()[1].base, mmap.mmap)
+            assert np.shares_memory(tree.get_arrays()[0], loaded.named_steps["knn"]._fit_X)
+            assert np.array_equal(np.asarray(tree.idx_array), np.asarray(clf.named_steps["knn"]._tree.idx_array))
+        with pytest.raises(ValueError):
+            nearest_neighbor_code.load_model(path, version="def")
+
+
+def test_model_from_other_sklearn_version_is_refitted(tmp_path):
+    rng = np.random.default_rng(0)
+    X, Q = rng.normal(size=(500, 3)), rng.normal(size=(100, 3))
+    y = X[:, 0] + rng.normal(0, 0.5, 500) > 0
+    for algorithm in ["kd_tree", "ball_tree", "brute"]:
+        clf = Pipeline([("scaler", StandardScaler()), ("knn", nearest_neighbor_code.get_neighbours_classifier(algorithm, 10))]).fit(X, y)
+        path = str(tmp_path / algorithm)
+        nearest_neighbor_code.save_model(path, clf, get_args([], algorithm=algorithm, n_neighbors=10))
+        with open(os.path.join(path, "model.json")) as f:
+            meta = json.load(f)
+        assert meta["sklearn_version"] == sklearn.__version__
+        meta["sklearn_version"] = "0.1"
+        with open(os.path.join(path, "model.json"), "w") as f:
+            json.dump(meta, f)
+
+        loaded = nearest_neighbor_code.load_model(path)
+        assert np.array_equal(loaded.predict_proba(Q), clf.predict_proba(Q))
+        if algorithm != "brute":
+            assert not isinstance(loaded.named_steps["knn"]._tree.get_arrays()[1].base, mmap.mmap)
+
+
+def test_pickled_models_still_load(tmp_path):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(100, 2))
+    clf = Pipeline([("scaler", StandardScaler()), ("knn", KNeighborsClassifier(n_neighbors=5))]).fit(X, X[:, 0] > 0)
+    path = tmp_path / "model.pkl"
+    with open(path, "wb") as f:
+        pickle.dump(clf, f)
+    assert np.array_equal(nearest_neighbor_code.load_model(str(path)).predict_proba(X), clf.predict_proba(X))
+
+
+def test_script_imports_pippin_through_pythonpath(tmp_path):
+    # Run like the job script does, from a directory pippin can't otherwise be imported from
+    env = {k: v for k, v in os.environ.items() if k != "PYTHONPATH"}
+    script = os.path.abspath(nearest_neighbor_code.__file__)
+    command = f"{get_pythonpath_export()}\ncd {tmp_path}\n{sys.executable} {script} --help"
+    result = subprocess.run(["bash", "-c", command], env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert "--algorithm" in result.stdout
+
+
+def test_job_command_lines_parse(monkeypatch):
+    tasks = get_manager(yaml="tests/config_files/valid_classify_nn_batched.yml", check=True).tasks
+    train, predict = [t for t in tasks if isinstance(t, NearestNeighborPyClassifier)]
+    commands = {}
+    for t in [train, predict]:
+        for d in t.dependencies:
+            d.get_old_hash = lambda quiet=False, required=False, name=d.name: name
+        monkeypatch.setattr(t, "classify", lambda force_refresh, command, t=t: commands.setdefault(t.name, command))
+    train.train(False)
+    predict.predict(False)
+
+    # Train jobs get --model_version added in front of the command in classify
+    for t, command, fitres_files, outputs in [
+        (train, f"--model_version abc {commands['NNTRAIN']}", [train.fitres_file], [train.predictions_filename]),
+        (predict, commands["NNPREDICT"], predict.fitres_files, predict.predictions_filenames),
+    ]:
+        monkeypatch.setattr(sys, "argv", ["nearest_neighbor_code.py"] + shlex.split(command))
+        args = nearest_neighbor_code.get_args()
+        assert args.fitres_file == fitres_files
+        assert args.output == outputs
+        assert args.predict == (t is predict)
+        assert args.model == train.output["model_filename"]
+    assert args.model_version == "NNTRAIN"
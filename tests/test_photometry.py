@@ -0,0 +1,49 @@
+import os
+
+from astropy.table import Table
+
+from pippin import photometry
+from pippin.photometry import get_header_index, INDEX_FILENAME
+
+
+def write_head(path, snids, sntypes):
+    Table({"SNID": snids, "SNTYPE": sntypes, "REDSHIFT_FINAL": [0.1] * len(snids)}).write(str(path), overwrite=True)
+
+
+def test_index_from_head_files(tmp_path):
+    write_head(tmp_path / "SIM_0001_HEAD.FITS", [" 1 ", "2"], [1, 20])
+    write_head(tmp_path / "SIM_0002_HEAD.FITS", ["3", "2"], [101, 1])
+    photometry.clear()
+
+    index = get_header_index(str(tmp_path))
+    assert list(index["SNID"]) == ["1", "2", "3"]
+    assert list(index["SNTYPE"]) == [1, 20, 101]
+    assert os.path.exists(tmp_path / INDEX_FILENAME)
+
+
+def test_index_file_reused_and_rebuilt(tmp_path, monkeypatch):
+    head = tmp_path / "SIM_HEAD.FITS"
+    write_head(head, ["1", "2"], [1, 20])
+    photometry.clear()
+    get_header_index(str(tmp_path))
+
+    # A new process (or cleared memory) should load the saved index instead of opening the HEAD files
+    photometry.clear()
+    monkeypatch.setattr(photometry, "read_header_file", lambda path: 1 / 0)
+    assert list(get_header_index(str(tmp_path))["SNID"]) == ["1", "2"]
+    monkeypatch.undo()
+
+    write_head(head, ["1", "2", "5"], [1, 20, 1])
+    os.utime(head, ns=(0, 0))
+    assert list(get_header_index(str(tmp_path))["SNID"]) == ["1", "2", "5"]
+
+
+def test_index_from_text_files(tmp_path):
+    (tmp_path / "DES_000123.DAT").write_text("SURVEY: DES\nSNID: 123\nSNTYPE: 1  # Ia\nNOBS: 1\nOBS: 56000 g 1 1\n")
+    (tmp_path / "DES_000124.DAT").write_text("SNID: 124\nNOBS: 0\nSNTYPE: 20\n")
+    (tmp_path / "DES.LIST").write_text("DES_000123.DAT\nDES_000124.DAT\n")
+    photometry.clear()
+
+    index = get_header_index(str(tmp_path))
+    assert list(index["SNID"]) == ["123", "124"]
+    assert list(index["SNTYPE"]) == [1, photometry.UNKNOWN_TYPE]
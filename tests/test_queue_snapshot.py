@@ -0,0 +1,88 @@
+import os
+import stat
+
+from pippin.queue_snapshot import QueueMonitor, QueueSnapshot
+
+
+def make_fake_squeue(tmp_path, lines):
+    """ A stand-in for squeue that prints the given lines and records how many times it was called """
+    calls = tmp_path / "calls.txt"
+    script = tmp_path / "squeue"
+    output = "\n".join(lines)
+    script.write_text(f"#!/bin/bash\necho x >> {calls}\ncat <<'END'\n{output}\nEND\n")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    return str(script), calls
+
+
+def num_calls(calls):
+    if not os.path.exists(calls):
+        return 0
+    return len(calls.read_text().splitlines())
+
+
+def test_snapshot_counts_jobs_by_prefix_and_substring():
+    snapshot = QueueSnapshot(
+        ["1|broadwl|(null)|PIP_TEST_SIM_0001", "2|broadwl|(null)|PIP_TEST_SIM_0002", "3|gpu2|gpu:1|PIP_TEST_SNN", "4|broadwl|(null)|SPLIT_PIP_TEST_FIT"]
+    )
+    assert snapshot.count("PIP_TEST_SIM") == 2
+    assert snapshot.count("PIP_TEST_SNN") == 1
+    assert snapshot.count("PIP_TEST_FIT") == 1
+    assert snapshot.count("PIP_OTHER") == 0
+    assert snapshot.num_jobs == len(snapshot) == 4
+    assert snapshot.num_gpu_jobs == 1
+    assert snapshot.num_cpu_jobs == 3
+
+
+def test_snapshot_counts_prefix_and_substring_matches_together():
+    snapshot = QueueSnapshot(["PIP_A_0", "PIP_A_1", "SPLIT_PIP_A_2", "PIP_A_PIP_A", "PIP_B"])
+    assert snapshot.count("PIP_A") == 4
+    assert snapshot.count("PIP_B") == 1
+    assert snapshot.count("A_") == 4
+
+
+def test_counts_are_worked_out_once_per_queue():
+    snapshot = QueueSnapshot(["PIP_A_0", "PIP_A_0", "SPLIT_PIP_A_1"])
+    assert snapshot.count("PIP_A") == 3
+    snapshot._name_counts = None  # Any further scan would now fail
+    assert snapshot.count("PIP_A") == 3
+
+    # The next snapshot of an unchanged queue doesn't scan either
+    previous = QueueSnapshot(["PIP_A_0", "PIP_A_0", "SPLIT_PIP_A_1"])
+    previous.count("PIP_A")
+    same = QueueSnapshot(["PIP_A_0", "SPLIT_PIP_A_1", "PIP_A_0"])
+    same.reuse_counts(previous)
+    same._name_counts = None
+    assert same.count("PIP_A") == 3
+
+    changed = QueueSnapshot(["PIP_A_0"])
+    changed.reuse_counts(previous)
+    assert changed.count("PIP_A") == 1
+
+
+def test_snapshot_accepts_plain_job_names():
+    snapshot = QueueSnapshot(["PIP_A_0", "PIP_A_1", ""])
+    assert snapshot.count("PIP_A") == 2
+    assert snapshot.num_cpu_jobs == 2
+    assert snapshot.num_gpu_jobs == 0
+
+
+def test_monitor_reuses_snapshot_within_ttl(tmp_path):
+    command, calls = make_fake_squeue(tmp_path, ["1|broadwl|(null)|PIP_A_0", "2|gpu2|gpu:1|PIP_B"])
+    monitor = QueueMonitor(command=command, ttl=1000)
+    first = monitor.get()
+    second = monitor.get()
+    assert first is second
+    assert num_calls(calls) == 1
+    assert first.count("PIP_A") == 1
+    assert first.num_gpu_jobs == 1
+
+    monitor.get(force=True)
+    assert num_calls(calls) == 2
+
+
+def test_monitor_refreshes_after_ttl(tmp_path):
+    command, calls = make_fake_squeue(tmp_path, ["1|broadwl|(null)|PIP_A_0"])
+    monitor = QueueMonitor(command=command, ttl=0)
+    monitor.get()
+    monitor.get()
+    assert num_calls(calls) == 2
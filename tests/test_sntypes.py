@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+from pippin.sntypes import TypeLookup
+
+
+def test_labels_match_types_dict():
+    lookup = TypeLookup({"IA": [1, 101], "NONIA": [20, 120]})
+    labels = lookup.label(pd.Series([1, 101.0, 20, 120, 99, np.nan]))
+    assert np.array_equal(labels, [1.0, 1.0, 0.0, 0.0, np.nan, np.nan], equal_nan=True)
+    assert lookup.has_ia() and lookup.has_nonia()
+
+
+def test_string_types_are_converted():
+    lookup = TypeLookup({"IA": [1], "NONIA": [20]})
+    labels = lookup.label(np.array(["1", " 20", "junk"], dtype=object))
+    assert np.array_equal(labels, [1.0, 0.0, np.nan], equal_nan=True)
+
+
+def test_missing_classes():
+    lookup = TypeLookup({"IA": [1]})
+    assert not lookup.has_nonia()
+    assert np.array_equal(lookup.label([1, 2]), [1.0, np.nan], equal_nan=True)
@@ -0,0 +1,68 @@
+import os
+
+from pippin.state import StateStore
+from pippin.task import Task
+
+
+class DummyTask(Task):
+    def _run(self, force_refresh):
+        return True
+
+    def _check_completion(self, squeue):
+        return Task.FINISHED_SUCCESS
+
+    @staticmethod
+    def get_tasks(config, prior_tasks, base_output_dir, stage_number, prefix, global_config):
+        return []
+
+
+def make_task(tmp_path, name):
+    output_dir = str(tmp_path / name)
+    os.makedirs(output_dir)
+    return DummyTask(name, output_dir)
+
+
+def test_hashes_stored_in_database(tmp_path):
+    task = make_task(tmp_path, "A")
+    task.state_store = StateStore(str(tmp_path))
+    assert task.get_old_hash() is None
+    task.save_new_hash("abc")
+    task.state_store.close()
+    assert not os.path.exists(task.hash_file)
+
+    task.state_store = StateStore(str(tmp_path))
+    assert task.get_old_hash() == "abc"
+    task.clear_hash()
+    assert task.get_old_hash() is None
+
+
+def test_completion_recorded(tmp_path):
+    task = make_task(tmp_path, "A")
+    task.state_store = StateStore(str(tmp_path))
+    task.save_new_hash("abc")
+    with open(task.done_file, "w") as f:
+        f.write("SUCCESS")
+    assert task.check_completion(None) == Task.FINISHED_SUCCESS
+    assert task.state_store.get_status(task) == StateStore.SUCCESS
+    assert task.wall_time is not None
+    task.state_store.close()
+
+    store = StateStore(str(tmp_path))
+    assert store.get_status(task) == StateStore.SUCCESS
+
+
+def test_import_existing_hash_files(tmp_path):
+    task = make_task(tmp_path, "A")
+    other = make_task(tmp_path, "B")
+    task.save_new_hash("abc")
+
+    store = StateStore(str(tmp_path))
+    assert store.is_new
+    store.import_tasks([task, other])
+    task.state_store = store
+    other.state_store = store
+    assert task.get_old_hash() == "abc"
+    assert store.get_status(task) == StateStore.IMPORTED
+    assert other.get_old_hash() is None
+    store.close()
+    assert not StateStore(str(tmp_path)).is_new
@@ -0,0 +1,128 @@
+import os
+
+from pippin.cache import TaskCache
+from pippin.task import Task
+
+
+class DummyTask(Task):
+    cacheable = True
+
+    def get_cache_values(self):
+        values = super().get_cache_values()
+        values["$PIPPIN_GENVERSION"] = f"PIP_{self.name}"
+        return values
+
+    def _run(self, force_refresh):
+        return True
+
+    def _check_completion(self, squeue):
+        return Task.FINISHED_SUCCESS
+
+    @staticmethod
+    def get_tasks(config, prior_tasks, base_output_dir, stage_number, prefix, global_config):
+        return []
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def test_store_and_restore(tmp_path):
+    cache = TaskCache(str(tmp_path / "cache"))
+    output_dir, extra_dir = str(tmp_path / "run1" / "SIM"), str(tmp_path / "sims" / "SIM")
+    write(os.path.join(output_dir, "FINISHED.DONE"), "SUCCESS")
+    write(os.path.join(output_dir, "hash.txt"), "abc")
+    write(os.path.join(extra_dir, "LC", "photometry.fits"), "data")
+    cache.store("abcdef", "SIM", "DummyTask", output_dir, [extra_dir])
+    assert len(cache.list_entries()) == 1
+
+    new_output, new_extra = str(tmp_path / "run2" / "SIM"), str(tmp_path / "sims2" / "SIM")
+    write(os.path.join(new_output, "stale.txt"), "old")
+    assert cache.restore("abcdef", new_output, [new_extra])
+    assert os.path.exists(os.path.join(new_output, "FINISHED.DONE"))
+    assert not os.path.exists(os.path.join(new_output, "stale.txt"))
+    assert not os.path.exists(os.path.join(new_output, "hash.txt"))
+    with open(os.path.join(new_extra, "LC", "photometry.fits")) as f:
+        assert f.read() == "data"
+    assert cache.get_meta("abcdef")["num_uses"] == 1
+    assert not cache.restore("other", new_output, [new_extra])
+
+
+def test_restored_files_are_read_only_links(tmp_path, monkeypatch):
+    monkeypatch.setattr("pippin.cache.fcntl", None)  # As on a filesystem without reflinks
+    cache = TaskCache(str(tmp_path / "cache"))
+    output_dir = str(tmp_path / "run1" / "SIM")
+    write(os.path.join(output_dir, "out.txt"), "cached")
+    cache.store("abcdef", "SIM", "DummyTask", output_dir)
+
+    new_output = str(tmp_path / "run2" / "SIM")
+    assert cache.restore("abcdef", new_output)
+    original, restored = os.path.join(output_dir, "out.txt"), os.path.join(new_output, "out.txt")
+    entry = os.path.join(cache.get_entry_dir("abcdef"), "output", "out.txt")
+    assert os.stat(original).st_ino == os.stat(restored).st_ino == os.stat(entry).st_ino
+    assert os.stat(restored).st_mode & 0o222 == 0
+
+    # A rerun replaces its outputs rather than changing them, which leaves the cache alone
+    os.remove(restored)
+    write(restored, "changed by run2")
+    with open(entry) as f:
+        assert f.read() == "cached"
+
+
+def test_restore_replaces_genversion(tmp_path):
+    cache = TaskCache(str(tmp_path / "cache"))
+    output_dir, sim_dir = str(tmp_path / "run1" / "PIP_A_SIM"), str(tmp_path / "sims" / "PIP_A_SIM")
+    write(os.path.join(output_dir, "PIP_A_SIM.input"), f"GENVERSION: PIP_A_SIM\nLOGDIR: {output_dir}/LOGS\n")
+    write(os.path.join(sim_dir, "PIP_A_SIM.LIST"), "PIP_A_SIM_HEAD.FITS\n")
+    with open(os.path.join(sim_dir, "PIP_A_SIM_HEAD.FITS"), "wb") as f:
+        f.write(b"PIP_A_SIM\0binary")
+    values = {"$PIPPIN_TASK_OUTPUT": output_dir, "$PIPPIN_GENVERSION": "PIP_A_SIM"}
+    cache.store("abcdef", "SIM", "DummyTask", output_dir, [sim_dir], values)
+
+    new_output, new_sim_dir = str(tmp_path / "run2" / "PIP_B_SIM"), str(tmp_path / "sims" / "PIP_B_SIM")
+    assert cache.restore("abcdef", new_output, [new_sim_dir], {"$PIPPIN_TASK_OUTPUT": new_output, "$PIPPIN_GENVERSION": "PIP_B_SIM"})
+    with open(os.path.join(new_output, "PIP_B_SIM.input")) as f:
+        assert f.read() == f"GENVERSION: PIP_B_SIM\nLOGDIR: {new_output}/LOGS\n"
+    with open(os.path.join(new_sim_dir, "PIP_B_SIM.LIST")) as f:
+        assert f.read() == "PIP_B_SIM_HEAD.FITS\n"
+    with open(os.path.join(new_sim_dir, "PIP_B_SIM_HEAD.FITS"), "rb") as f:
+        assert f.read() == b"PIP_A_SIM\0binary"  # Binary files are linked as they are
+
+
+def test_prune_evicts_least_recently_used(tmp_path):
+    cache = TaskCache(str(tmp_path / "cache"))
+    for key in ["aaaa", "bbbb", "cccc"]:
+        output_dir = str(tmp_path / key)
+        write(os.path.join(output_dir, "out.txt"), "x" * 100)
+        cache.store(key, key, "DummyTask", output_dir)
+    cache.restore("aaaa", str(tmp_path / "restored"))
+    removed = cache.prune(max_size=250)
+    assert [m["key"] for m in removed] == ["bbbb"]
+    assert sorted(m["key"] for m in cache.list_entries()) == ["aaaa", "cccc"]
+
+
+def test_task_restores_from_cache(tmp_path):
+    cache = TaskCache(str(tmp_path / "cache"))
+    first = DummyTask("SIM", str(tmp_path / "run1" / "SIM"))
+    write(first.done_file, "SUCCESS")
+    first.task_cache = cache
+    first.cache_key = first.get_cache_key("some inputs")
+    first.store_in_cache()
+
+    second = DummyTask("SIM", str(tmp_path / "run2" / "SIM"))
+    second.task_cache = cache
+    second.cache_key = second.get_cache_key("some inputs")
+    assert second.cache_key == first.cache_key
+    assert second.restore_from_cache("newhash")
+    assert not second.fresh_run
+    assert second.get_old_hash() == "newhash"
+    assert os.path.exists(second.done_file)
+
+
+def test_cache_key_ignores_genversion(tmp_path):
+    first = DummyTask("A_SIM", str(tmp_path / "A_SIM"))
+    second = DummyTask("B_SIM", str(tmp_path / "B_SIM"))
+    assert first.get_cache_key("GENVERSION: PIP_A_SIM\nNGEN: 10") == second.get_cache_key("GENVERSION: PIP_B_SIM\nNGEN: 10")
+    assert first.get_cache_key("GENVERSION: PIP_A_SIM\nNGEN: 10") != second.get_cache_key("GENVERSION: PIP_B_SIM\nNGEN: 20")
@@ -0,0 +1,69 @@
+from pippin.dag import TaskGraph
+
+
+class FakeTask:
+    def __init__(self, name, dependencies=None, gpu=False):
+        self.name = name
+        self.dependencies = dependencies or []
+        self.gpu = gpu
+        self.num_jobs = 1
+
+
+def build():
+    sim = FakeTask("sim")
+    other_sim = FakeTask("other_sim")
+    fit = FakeTask("fit", [sim])
+    classifier = FakeTask("classifier", [fit])
+    agg = FakeTask("agg", [fit, classifier])
+    return sim, other_sim, fit, classifier, agg
+
+
+def test_ready_tasks_ordered_by_critical_path():
+    sim, other_sim, fit, classifier, agg = build()
+    graph = TaskGraph([other_sim, sim, fit, classifier, agg])
+    assert graph.critical_path[sim] == 4
+    assert graph.critical_path[other_sim] == 1
+    assert graph.pop_ready() is sim
+    assert graph.pop_ready() is other_sim
+    assert graph.pop_ready() is None
+
+
+def test_dependents_released_when_all_deps_done():
+    sim, other_sim, fit, classifier, agg = build()
+    graph = TaskGraph([sim, other_sim, fit, classifier, agg])
+    graph.pop_ready()
+    graph.pop_ready()
+    graph.mark_done(sim)
+    assert graph.pop_ready() is fit
+    graph.mark_done(fit)
+    assert graph.pop_ready() is classifier
+    assert graph.pop_ready() is None
+    graph.mark_done(classifier)
+    assert graph.pop_ready() is agg
+    assert len(graph) == 0
+
+
+def test_skipped_tasks_stay_ready():
+    sim, other_sim, fit, classifier, agg = build()
+    graph = TaskGraph([sim, other_sim, fit, classifier, agg])
+    assert graph.pop_ready(lambda t: t is other_sim) is other_sim
+    assert graph.pop_ready() is sim
+
+
+def test_block_removes_everything_downstream():
+    sim, other_sim, fit, classifier, agg = build()
+    graph = TaskGraph([sim, other_sim, fit, classifier, agg])
+    graph.pop_ready()
+    assert graph.block(sim) == [fit, classifier, agg]
+    assert graph.get_waiting() == [other_sim]
+    assert graph.pop_ready() is other_sim
+    assert not graph
+
+
+def test_costs_change_priority():
+    cheap = FakeTask("cheap")
+    cheap_child = FakeTask("cheap_child", [cheap])
+    expensive = FakeTask("expensive")
+    graph = TaskGraph([cheap, cheap_child, expensive], costs={cheap: 1, cheap_child: 1, expensive: 100})
+    assert graph.get_makespan() == 100
+    assert graph.pop_ready() is expensive
@@ -0,0 +1,36 @@
+from pippin.wall_times import WallTimeHistory
+
+
+class SimTask:
+    def __init__(self, name, wall_time=None):
+        self.name = name
+        self.wall_time = wall_time
+
+
+class FitTask(SimTask):
+    pass
+
+
+def test_estimates_fall_back_to_type_then_default(tmp_path):
+    path = str(tmp_path / "wall_times.json")
+    history = WallTimeHistory(path, default=5)
+    assert history.estimate(SimTask("A")) == 5
+
+    history.record(SimTask("A", wall_time=100))
+    history.record(SimTask("B", wall_time=300))
+    history.save()
+
+    history = WallTimeHistory(path, default=5)
+    assert history.has_estimate(SimTask("A"))
+    assert history.estimate(SimTask("A")) == 100
+    assert history.estimate(SimTask("C")) == 200
+    assert history.estimate(FitTask("A")) == 5
+
+
+def test_running_mean(tmp_path):
+    path = str(tmp_path / "wall_times.json")
+    for wall_time in [100, 200]:
+        history = WallTimeHistory(path)
+        history.record(SimTask("A", wall_time=wall_time))
+        history.save()
+    assert WallTimeHistory(path).estimate(SimTask("A")) == 150
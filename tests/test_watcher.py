@@ -0,0 +1,46 @@
+import threading
+import time
+
+import pytest
+
+from pippin.watcher import DoneFileWatcher
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_wait_returns_when_done_file_written(tmp_path, use_inotify):
+    done_file = tmp_path / "task" / "done.txt"
+    watcher = DoneFileWatcher(poll_frequency=0.1, use_inotify=use_inotify)
+    watcher.watch([str(done_file)])
+
+    def write():
+        time.sleep(0.2)
+        done_file.parent.mkdir()
+        done_file.write_text("SUCCESS")
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    start = time.time()
+    changed = watcher.wait(10)
+    thread.join()
+    watcher.close()
+
+    assert changed == [str(done_file)]
+    assert time.time() - start < 5
+
+
+def test_wait_times_out_and_ignores_unwatched(tmp_path):
+    watcher = DoneFileWatcher(poll_frequency=0.05)
+    watcher.watch([str(tmp_path / "done.txt")])
+    watcher.unwatch([str(tmp_path / "done.txt")])
+    (tmp_path / "done.txt").write_text("SUCCESS")
+    assert watcher.wait(0.2) == []
+    watcher.close()
+
+
+def test_supernnova_watches_both_done_files():
+    from pippin.classifiers.supernnova import SuperNNovaClassifier
+
+    class Fake:
+        done_file, done_file2 = "done_task.txt", "done_task2.txt"
+
+    assert SuperNNovaClassifier.get_done_files(Fake()) == ["done_task.txt", "done_task2.txt"]